@@ -0,0 +1,382 @@
+"""
+Columnar in-memory storage for game results.
+
+A game result dict costs a few hundred bytes: six keys, an ISO timestamp
+string and the repeated status/difficulty strings. Here every field lives in
+its own typed array instead: ids, user ids and epoch-microsecond timestamps
+as 64-bit integers, status and difficulty together as one byte, and numeric
+promo codes as integers. Anything that does not fit a column (idempotency
+keys, odd timestamps, extra keys) is kept per row in a sparse side table, so
+``to_json()`` reproduces the original dicts exactly.
+
+The object behaves like the list of dicts it replaces (``len``, indexing,
+iteration, ``append``), so existing callers keep working, while aggregations
+run over the raw arrays with C-level loops (``bytes.count``,
+``bytes.translate`` masks, ``itertools.compress``, ``collections.Counter``)
+instead of per-row dict lookups.
+
+Run ``python columnar.py [rows]`` for a memory and scan-speed comparison with
+the list of dicts.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import compress
+
+STATUSES = ("win", "loss", "draw")
+DIFFICULTIES = ("relaxed", "strategic", "master")
+
+_STATUS_CODES = {status: index for index, status in enumerate(STATUSES)}
+_DIFFICULTY_CODES = {difficulty: index for index, difficulty in enumerate(DIFFICULTIES)}
+_EPOCH = datetime(1970, 1, 1)
+_COLUMN_KEYS = ("id", "user_id", "status", "difficulty", "created_at", "promo_code")
+
+
+def kind_code(status, difficulty):
+    """One byte for a (status, difficulty) pair"""
+    return _STATUS_CODES[status] * len(DIFFICULTIES) + _DIFFICULTY_CODES[difficulty]
+
+
+def _mask_table(predicate):
+    """bytes.translate table mapping each kind code to 1 or 0"""
+    return bytes(
+        1 if code < len(STATUSES) * len(DIFFICULTIES) and predicate(*divmod(code, len(DIFFICULTIES))) else 0
+        for code in range(256)
+    )
+
+
+_WINS = _mask_table(lambda status, difficulty: status == _STATUS_CODES["win"])
+_WINS_BY_DIFFICULTY = {
+    difficulty: _mask_table(lambda status, d, index=index: status == _STATUS_CODES["win"] and d == index)
+    for difficulty, index in _DIFFICULTY_CODES.items()
+}
+
+
+def epoch_us(timestamp):
+    """Microseconds since the epoch for a naive UTC ISO timestamp"""
+    delta = datetime.fromisoformat(timestamp) - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def iso_from_epoch_us(value):
+    """Inverse of epoch_us"""
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+class GameResultColumns:
+    """Game results stored column by column, usable like a list of dicts"""
+
+    def __init__(self):
+        self._ids = array("q")
+        self._user_ids = array("q")
+        self._created = array("q")     # epoch microseconds
+        self._kinds = array("B")       # kind_code(status, difficulty)
+        self._promo_codes = array("q")  # numeric promo code, 0 if none
+        self._extra = {}               # row -> fields that did not fit a column
+
+    @classmethod
+    def from_dicts(cls, game_results):
+        columns = cls()
+        for game_result in game_results:
+            columns.append(game_result)
+        return columns
+
+    @classmethod
+    def from_columns(cls, ids, user_ids, created, kinds, promo_codes, extra):
+        """Wrap existing arrays (as returned by GameResultSnapshot.columns())"""
+        columns = cls()
+        columns._ids = ids
+        columns._user_ids = user_ids
+        columns._created = created
+        columns._kinds = kinds
+        columns._promo_codes = promo_codes
+        columns._extra = extra
+        return columns
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(row) for row in range(*index.indices(len(self._ids)))]
+        if index < 0:
+            index += len(self._ids)
+        if not 0 <= index < len(self._ids):
+            raise IndexError("game result index out of range")
+        return self._row(index)
+
+    def __iter__(self):
+        for row in range(len(self._ids)):
+            yield self._row(row)
+
+    def append(self, game_result):
+        """Add one game result dict"""
+        row = len(self._ids)
+        extra = {key: value for key, value in game_result.items() if key not in _COLUMN_KEYS}
+
+        created_at = game_result["created_at"]
+        try:
+            created = epoch_us(created_at)
+            if iso_from_epoch_us(created) != created_at:
+                raise ValueError(created_at)
+        except (TypeError, ValueError):
+            # Timezone offsets and other formats are kept verbatim
+            created = 0
+            extra["created_at"] = created_at
+
+        promo = 0
+        if "promo_code" in game_result:
+            code = game_result["promo_code"]
+            if isinstance(code, str) and code.isdigit() and code[0] != "0":
+                promo = int(code)
+            else:
+                extra["promo_code"] = code
+
+        kind = kind_code(game_result["status"], game_result["difficulty"])
+
+        self._ids.append(game_result["id"])
+        self._user_ids.append(game_result["user_id"])
+        self._created.append(created)
+        self._kinds.append(kind)
+        self._promo_codes.append(promo)
+        if extra:
+            self._extra[row] = extra
+
+    def _row(self, row):
+        status, difficulty = divmod(self._kinds[row], len(DIFFICULTIES))
+        game_result = {
+            "id": self._ids[row],
+            "user_id": self._user_ids[row],
+            "status": STATUSES[status],
+            "difficulty": DIFFICULTIES[difficulty],
+            "created_at": iso_from_epoch_us(self._created[row]),
+        }
+        extra = self._extra.get(row)
+        if extra:
+            game_result.update(extra)
+        if self._promo_codes[row]:
+            game_result["promo_code"] = str(self._promo_codes[row])
+        return game_result
+
+    def row_of(self, game_result_id):
+        """Row holding a game result id, or None"""
+        if not self._ids:
+            return None
+        # Ids are sequential, so the row is normally just an offset
+        row = game_result_id - self._ids[0]
+        if 0 <= row < len(self._ids) and self._ids[row] == game_result_id:
+            return row
+        try:
+            return self._ids.index(game_result_id)
+        except ValueError:
+            return None
+
+    def rows_before(self, created_us, limit):
+        """
+        Number of leading rows (at most ``limit``) created before
+        ``created_us``; rows with a timestamp kept verbatim count as old
+        """
+        created = self._created
+        row = 0
+        end = min(limit, len(created))
+        while row < end and created[row] < created_us:
+            row += 1
+        return row
+
+    def drop_prefix(self, count):
+        """
+        Remove the first ``count`` rows. The arrays are replaced rather than
+        shrunk in place, so snapshots taken earlier keep their rows.
+        """
+        if count <= 0:
+            return
+        self._ids = self._ids[count:]
+        self._user_ids = self._user_ids[count:]
+        self._created = self._created[count:]
+        self._kinds = self._kinds[count:]
+        self._promo_codes = self._promo_codes[count:]
+        self._extra = {row - count: fields for row, fields in self._extra.items() if row >= count}
+
+    # Aggregations
+
+    def kind_counts(self):
+        """Number of games per (status, difficulty) pair"""
+        kinds = self._kinds.tobytes()
+        return {
+            (status, difficulty): kinds.count(kind_code(status, difficulty))
+            for status in STATUSES
+            for difficulty in DIFFICULTIES
+        }
+
+    def status_counts(self):
+        """Number of games per status"""
+        counts = dict.fromkeys(STATUSES, 0)
+        for (status, _), count in self.kind_counts().items():
+            counts[status] += count
+        return counts
+
+    def difficulty_counts(self, status=None):
+        """Number of games per difficulty, optionally only with one status"""
+        counts = dict.fromkeys(DIFFICULTIES, 0)
+        for (kind_status, difficulty), count in self.kind_counts().items():
+            if status is None or kind_status == status:
+                counts[difficulty] += count
+        return counts
+
+    def winners(self, difficulty=None):
+        """User id of every win, oldest first, optionally for one difficulty"""
+        table = _WINS if difficulty is None else _WINS_BY_DIFFICULTY[difficulty]
+        return compress(self._user_ids, self._kinds.tobytes().translate(table))
+
+    def wins_since(self, created_us):
+        """
+        (user_id, created epoch microseconds, difficulty) of every win created
+        at or after ``created_us``, oldest first; rows are in time order
+        """
+        start = bisect_left(self._created, created_us)
+        kinds = self._kinds[start:]
+        mask = kinds.tobytes().translate(_WINS)
+        for user_id, created, kind in compress(zip(self._user_ids[start:], self._created[start:], kinds), mask):
+            yield user_id, created, DIFFICULTIES[kind % len(DIFFICULTIES)]
+
+    def wins_per_user(self, difficulty=None):
+        """Counter of wins per user id"""
+        return Counter(self.winners(difficulty))
+
+    def games_per_user(self):
+        """Counter of games per user id"""
+        return Counter(self._user_ids)
+
+    def memory_bytes(self):
+        """Approximate size of the columns (side table excluded)"""
+        return sum(
+            column.itemsize * len(column)
+            for column in (self._ids, self._user_ids, self._created, self._kinds, self._promo_codes)
+        )
+
+    def snapshot(self):
+        """
+        The first ``len(self)`` rows, for serialising in another thread while
+        this object keeps growing; see to_json()
+        """
+        return GameResultSnapshot(self, len(self._ids))
+
+    def to_json(self):
+        """The game results as the list of dicts stored in the snapshot file"""
+        return list(self)
+
+
+class GameResultSnapshot:
+    """
+    Rows are only ever appended and never changed, and dropping rows swaps in
+    new arrays, so a prefix of the live arrays stays valid without copying them
+    """
+
+    __slots__ = ("_columns", "_length")
+
+    def __init__(self, columns, length):
+        # A view on the current arrays, not on the live object
+        self._columns = GameResultColumns.from_columns(
+            columns._ids, columns._user_ids, columns._created, columns._kinds, columns._promo_codes,
+            columns._extra
+        )
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def to_json(self):
+        return [self._columns._row(row) for row in range(self._length)]
+
+    def columns(self):
+        """
+        Copies of the columns cut to the snapshot length, as (ids, user_ids,
+        created, kinds, promo_codes, extra)
+        """
+        source = self._columns
+        length = self._length
+        # Slicing an array or copying a dict is a single step under the GIL,
+        # so this is safe while the loop keeps appending
+        extra = dict(source._extra)
+        return (
+            source._ids[:length],
+            source._user_ids[:length],
+            source._created[:length],
+            source._kinds[:length],
+            source._promo_codes[:length],
+            {row: fields for row, fields in extra.items() if row < length},
+        )
+
+
+def _benchmark(rows):
+    import random
+    import time
+    import tracemalloc
+
+    start = datetime(2026, 1, 1)
+    users = [random.randrange(10 ** 9) for _ in range(max(1, rows // 20))]
+
+    def make_dicts():
+        game_results = []
+        for index in range(rows):
+            status = random.choice(STATUSES)
+            game_result = {
+                "id": index + 1,
+                "user_id": random.choice(users),
+                "status": status,
+                "difficulty": random.choice(DIFFICULTIES),
+                "created_at": (start + timedelta(seconds=index, microseconds=random.randrange(1000000))).isoformat()
+            }
+            if status == "win":
+                game_result["promo_code"] = str(random.randrange(10000, 100000))
+            game_results.append(game_result)
+        return game_results
+
+    tracemalloc.start()
+    dicts = make_dicts()
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    columns = GameResultColumns.from_dicts(dicts)
+    column_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    def timed(func):
+        began = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - began
+
+    def dict_wins():
+        wins = Counter()
+        for game_result in dicts:
+            if game_result["status"] == "win":
+                wins[game_result["user_id"]] += 1
+        return wins
+
+    def dict_difficulties():
+        counts = dict.fromkeys(DIFFICULTIES, 0)
+        for game_result in dicts:
+            counts[game_result["difficulty"]] += 1
+        return counts
+
+    slow_wins, dict_wins_s = timed(dict_wins)
+    fast_wins, column_wins_s = timed(columns.wins_per_user)
+    assert slow_wins == fast_wins
+    slow_counts, dict_counts_s = timed(dict_difficulties)
+    fast_counts, column_counts_s = timed(columns.difficulty_counts)
+    assert slow_counts == fast_counts
+    assert columns.to_json()[:1000] == dicts[:1000]
+
+    print(f"rows: {rows}")
+    print(f"memory: dicts {dict_bytes / rows:.0f} B/row, columns {column_bytes / rows:.1f} B/row")
+    print(f"wins per user: dicts {dict_wins_s * 1000:.1f} ms, columns {column_wins_s * 1000:.1f} ms")
+    print(f"games per difficulty: dicts {dict_counts_s * 1000:.1f} ms, columns {column_counts_s * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,47 @@
+"""
+Shared pytest fixtures: the SQL backend (main.py) and the JSON file backend
+(simple_backend.py) served by a TestClient, each on a database or data file
+of its own in a temporary directory
+"""
+
+import importlib
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# database.py reads DATABASE_URL on import, which test modules may do while
+# being collected, so the test database is picked before any of them loads
+_data_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_data_dir.name, 'test.db')}"
+
+
+@pytest.fixture(scope="session")
+def data_dir():
+    # The JSON store keeps its files in the cwd
+    cwd = os.getcwd()
+    os.chdir(_data_dir.name)
+    yield _data_dir.name
+    os.chdir(cwd)
+
+
+def _serve(module):
+    with TestClient(importlib.import_module(module).app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def sql_client(data_dir):
+    yield from _serve("main")
+
+
+@pytest.fixture(scope="session")
+def json_client(data_dir):
+    yield from _serve("simple_backend")
+
+
+@pytest.fixture(params=["sql", "json"])
+def client(request):
+    """Each test that takes it runs once against either backend"""
+    return request.getfixturevalue(f"{request.param}_client")
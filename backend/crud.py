@@ -0,0 +1,423 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import (
+    User, GameResult, PromoCode, UserStats, LeaderboardBucket, RankingStats,
+    GameStatus, DifficultyLevel, STATUS_COLUMNS, DIFFICULTY_COLUMNS
+)
+from leaderboard import PERIODS, period_key
+from promo_codes import PromoCodeAllocator, PROMO_CODE_TTL_DAYS, PROMO_CODES_REQUIRE_MOVES
+from schemas import GameResultCreate, UserStatsResponse
+
+COUNTER_COLUMNS = list(STATUS_COLUMNS.values()) + list(DIFFICULTY_COLUMNS.values())
+
+# Seeded from the promo_codes table on first use, see _promo_allocator()
+_allocator = None
+
+# How often a write that lost a race on a unique column is run again
+WRITE_ATTEMPTS = 3
+
+
+async def create_game_result(db: AsyncSession, game_data: GameResultCreate):
+    """Store one game result; see create_game_results_batch"""
+    recorded = await create_game_results_batch(db, [game_data])
+    return recorded[0]
+
+
+async def create_game_results_batch(db: AsyncSession, items):
+    """
+    Store several game results with their promo codes and counter updates in
+    a single transaction. Items whose (user_id, idempotency_key) was stored
+    before come back unchanged with duplicate=True.
+    """
+    return await _retry_on_conflict(db, lambda: _store_game_results(db, items))
+
+
+async def _retry_on_conflict(db: AsyncSession, write):
+    """
+    Run ``write()``, which commits; if a concurrent request stored the same
+    idempotency key, promo code or new user first, roll back and run it again,
+    so that it sees the other request's rows
+    """
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            return await write()
+        except IntegrityError:
+            await db.rollback()
+            if attempt == WRITE_ATTEMPTS - 1:
+                raise
+
+
+async def _store_game_results(db: AsyncSession, items):
+    # Results stored earlier under the same idempotency keys
+    keys = {(item.user_id, item.idempotency_key) for item in items if item.idempotency_key is not None}
+    known = {}
+    if keys:
+        rows = await db.execute(
+            select(GameResult, PromoCode.code)
+            .outerjoin(PromoCode, PromoCode.game_result_id == GameResult.id)
+            .where(tuple_(GameResult.user_id, GameResult.idempotency_key).in_(list(keys)))
+        )
+        for result, code in rows:
+            known[(result.user_id, result.idempotency_key)] = _recorded(result, code, duplicate=True)
+
+    await _ensure_users(db, items)
+
+    # Only new, distinct items are inserted
+    new_items = []
+    for item in items:
+        key = (item.user_id, item.idempotency_key)
+        if item.idempotency_key is None or key not in known:
+            new_items.append(item)
+            if item.idempotency_key is not None:
+                known[key] = None  # claimed by this batch
+
+    inserted = []
+    if new_items:
+        result_rows = await db.execute(
+            insert(GameResult).returning(GameResult, sort_by_parameter_order=True),
+            [
+                {
+                    "user_id": item.user_id,
+                    "status": GameStatus(item.status.value),
+                    "difficulty": DifficultyLevel(item.difficulty.value),
+                    "idempotency_key": item.idempotency_key,
+                }
+                for item in new_items
+            ]
+        )
+        inserted = list(result_rows.scalars())
+
+    wins = [result for result in inserted if result.status == GameStatus.WIN]
+    rewarded = [
+        result for item, result in zip(new_items, inserted)
+        if result.status == GameStatus.WIN and (item.moves is not None or not PROMO_CODES_REQUIRE_MOVES)
+    ]
+    codes = await _unused_codes(db, len(rewarded))
+    if rewarded:
+        expires_at = _promo_expiry()
+        await db.execute(
+            insert(PromoCode),
+            [
+                {
+                    "code": code,
+                    "user_id": result.user_id,
+                    "game_result_id": result.id,
+                    "is_used": False,
+                    "expires_at": expires_at,
+                }
+                for result, code in zip(rewarded, codes)
+            ]
+        )
+    promo_by_result = {result.id: code for result, code in zip(rewarded, codes)}
+
+    await _bump_user_stats(db, inserted)
+    await _bump_ranking_stats(db, inserted)
+    await _bump_leaderboard_buckets(db, wins)
+    await db.commit()
+
+    new_results = iter(inserted)
+    recorded = []
+    for item in items:
+        key = (item.user_id, item.idempotency_key)
+        if item.idempotency_key is not None and known.get(key) is not None:
+            recorded.append(known[key])
+            continue
+        result = next(new_results)
+        entry = _recorded(result, promo_by_result.get(result.id))
+        if item.idempotency_key is not None:
+            # Later repeats of this key within the batch are duplicates
+            known[key] = dict(entry, duplicate=True)
+        recorded.append(entry)
+    return recorded
+
+
+def _recorded(result, promo_code, duplicate=False):
+    return {
+        "id": result.id,
+        "user_id": result.user_id,
+        "status": result.status.value,
+        "difficulty": result.difficulty.value,
+        "promo_code": promo_code,
+        "created_at": result.created_at,
+        "idempotency_key": result.idempotency_key,
+        "duplicate": duplicate,
+    }
+
+
+async def _ensure_users(db: AsyncSession, items):
+    """Create every user referenced by the items that does not exist yet"""
+    usernames = {}
+    for item in items:
+        usernames.setdefault(item.user_id, item.username)
+    existing = set(await db.scalars(select(User.id).where(User.id.in_(usernames))))
+    missing = [user_id for user_id in usernames if user_id not in existing]
+    if missing:
+        # Telegram id doubles as the primary key so the API keeps exposing it
+        await db.execute(
+            insert(User),
+            [{"id": user_id, "telegram_id": user_id, "username": usernames[user_id]} for user_id in missing]
+        )
+
+
+async def _promo_allocator(db: AsyncSession):
+    """This process's promo code allocator, with every stored code reserved"""
+    global _allocator
+    if _allocator is None:
+        allocator = PromoCodeAllocator()
+        for code in await db.scalars(select(PromoCode.code)):
+            allocator.reserve(code)
+        if _allocator is None:
+            _allocator = allocator
+    return _allocator
+
+
+async def _unused_codes(db: AsyncSession, count):
+    """Draw ``count`` distinct promo codes that are not stored yet"""
+    allocator = await _promo_allocator(db)
+    codes = []
+    while len(codes) < count:
+        candidates = [allocator.allocate() for _ in range(count - len(codes))]
+        # Other workers allocate from their own copy of the pool
+        taken = set(await db.scalars(select(PromoCode.code).where(PromoCode.code.in_(candidates))))
+        codes.extend(code for code in candidates if code not in taken)
+    return codes
+
+
+def _promo_expiry():
+    """Expiry for a code issued now, or None when codes do not expire"""
+    if not PROMO_CODE_TTL_DAYS:
+        return None
+    return datetime.now(timezone.utc) + timedelta(days=PROMO_CODE_TTL_DAYS)
+
+
+async def promo_code_pool_stats(db: AsyncSession):
+    """Current promo code length and how many codes are left"""
+    return (await _promo_allocator(db)).stats()
+
+
+def _upsert(db: AsyncSession, table):
+    """INSERT ... ON CONFLICT for the connected dialect"""
+    dialect = db.bind.dialect.name
+    return (postgresql.insert if dialect == "postgresql" else sqlite.insert)(table)
+
+
+async def _bump_user_stats(db: AsyncSession, results):
+    """Add new games to the per-user counters (upsert, part of the caller's transaction)"""
+    deltas = {}
+    for result in results:
+        delta = deltas.setdefault(result.user_id, dict.fromkeys(COUNTER_COLUMNS, 0))
+        delta[STATUS_COLUMNS[result.status]] += 1
+        delta[DIFFICULTY_COLUMNS[result.difficulty]] += 1
+    if not deltas:
+        return
+
+    stmt = _upsert(db, UserStats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={
+            column: getattr(UserStats, column) + getattr(stmt.excluded, column)
+            for column in COUNTER_COLUMNS
+        }
+    )
+    await db.execute(stmt, [dict(delta, user_id=user_id) for user_id, delta in deltas.items()])
+
+
+async def _bump_ranking_stats(db: AsyncSession, results):
+    """
+    Add new games to the overall and per-difficulty ranking counters and
+    recompute their win rates (upsert, part of the caller's transaction)
+    """
+    deltas = {}
+    for result in results:
+        for scope in ("all", result.difficulty.value):
+            delta = deltas.setdefault((scope, result.user_id), [0, 0])
+            delta[0] += result.status == GameStatus.WIN
+            delta[1] += 1
+    if not deltas:
+        return
+
+    stmt = _upsert(db, RankingStats)
+    wins = RankingStats.wins + stmt.excluded.wins
+    games = RankingStats.games + stmt.excluded.games
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RankingStats.difficulty, RankingStats.user_id],
+        set_={"wins": wins, "games": games, "win_rate": wins * 1.0 / games}
+    )
+    await db.execute(stmt, [
+        {"difficulty": scope, "user_id": user_id, "wins": won, "games": games, "win_rate": won / games}
+        for (scope, user_id), (won, games) in deltas.items()
+    ])
+
+
+async def _bump_leaderboard_buckets(db: AsyncSession, wins):
+    """Add new wins to the day/week/month buckets they fall into (part of the caller's transaction)"""
+    deltas = {}
+    for result in wins:
+        created_at = result.created_at or datetime.now(timezone.utc)
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        for period in PERIODS:
+            bucket = period_key(period, created_at)
+            for scope in ("all", result.difficulty.value):
+                key = (period, bucket, scope, result.user_id)
+                deltas[key] = deltas.get(key, 0) + 1
+    if not deltas:
+        return
+
+    stmt = _upsert(db, LeaderboardBucket)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            LeaderboardBucket.period, LeaderboardBucket.bucket, LeaderboardBucket.difficulty, LeaderboardBucket.user_id
+        ],
+        set_={"wins": LeaderboardBucket.wins + stmt.excluded.wins}
+    )
+    await db.execute(stmt, [
+        {"period": period, "bucket": bucket, "difficulty": scope, "user_id": user_id, "wins": count}
+        for (period, bucket, scope, user_id), count in deltas.items()
+    ])
+
+
+async def get_period_leaderboard(db: AsyncSession, period: str, limit: int, difficulty=None):
+    """Top players of the current UTC day, ISO week or month; reads one bucket"""
+    bucket = period_key(period, datetime.now(timezone.utc).replace(tzinfo=None))
+    rows = await db.execute(
+        select(User.id, User.username, LeaderboardBucket.wins)
+        .join(LeaderboardBucket, User.id == LeaderboardBucket.user_id)
+        .where(
+            LeaderboardBucket.period == period,
+            LeaderboardBucket.bucket == bucket,
+            LeaderboardBucket.difficulty == (difficulty or "all")
+        )
+        .order_by(LeaderboardBucket.wins.desc())
+        .limit(limit)
+    )
+    return rows.all()
+
+
+async def get_ranking(db: AsyncSession, difficulty, rank_by: str, min_games: int, limit: int):
+    """
+    All-time top players overall or for one difficulty, by wins or by win
+    rate among players with at least min_games games; reads ranking_stats
+    """
+    stmt = (
+        select(User.id, User.username, RankingStats.wins, RankingStats.games, RankingStats.win_rate)
+        .join(RankingStats, User.id == RankingStats.user_id)
+        .where(RankingStats.difficulty == (difficulty or "all"))
+    )
+    if rank_by == "win_rate":
+        stmt = (
+            stmt.where(RankingStats.games >= max(min_games, 1))
+            .order_by(RankingStats.win_rate.desc(), RankingStats.games.desc(), RankingStats.user_id)
+        )
+    else:
+        stmt = stmt.where(RankingStats.wins > 0).order_by(RankingStats.wins.desc())
+    rows = await db.execute(stmt.limit(limit))
+    return rows.all()
+
+
+async def create_promo_code(db: AsyncSession, user_id: int, game_result_id=None):
+    """Issue a promo code that is not taken yet"""
+    async def issue():
+        code = (await _unused_codes(db, 1))[0]
+        promo = PromoCode(
+            code=code, user_id=user_id, game_result_id=game_result_id, is_used=False, expires_at=_promo_expiry()
+        )
+        db.add(promo)
+        await db.commit()
+        await db.refresh(promo)
+        return promo
+    return await _retry_on_conflict(db, issue)
+
+
+async def get_user_stats(db: AsyncSession, user_id: int):
+    """Read a user's precomputed counters"""
+    user = await db.get(User, user_id)
+    if user is None:
+        return UserStatsResponse(
+            user_id=user_id,
+            username=None,
+            total_games=0,
+            wins=0,
+            losses=0,
+            draws=0,
+            win_rate=0.0,
+            favorite_difficulty=None
+        )
+
+    stats = await db.get(UserStats, user_id)
+    wins = stats.wins if stats else 0
+    losses = stats.losses if stats else 0
+    draws = stats.draws if stats else 0
+    total_games = wins + losses + draws
+
+    # Ties go to the easier difficulty
+    favorite = None
+    if stats:
+        by_difficulty = {
+            difficulty: getattr(stats, column)
+            for difficulty, column in DIFFICULTY_COLUMNS.items()
+        }
+        favorite = max(by_difficulty, key=by_difficulty.get)
+        if not by_difficulty[favorite]:
+            favorite = None
+
+    return UserStatsResponse(
+        user_id=user_id,
+        username=user.username,
+        total_games=total_games,
+        wins=wins,
+        losses=losses,
+        draws=draws,
+        win_rate=round(wins / total_games * 100, 2) if total_games > 0 else 0.0,
+        favorite_difficulty=favorite.value if favorite else None
+    )
+
+
+async def validate_promo_code(db: AsyncSession, code: str, user_id: int):
+    """
+    Redeem an unused, unexpired promo code owned by ``user_id``; returns None
+    if it cannot be used. The check and the update are one statement, so of
+    several concurrent redemptions exactly one succeeds.
+    """
+    now = datetime.now(timezone.utc)
+    promo = await db.scalar(
+        update(PromoCode)
+        .where(
+            PromoCode.code == code,
+            PromoCode.user_id == user_id,
+            PromoCode.is_used.is_(False),
+            or_(PromoCode.expires_at.is_(None), PromoCode.expires_at > now)
+        )
+        .values(is_used=True, used_at=now)
+        .returning(PromoCode)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return promo
+
+
+async def promo_code_status(db: AsyncSession, code: str, user_id: int):
+    """
+    Why ``user_id`` cannot redeem a code, in the terms of
+    PromoCodeStore.check: "not_owner", "used", "expired", "valid", or None
+    for unknown codes
+    """
+    promo = await db.scalar(select(PromoCode).where(PromoCode.code == code))
+    if promo is None:
+        return None
+    if promo.user_id != user_id:
+        return "not_owner"
+    if promo.is_used:
+        return "used"
+    expires_at = promo.expires_at
+    if expires_at is not None and expires_at.tzinfo is None:
+        # SQLite hands timestamps back without their zone
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at is not None and expires_at <= datetime.now(timezone.utc):
+        return "expired"
+    return "valid"
@@ -0,0 +1,138 @@
+"""
+Async SQLAlchemy engine and session factory for the SQL backend (main.py).
+
+DATABASE_URL selects the driver: ``postgresql+asyncpg://...`` in production,
+``sqlite+aiosqlite:///...`` (the default) for local runs. Pool sizing and the
+prepared-statement cache are configured from the environment.
+
+The schema is owned by the Alembic migrations in ``migrations/``;
+``init_db()`` runs them on startup.
+"""
+
+import asyncio
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./rose_tic.db")
+
+# Connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+# Per-connection cache of server-side prepared statements (asyncpg)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500))
+
+
+def _engine_options(url):
+    """Engine keyword arguments tuned for the selected driver"""
+    options = {
+        # Compiled SQL cache shared by all connections
+        "query_cache_size": 1200,
+    }
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return options
+        # aiosqlite defaults to opening a connection per session; keep a
+        # small pool instead, SQLite allows a single writer anyway
+        options.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=min(DB_POOL_SIZE, 5),
+            max_overflow=0,
+            pool_timeout=DB_POOL_TIMEOUT,
+            connect_args={"timeout": 30},
+        )
+    else:
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+    return options
+
+
+def _database_url(raw_url):
+    url = make_url(raw_url)
+    if url.get_driver_name() == "asyncpg" and "prepared_statement_cache_size" not in url.query:
+        url = url.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)})
+    return url
+
+
+_url = _database_url(DATABASE_URL)
+engine = create_async_engine(_url, **_engine_options(_url))
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# Pool activity counters, see pool_metrics()
+_pool_counters = {"connects": 0, "checkouts": 0, "checkins": 0, "invalidated": 0}
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    _pool_counters["connects"] += 1
+    if _url.get_backend_name() == "sqlite":
+        # WAL lets readers run while a write is in progress
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _pool_counters["checkouts"] += 1
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    _pool_counters["checkins"] += 1
+
+
+@event.listens_for(engine.sync_engine, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    _pool_counters["invalidated"] += 1
+
+
+async def get_db():
+    """FastAPI dependency that yields a session and always closes it"""
+    async with SessionLocal() as session:
+        yield session
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+async def init_db():
+    """Migrate the database to the latest schema (``alembic upgrade head``)"""
+    # No ini file, so alembic leaves the application's logging configuration alone
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    # env.py runs the migrations on an event loop of its own
+    await asyncio.get_running_loop().run_in_executor(None, command.upgrade, config, "head")
+
+
+async def close_db():
+    """Close every pooled connection"""
+    await engine.dispose()
+
+
+def pool_metrics():
+    """Current pool occupancy plus lifetime counters"""
+    pool = engine.pool
+    metrics = dict(_pool_counters)
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            metrics[name] = method()
+    metrics["status"] = pool.status()
+    return metrics
@@ -0,0 +1,485 @@
+"""
+Server-side tic-tac-toe engine.
+
+A board is encoded as a base-3 integer: cell ``i`` (0-8, row by row)
+contributes ``digit * 3**i``, with 0 for an empty cell, 1 for diamond and 2
+for ring. Diamond always moves first, so whose turn it is follows from the
+board itself.
+
+At import time every position reachable from the empty board (5,478 of
+them, finished games included) is enumerated once. The results go into
+flat tables indexed by board code:
+
+- the winner of finished games;
+- for each difficulty, the set of moves the client AI in
+  ``src/hooks/useGameLogic.ts`` may pick for the side to move (relaxed:
+  any empty cell; strategic: next to its own marks, else the centre;
+  master: win, block, centre, corner, edge).
+
+Move selection and result checks are then a single list lookup. Move sets
+are stored as 9-bit masks; ``MASK_CELLS`` turns a mask into its cells.
+
+Perfect play (``score``, ``best_moves``, ``perfect_move``) comes from a
+minimax search backed by a TranspositionTable. Positions are stored once per
+class of the 8 rotations and reflections of the board, under the smallest
+code in the class (765 classes instead of 5,478 positions), and their best
+moves are mapped back to the orientation asked for. The canonical code and
+symmetry of every position are flat tables built at import, and the table
+itself is a pair of dense lists indexed by canonical code, solved from the
+empty board at import, so a lookup is a few list reads. The client AIs'
+choices are not symmetric (they prefer the lowest-numbered cell), so they
+keep their flat tables.
+
+``replay`` checks a whole submitted game: it plays the moves on two 9-bit
+bitboards plus the running board code, without copying a board per move,
+rejects any computer move the client AI could not have made, and detects
+the end of the game with one ``LINE_COMPLETE`` lookup per move.
+``verify_games`` does the same for a batch.
+
+Running this module prints how many positions it holds and a lookup
+benchmark.
+"""
+
+import random
+import time
+
+from columnar import DIFFICULTIES
+
+EMPTY, DIAMOND, RING = 0, 1, 2
+SYMBOLS = {"diamond": DIAMOND, "ring": RING}
+SYMBOL_NAMES = {DIAMOND: "diamond", RING: "ring"}
+
+# Same order as WINNING_LINES in useGameLogic.ts
+WINNING_LINES = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),
+    (0, 4, 8), (2, 4, 6),
+)
+LINE_MASKS = tuple(sum(1 << cell for cell in line) for line in WINNING_LINES)
+
+# Neighbours the strategic AI looks at, in the client's order
+ADJACENT = (
+    (1, 3, 4), (0, 2, 3, 4, 5), (1, 4, 5),
+    (0, 1, 4, 6, 7), (0, 1, 2, 3, 5, 6, 7, 8), (1, 2, 4, 7, 8),
+    (3, 4, 7), (3, 4, 5, 6, 8), (4, 5, 7),
+)
+CENTER = 4
+CORNERS = (0, 2, 6, 8)
+
+POW3 = tuple(3 ** cell for cell in range(9))
+CODES = 3 ** 9
+FULL_MASK = (1 << 9) - 1
+
+# Winner entries
+DRAW = 3
+
+# Cells of every 9-bit mask, ascending
+MASK_CELLS = tuple(tuple(cell for cell in range(9) if mask >> cell & 1) for mask in range(1 << 9))
+
+# Whether a set of cells (as a mask) contains a whole line
+LINE_COMPLETE = tuple(any(mask & line == line for line in LINE_MASKS) for mask in range(1 << 9))
+
+# The 8 symmetries of the board as cell maps: symmetry ``s`` moves cell ``c`` to SYMMETRIES[s][c]
+SYMMETRIES = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8),    # identity
+    (2, 5, 8, 1, 4, 7, 0, 3, 6),    # rotate 90 degrees
+    (8, 7, 6, 5, 4, 3, 2, 1, 0),    # rotate 180 degrees
+    (6, 3, 0, 7, 4, 1, 8, 5, 2),    # rotate 270 degrees
+    (2, 1, 0, 5, 4, 3, 8, 7, 6),    # mirror left-right
+    (6, 7, 8, 3, 4, 5, 0, 1, 2),    # mirror top-bottom
+    (0, 3, 6, 1, 4, 7, 2, 5, 8),    # main diagonal
+    (8, 5, 2, 7, 4, 1, 6, 3, 0),    # anti-diagonal
+)
+
+# Code contribution of each row's 3 digits (0-26) once moved by each symmetry,
+# so a whole board is transformed with 3 lookups
+_ROW_IMAGES = tuple(
+    tuple(
+        tuple(
+            sum(chunk // 3 ** col % 3 * POW3[cells[3 * row + col]] for col in range(3))
+            for chunk in range(27)
+        )
+        for row in range(3)
+    )
+    for cells in SYMMETRIES
+)
+
+# Cells of the original board that a symmetry moves into a mask
+_MASK_PREIMAGES = tuple(
+    tuple(sum(1 << cell for cell in range(9) if mask >> cells[cell] & 1) for mask in range(1 << 9))
+    for cells in SYMMETRIES
+)
+
+
+def encode(board):
+    """Code of a board given as 9 cells of "diamond", "ring" or None (or 0/1/2)"""
+    code = 0
+    for cell in range(8, -1, -1):
+        value = board[cell]
+        code = code * 3 + (SYMBOLS[value] if isinstance(value, str) else value or 0)
+    return code
+
+
+def decode(code):
+    """Board of a code as 9 cells of "diamond", "ring" or None"""
+    board = []
+    for _ in range(9):
+        code, digit = divmod(code, 3)
+        board.append(SYMBOL_NAMES.get(digit))
+    return board
+
+
+def bitboards(code):
+    """(diamond cells, ring cells) of a code as 9-bit masks"""
+    diamonds = rings = 0
+    for cell in range(9):
+        code, digit = divmod(code, 3)
+        if digit == DIAMOND:
+            diamonds |= 1 << cell
+        elif digit == RING:
+            rings |= 1 << cell
+    return diamonds, rings
+
+
+def _first_line_move(own, empty):
+    """Lowest empty cell that completes a line for ``own``, or None"""
+    for cell in MASK_CELLS[empty]:
+        if LINE_COMPLETE[own | 1 << cell]:
+            return cell
+    return None
+
+
+def _strategic_candidates(own, empty):
+    for own_cell in MASK_CELLS[own]:
+        for cell in ADJACENT[own_cell]:
+            if empty >> cell & 1:
+                return 1 << cell
+    if empty >> CENTER & 1:
+        return 1 << CENTER
+    return empty
+
+
+def _master_candidates(own, other, empty):
+    for mark in (own, other):
+        cell = _first_line_move(mark, empty)
+        if cell is not None:
+            return 1 << cell
+    if empty >> CENTER & 1:
+        return 1 << CENTER
+    corners = empty & sum(1 << cell for cell in CORNERS)
+    return corners or empty
+
+
+def _build_tables():
+    """Enumerate and solve every reachable position (iteratively, deepest first)"""
+    winner = [None] * CODES
+    to_move = [None] * CODES
+    empties = [0] * CODES
+    # Positions by number of marks, each reached once
+    layers = [{0: (0, 0)}]
+    for marks in range(9):
+        mover = DIAMOND if marks % 2 == 0 else RING
+        layer = {}
+        for code, (diamonds, rings) in layers[marks].items():
+            if LINE_COMPLETE[diamonds] or LINE_COMPLETE[rings]:
+                continue
+            empty = FULL_MASK & ~(diamonds | rings)
+            for cell in MASK_CELLS[empty]:
+                child = code + mover * POW3[cell]
+                if child not in layer:
+                    if mover == DIAMOND:
+                        layer[child] = (diamonds | 1 << cell, rings)
+                    else:
+                        layer[child] = (diamonds, rings | 1 << cell)
+        layers.append(layer)
+
+    candidates = {difficulty: [0] * CODES for difficulty in DIFFICULTIES}
+    for marks in range(9, -1, -1):
+        mover = DIAMOND if marks % 2 == 0 else RING
+        for code, (diamonds, rings) in layers[marks].items():
+            empty = FULL_MASK & ~(diamonds | rings)
+            empties[code] = empty
+            if LINE_COMPLETE[diamonds] or LINE_COMPLETE[rings]:
+                winner[code] = DIAMOND if LINE_COMPLETE[diamonds] else RING
+                continue
+            if not empty:
+                winner[code] = DRAW
+                continue
+            winner[code] = EMPTY
+            to_move[code] = mover
+            own, other = (diamonds, rings) if mover == DIAMOND else (rings, diamonds)
+            candidates["relaxed"][code] = empty
+            candidates["strategic"][code] = _strategic_candidates(own, empty)
+            candidates["master"][code] = _master_candidates(own, other, empty)
+    return winner, to_move, empties, candidates
+
+
+_WINNER, _TO_MOVE, _EMPTY, _CANDIDATES = _build_tables()
+
+# Number of reachable positions, finished games and the empty board included
+POSITIONS = sum(1 for entry in _WINNER if entry is not None)
+
+
+def is_legal(code):
+    """Whether a code is a position reachable from the empty board"""
+    return 0 <= code < CODES and _WINNER[code] is not None
+
+
+def winner(code):
+    """Winner of a position: "diamond", "ring", "draw", or None while the game is on"""
+    entry = _WINNER[code]
+    if entry is None:
+        raise ValueError(f"Unreachable position: {code}")
+    if entry == DRAW:
+        return "draw"
+    return SYMBOL_NAMES.get(entry)
+
+
+def to_move(code):
+    """Symbol of the side to move, or None once the game is over"""
+    return SYMBOL_NAMES.get(_TO_MOVE[code])
+
+
+def play(code, cell):
+    """Code after the side to move takes an empty cell"""
+    mover = _TO_MOVE[code]
+    if mover is None or not _EMPTY[code] >> cell & 1:
+        raise ValueError(f"Illegal move {cell} in position {code}")
+    return code + mover * POW3[cell]
+
+
+def canonical(code):
+    """(smallest code among the 8 symmetric boards, index of the symmetry that gives it)"""
+    low, middle, high = code % 27, code // 27 % 27, code // 729
+    best_code, best_symmetry = code, 0
+    for symmetry in range(1, 8):
+        rows = _ROW_IMAGES[symmetry]
+        image = rows[0][low] + rows[1][middle] + rows[2][high]
+        if image < best_code:
+            best_code, best_symmetry = image, symmetry
+    return best_code, best_symmetry
+
+
+# Canonical code of every code and the cells of the original board that its
+# symmetry moves into each mask; unreachable codes map to themselves
+_CANONICAL = list(range(CODES))
+_PREIMAGES = [_MASK_PREIMAGES[0]] * CODES
+for _code in range(CODES):
+    if _WINNER[_code] is not None:
+        _CANONICAL[_code], _symmetry = canonical(_code)
+        _PREIMAGES[_code] = _MASK_PREIMAGES[_symmetry]
+del _code, _symmetry
+
+
+class TranspositionTable:
+    """
+    Minimax results of positions, one entry per symmetry class, in dense
+    lists indexed by canonical code. The whole game is 765 classes (about
+    300 KiB of list slots), so nothing is ever evicted.
+    """
+
+    def __init__(self):
+        self.scores = [None] * CODES    # canonical code -> minimax score, None until searched
+        self.best = [0] * CODES         # canonical code -> mask of the best moves
+        self.searched = 0
+
+    def __len__(self):
+        return self.searched
+
+    def lookup(self, code):
+        """(minimax score, mask of the best moves) for the side to move in ``code``"""
+        key = _CANONICAL[code]
+        value = self.scores[key]
+        if value is None:
+            value = self._search(key)
+        return value, _PREIMAGES[code][self.best[key]]
+
+    def stats(self):
+        return {"entries": self.searched, "slots": CODES}
+
+    def _search(self, code):
+        empty = _EMPTY[code]
+        entry = _WINNER[code]
+        if entry is None:
+            raise ValueError(f"Unreachable position: {code}")
+        if entry == DRAW:
+            top, best = 0, 0
+        elif entry != EMPTY:
+            # The side to move has lost; sooner is worse
+            top, best = -(1 + bin(empty).count("1")), 0
+        else:
+            mover = _TO_MOVE[code]
+            top, best = None, 0
+            for cell in MASK_CELLS[empty]:
+                value = -self.lookup(code + mover * POW3[cell])[0]
+                if top is None or value > top:
+                    top, best = value, 1 << cell
+                elif value == top:
+                    best |= 1 << cell
+        self.scores[code] = top
+        self.best[code] = best
+        self.searched += 1
+        return top
+
+
+# Shared by every caller and solved from the empty board now; since every
+# reachable position is then in it, best_moves() reads the lists directly
+transpositions = TranspositionTable()
+transpositions.lookup(0)
+
+
+def score(code):
+    """
+    Minimax score for the side to move: positive wins, negative loses, 0
+    draws; a larger magnitude means a quicker result
+    """
+    return transpositions.lookup(code)[0]
+
+
+def best_moves(code):
+    """Cells that keep the best minimax score for the side to move"""
+    return MASK_CELLS[_PREIMAGES[code][transpositions.best[_CANONICAL[code]]]]
+
+
+def perfect_move(code, rng=random):
+    """A minimax-optimal move, drawn at random among the equally good ones"""
+    cells = best_moves(code)
+    if not cells:
+        raise ValueError(f"No move in position {code}")
+    return cells[0] if len(cells) == 1 else rng.choice(cells)
+
+
+def candidate_moves(code, difficulty):
+    """Cells the client AI of ``difficulty`` may pick for the side to move"""
+    return MASK_CELLS[_CANDIDATES[difficulty][code]]
+
+
+def is_candidate_move(code, difficulty, cell):
+    """Whether the client AI of ``difficulty`` may take ``cell`` here"""
+    return bool(_CANDIDATES[difficulty][code] >> cell & 1)
+
+
+def choose_move(code, difficulty, rng=random):
+    """A move the client AI of ``difficulty`` could make, drawn at random among its options"""
+    cells = MASK_CELLS[_CANDIDATES[difficulty][code]]
+    if not cells:
+        raise ValueError(f"No move in position {code}")
+    return cells[0] if len(cells) == 1 else rng.choice(cells)
+
+
+def outcome(code, player_symbol):
+    """Result for the player with ``player_symbol``: "win", "loss", "draw", or None while the game is on"""
+    entry = _WINNER[code]
+    if entry is None:
+        raise ValueError(f"Unreachable position: {code}")
+    if entry == EMPTY:
+        return None
+    if entry == DRAW:
+        return "draw"
+    return "win" if entry == SYMBOLS[player_symbol] else "loss"
+
+
+def verify_result(board, player_symbol, status):
+    """Whether a final board (a code or 9 cells) is reachable and ends with ``status`` for the player"""
+    code = board if isinstance(board, int) else encode(board)
+    return is_legal(code) and outcome(code, player_symbol) == status
+
+
+class InvalidGame(ValueError):
+    """A move list the client could not have produced"""
+
+
+def replay(moves, difficulty, player_symbol="diamond"):
+    """
+    Replay a finished game (cells in play order, diamond first, the computer
+    playing the other symbol with the ``difficulty`` AI) and return its result
+    for the player. Raises InvalidGame for illegal moves, computer moves the
+    AI would not make, moves after the end, and unfinished games.
+    """
+    candidates = _CANDIDATES[difficulty]
+    player = SYMBOLS[player_symbol]
+    code = diamonds = rings = 0
+    mover = DIAMOND
+    result = None
+    for cell in moves:
+        if result is not None:
+            raise InvalidGame("Moves continue after the game ended")
+        if type(cell) is not int or not 0 <= cell < 9:
+            raise InvalidGame(f"No such cell: {cell!r}")
+        bit = 1 << cell
+        if (diamonds | rings) & bit:
+            raise InvalidGame(f"Cell {cell} is already taken")
+        if mover != player and not candidates[code] & bit:
+            raise InvalidGame(f"The {difficulty} AI would not play cell {cell}")
+        code += mover * POW3[cell]
+        if mover == DIAMOND:
+            diamonds |= bit
+            won = LINE_COMPLETE[diamonds]
+        else:
+            rings |= bit
+            won = LINE_COMPLETE[rings]
+        if won:
+            result = "win" if mover == player else "loss"
+        elif diamonds | rings == FULL_MASK:
+            result = "draw"
+        mover = RING if mover == DIAMOND else DIAMOND
+    if result is None:
+        raise InvalidGame("The game is not finished")
+    return result
+
+
+def verify_games(games):
+    """
+    Check many submitted games: ``games`` yields (moves, difficulty,
+    player_symbol, status). Returns, in order, None for every game whose moves
+    replay to its status and the reason for every other one.
+    """
+    reasons = []
+    for moves, difficulty, player_symbol, status in games:
+        try:
+            result = replay(moves, difficulty, player_symbol)
+        except InvalidGame as e:
+            reasons.append(str(e))
+            continue
+        reasons.append(None if result == status else f"The moves end in a {result}, not a {status}")
+    return reasons
+
+
+def benchmark(lookups=2_000_000):
+    """Positions looked up per second for best_moves() and candidate_moves(), games replayed per second"""
+    codes = [code for code in range(CODES) if _TO_MOVE[code] is not None]
+    sample = [codes[i % len(codes)] for i in range(lookups)]
+    results = {}
+    for name, lookup in (
+        ("best_moves", best_moves),
+        ("candidate_moves(master)", lambda code: candidate_moves(code, "master")),
+        ("outcome", lambda code: outcome(code, "diamond")),
+    ):
+        started = time.perf_counter()
+        for code in sample:
+            lookup(code)
+        results[name] = lookups / (time.perf_counter() - started)
+
+    # Games the master AI could have played against a random opponent
+    rng = random.Random(0)
+    games = []
+    for _ in range(10_000):
+        code, moves = 0, []
+        while to_move(code) is not None:
+            cell = choose_move(code, "master", rng) if len(moves) % 2 else rng.choice(MASK_CELLS[_EMPTY[code]])
+            moves.append(cell)
+            code = play(code, cell)
+        games.append((moves, "master", "diamond", outcome(code, "diamond")))
+    started = time.perf_counter()
+    for _ in range(10):
+        verify_games(games)
+    results["verify_games"] = len(games) * 10 / (time.perf_counter() - started)
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{POSITIONS} positions, first move score {score(0)} (draw with perfect play)")
+    print(f"transposition table: {len(transpositions)} symmetry classes, {transpositions.stats()}")
+    for name, rate in benchmark().items():
+        unit = "games" if name == "verify_games" else "positions"
+        print(f"{name}: {rate / 1e6:.2f}M {unit}/s")
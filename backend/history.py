@@ -0,0 +1,190 @@
+"""
+Monthly partitions of the game history.
+
+Only recent game results are kept in memory: the current month and the
+``HISTORY_HOT_MONTHS - 1`` months before it. Older results are rolled out in
+batches into one compressed archive file per month
+(``<name>.history/YYYY-MM.jsonl.gz``) and folded into ``HistoryArchive``,
+which keeps only pre-aggregated counters for them:
+
+- games per month, by status and difficulty;
+- per-user win/loss/draw counters, and games and wins per difficulty;
+- the leaderboard, overall and per difficulty, as it stood after the
+  archived games, so that a full leaderboard rebuild only has to replay the
+  games still in memory.
+
+Totals and per-user stats never need the archived rows, so they stay
+constant-time however long the history grows, and the in-memory working set
+is bounded by the hot window.
+"""
+
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+
+from columnar import DIFFICULTIES, STATUSES
+from leaderboard import WinLeaderboard
+
+# Months kept in memory, the current one included (0 disables archiving)
+HISTORY_HOT_MONTHS = int(os.getenv("HISTORY_HOT_MONTHS", 3))
+
+# Roller: how often it runs and how many game results it archives per write
+HISTORY_ROLL_INTERVAL = float(os.getenv("HISTORY_ROLL_INTERVAL", 3600))
+HISTORY_ROLL_BATCH = int(os.getenv("HISTORY_ROLL_BATCH", 5000))
+
+
+def history_dir_for(data_file):
+    """Directory with the monthly archives that belong to a snapshot file"""
+    return os.path.splitext(data_file)[0] + ".history"
+
+
+_PARTITION = re.compile(r"\d{4}-\d{2}$")
+
+
+def partition_of(created_at):
+    """Partition ("YYYY-MM") of an ISO timestamp"""
+    partition = created_at[:7] if isinstance(created_at, str) else ""
+    return partition if _PARTITION.match(partition) else "unknown"
+
+
+def hot_window_start(now, hot_months=HISTORY_HOT_MONTHS):
+    """First moment that is still kept in memory"""
+    month_index = now.year * 12 + now.month - 1 - (hot_months - 1)
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def write_partitions(directory, rows_by_partition):
+    """
+    Append game result lines (bytes per partition) to the monthly archive
+    files. A crash before the log append can leave a batch in a file twice;
+    readers should keep the first copy of each id.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for partition, payload in rows_by_partition.items():
+        # Each append is a separate gzip member; readers see one stream
+        with open(os.path.join(directory, f"{partition}.jsonl.gz"), "ab") as f:
+            f.write(gzip.compress(payload))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_partition(directory, partition):
+    """Game result dicts of one archived month"""
+    path = os.path.join(directory, f"{partition}.jsonl.gz")
+    game_results = {}
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                game_result = json.loads(line)
+                game_results.setdefault(game_result["id"], game_result)
+    return list(game_results.values())
+
+
+class HistoryArchive:
+    """Counters for the game results that were rolled out of memory"""
+
+    def __init__(self):
+        self.rows = 0
+        self.last_id = 0
+        self.partitions = {}     # "YYYY-MM" -> {"games": n, status: n, difficulty: n}
+        self.users = {}          # user_id -> [win, loss, draw, {difficulty: games}, {difficulty: wins}]
+        self.leaderboard = WinLeaderboard()
+        self.difficulty_leaderboards = {difficulty: WinLeaderboard() for difficulty in DIFFICULTIES}
+        self._version = 0
+        self._frozen = (None, None)
+
+    def add(self, game_result):
+        """Fold one archived game result into the counters"""
+        status = game_result["status"]
+        difficulty = game_result["difficulty"]
+
+        name = partition_of(game_result["created_at"])
+        partition = self.partitions.get(name)
+        if partition is None:
+            partition = self.partitions[name] = dict.fromkeys(("games",) + STATUSES + DIFFICULTIES, 0)
+        partition["games"] += 1
+        partition[status] += 1
+        partition[difficulty] += 1
+
+        user_id = game_result["user_id"]
+        counters = self.users.get(user_id)
+        if counters is None:
+            counters = self.users[user_id] = [0, 0, 0, {}, {}]
+        counters[STATUSES.index(status)] += 1
+        counters[3][difficulty] = counters[3].get(difficulty, 0) + 1
+
+        if status == "win":
+            counters[4][difficulty] = counters[4].get(difficulty, 0) + 1
+            self.leaderboard.record_win(user_id)
+            self.difficulty_leaderboards[difficulty].record_win(user_id)
+        self.rows += 1
+        self.last_id = max(self.last_id, game_result["id"])
+        self._version += 1
+
+    def get(self, user_id):
+        """
+        (win, loss, draw, {difficulty: games}, {difficulty: wins}) over
+        archived games, or None
+        """
+        counters = self.users.get(user_id)
+        if counters is None:
+            return None
+        win, loss, draw, difficulties, difficulty_wins = counters
+        return win, loss, draw, dict(difficulties), dict(difficulty_wins)
+
+    def totals(self):
+        """Games by status and difficulty over all archived months"""
+        totals = dict.fromkeys(("games",) + STATUSES + DIFFICULTIES, 0)
+        for partition in self.partitions.values():
+            for key, count in partition.items():
+                totals[key] += count
+        return totals
+
+    def to_json(self):
+        """Plain structure for the snapshot; cached until the next add()"""
+        version, frozen = self._frozen
+        if version != self._version:
+            frozen = {
+                "rows": self.rows,
+                "last_id": self.last_id,
+                "partitions": {name: dict(counts) for name, counts in self.partitions.items()},
+                "users": [
+                    [user_id, win, loss, draw, dict(difficulties), dict(difficulty_wins)]
+                    for user_id, (win, loss, draw, difficulties, difficulty_wins) in self.users.items()
+                ],
+                "leaderboard": self.leaderboard.export(),
+                "difficulty_leaderboards": {
+                    difficulty: board.export() for difficulty, board in self.difficulty_leaderboards.items()
+                },
+            }
+            self._frozen = (self._version, frozen)
+        return frozen
+
+    @classmethod
+    def from_json(cls, data):
+        archive = cls()
+        if not data:
+            return archive
+        archive.rows = data["rows"]
+        archive.last_id = data["last_id"]
+        archive.partitions = {name: dict(counts) for name, counts in data["partitions"].items()}
+        archive.users = {
+            user_id: [win, loss, draw, dict(difficulties), dict(difficulty_wins)]
+            for user_id, win, loss, draw, difficulties, difficulty_wins in data["users"]
+        }
+        archive.leaderboard = WinLeaderboard.restore(tuple(pair) for pair in data["leaderboard"])
+        archive.difficulty_leaderboards = difficulty_leaderboards(data)
+        archive._frozen = (archive._version, data)
+        return archive
+
+
+def difficulty_leaderboards(data):
+    """Per-difficulty win boards of HistoryArchive.to_json() output"""
+    if not data:
+        return {difficulty: WinLeaderboard() for difficulty in DIFFICULTIES}
+    return {
+        difficulty: WinLeaderboard.restore(tuple(pair) for pair in data["difficulty_leaderboards"][difficulty])
+        for difficulty in DIFFICULTIES
+    }
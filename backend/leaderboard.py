@@ -0,0 +1,341 @@
+"""
+Materialised win leaderboard.
+
+Win counts only ever go up by one, so players are kept in buckets keyed by
+their win count, plus a sorted list of the counts that are currently in use.
+Recording a win moves one player to the next bucket, and reading the top N
+walks the buckets from the highest count down, touching only N players.
+
+``PeriodLeaderboards`` keeps one such board per calendar period (UTC day,
+ISO week, month) for the period in progress. A win that falls into a new
+period starts a fresh board, so the boards roll over by themselves and a
+query reads exactly one of them.
+"""
+
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from itertools import chain
+
+PERIODS = ("day", "week", "month")
+
+
+class WinLeaderboard:
+    """Players ranked by number of wins, updated one win at a time"""
+
+    def __init__(self):
+        self._wins = {}       # user_id -> wins
+        self._buckets = {}    # wins -> {user_id: None}, in the order players got there
+        self._levels = []     # win counts that have a bucket, ascending
+
+    def __len__(self):
+        return len(self._wins)
+
+    def wins(self, user_id):
+        """Current number of wins of a player"""
+        return self._wins.get(user_id, 0)
+
+    def record_win(self, user_id):
+        """Move a player one win up"""
+        old = self._wins.get(user_id, 0)
+        new = old + 1
+
+        if old:
+            bucket = self._buckets[old]
+            del bucket[user_id]
+            if not bucket:
+                del self._buckets[old]
+                del self._levels[bisect_left(self._levels, old)]
+
+        bucket = self._buckets.get(new)
+        if bucket is None:
+            bucket = self._buckets[new] = {}
+            insort(self._levels, new)
+        bucket[user_id] = None
+        self._wins[user_id] = new
+
+    def top(self, limit):
+        """
+        Up to ``limit`` (user_id, wins) pairs, most wins first; players with
+        the same number of wins are ordered by who reached it first
+        """
+        result = []
+        if limit <= 0:
+            return result
+        for level in reversed(self._levels):
+            for user_id in self._buckets[level]:
+                result.append((user_id, level))
+                if len(result) == limit:
+                    return result
+        return result
+
+    @classmethod
+    def from_game_results(cls, game_results):
+        """Build a leaderboard from scratch by replaying game results in order"""
+        return cls.from_winners(
+            game_result["user_id"] for game_result in game_results if game_result["status"] == "win"
+        )
+
+    @classmethod
+    def from_winners(cls, user_ids):
+        """Build a leaderboard from the user id of every win, oldest first"""
+        board = cls()
+        for user_id in user_ids:
+            board.record_win(user_id)
+        return board
+
+    def export(self):
+        """(user_id, wins) pairs in internal order, see restore()"""
+        return [(user_id, level) for level in self._levels for user_id in self._buckets[level]]
+
+    @classmethod
+    def restore(cls, pairs):
+        """Rebuild a leaderboard, tie order included, from export() output"""
+        board = cls()
+        for user_id, wins in pairs:
+            bucket = board._buckets.get(wins)
+            if bucket is None:
+                bucket = board._buckets[wins] = {}
+                board._levels.append(wins)
+            bucket[user_id] = None
+            board._wins[user_id] = wins
+        return board
+
+
+def period_key(period, moment):
+    """Bucket (e.g. 2026-10-17, 2026-W42, 2026-10) a naive UTC datetime falls into"""
+    if period == "day":
+        return moment.strftime("%Y-%m-%d")
+    if period == "week":
+        year, week, _ = moment.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "month":
+        return moment.strftime("%Y-%m")
+    raise ValueError(f"Unknown leaderboard period: {period}")
+
+
+def period_start(period, moment):
+    """First moment of the period that contains ``moment``"""
+    day = datetime(moment.year, moment.month, moment.day)
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown leaderboard period: {period}")
+
+
+class PeriodLeaderboards:
+    """
+    Win leaderboards for the current day, week and month, overall and per
+    difficulty
+    """
+
+    def __init__(self):
+        self._boards = {}   # (period, difficulty or None) -> (period key, WinLeaderboard)
+
+    def record_win(self, user_id, moment, difficulty=None):
+        """Count a win at ``moment`` (naive UTC datetime) in every period"""
+        for period in PERIODS:
+            key = period_key(period, moment)
+            for scope in ((period, None), (period, difficulty)) if difficulty else ((period, None),):
+                current, board = self._boards.get(scope, (None, None))
+                if key != current:
+                    if current is not None and key < current:
+                        continue  # late win for a period that is already over
+                    board = WinLeaderboard()
+                    self._boards[scope] = (key, board)
+                board.record_win(user_id)
+
+    def board(self, period, now, difficulty=None):
+        """Leaderboard of the period containing ``now`` (empty if nobody won yet)"""
+        key, board = self._boards.get((period, difficulty), (None, None))
+        if key != period_key(period, now):
+            return WinLeaderboard()
+        return board
+
+    def top(self, period, limit, now, difficulty=None):
+        """Up to ``limit`` (user_id, wins) pairs for the period containing ``now``"""
+        return self.board(period, now, difficulty).top(limit)
+
+    @classmethod
+    def from_wins(cls, wins):
+        """Build the boards from (user_id, moment, difficulty) triples, oldest first"""
+        boards = cls()
+        for user_id, moment, difficulty in wins:
+            boards.record_win(user_id, moment, difficulty)
+        return boards
+
+
+class SortedKeys:
+    """
+    Sorted list of unique keys split into chunks of at most ``2 * chunk``
+    keys, plus the last key of every chunk. Adding or removing a key bisects
+    the chunk maxima and then moves at most one chunk's worth of keys, so an
+    update costs O(log n + chunk) instead of the O(n) memmove of one flat
+    list.
+    """
+
+    def __init__(self, keys=(), chunk=512):
+        self._chunk = chunk
+        keys = list(keys)
+        self._chunks = [keys[start:start + chunk] for start in range(0, len(keys), chunk)]
+        self._maxes = [keys[-1] for keys in self._chunks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._chunks)
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+        else:
+            index = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+            keys = self._chunks[index]
+            insort(keys, key)
+            self._maxes[index] = keys[-1]
+            if len(keys) > 2 * self._chunk:
+                self._chunks.insert(index + 1, keys[self._chunk:])
+                del keys[self._chunk:]
+                self._maxes.insert(index, keys[-1])
+        self._len += 1
+
+    def remove(self, key):
+        """Remove a key that is present"""
+        index = bisect_left(self._maxes, key)
+        keys = self._chunks[index]
+        del keys[bisect_left(keys, key)]
+        if keys:
+            self._maxes[index] = keys[-1]
+        else:
+            del self._chunks[index]
+            del self._maxes[index]
+        self._len -= 1
+
+
+class WinRateRanking:
+    """
+    Players with at least ``min_games`` games, ordered by win rate, then by
+    number of games, then by user id. Kept as SortedKeys that are updated in
+    place whenever a player's counters change.
+    """
+
+    def __init__(self, min_games):
+        self.min_games = min_games
+        self._keys = SortedKeys()   # (-win rate, -games, user_id, wins), ascending
+        self._key_of = {}           # user_id -> its key in _keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _key(user_id, wins, games):
+        return (-wins / games, -games, user_id, wins)
+
+    def update(self, user_id, wins, games):
+        """Move a player to the position for their new counters"""
+        old = self._key_of.pop(user_id, None)
+        if old is not None:
+            self._keys.remove(old)
+        if games >= self.min_games and games > 0:
+            key = self._key_of[user_id] = self._key(user_id, wins, games)
+            self._keys.add(key)
+
+    def top(self, limit, min_games=0):
+        """
+        Up to ``limit`` (user_id, wins, games) triples, best win rate first.
+        A ``min_games`` above the ranking's own skips the players below it, so
+        the scan is bounded by the players between two WIN_RATE_TIERS.
+        """
+        result = []
+        if limit <= 0:
+            return result
+        for _, negative_games, user_id, wins in self._keys:
+            if -negative_games >= min_games:
+                result.append((user_id, wins, -negative_games))
+                if len(result) == limit:
+                    break
+        return result
+
+    @classmethod
+    def from_counts(cls, min_games, counts):
+        """Build a ranking from (user_id, wins, games) triples with one sort"""
+        ranking = cls(min_games)
+        ranking._key_of = {
+            user_id: cls._key(user_id, wins, games)
+            for user_id, wins, games in counts
+            if games >= min_games and games > 0
+        }
+        ranking._keys = SortedKeys(sorted(ranking._key_of.values()))
+        return ranking
+
+
+# Win-rate rankings are kept for these minimum numbers of games; a query
+# reads the largest tier not above its threshold and skips the rest
+WIN_RATE_TIERS = (1, 5, 10, 25, 50, 100)
+
+
+class Rankings:
+    """
+    All-time rankings besides the overall win leaderboard: wins per
+    difficulty, and win rate overall and per difficulty for each tier of
+    WIN_RATE_TIERS. Everything is updated one game at a time.
+    """
+
+    def __init__(self, difficulties, wins=None):
+        self.wins = wins if wins is not None else {difficulty: WinLeaderboard() for difficulty in difficulties}
+        self.win_rates = {
+            scope: [WinRateRanking(tier) for tier in WIN_RATE_TIERS]
+            for scope in (None,) + tuple(difficulties)
+        }
+
+    def record(self, user_id, difficulty, won, overall, in_difficulty):
+        """
+        Account for one game; ``overall`` and ``in_difficulty`` are the
+        player's (wins, games) after it, overall and in its difficulty
+        """
+        if won:
+            self.wins[difficulty].record_win(user_id)
+        for scope, (wins, games) in ((None, overall), (difficulty, in_difficulty)):
+            for ranking in self.win_rates[scope]:
+                if games < ranking.min_games:
+                    break
+                ranking.update(user_id, wins, games)
+
+    def top_wins(self, difficulty, limit):
+        """Up to ``limit`` (user_id, wins) pairs for one difficulty"""
+        return self.wins[difficulty].top(limit)
+
+    def top_win_rate(self, limit, min_games, difficulty=None):
+        """Up to ``limit`` (user_id, wins, games) triples by win rate"""
+        tiers = self.win_rates[difficulty]
+        ranking = tiers[0]
+        for candidate in tiers:
+            if candidate.min_games <= min_games:
+                ranking = candidate
+        return ranking.top(limit, min_games)
+
+    @classmethod
+    def from_counters(cls, difficulties, counters, wins):
+        """
+        Build the win-rate rankings from (user_id, wins, games, {difficulty:
+        (wins, games)}) per player. ``wins`` are the per-difficulty win boards,
+        which are kept with their tie order rather than derived from counters.
+        """
+        rankings = cls(difficulties, wins)
+        counters = sorted(counters)
+        for scope in rankings.win_rates:
+            if scope is None:
+                counts = [(user_id, wins, games) for user_id, wins, games, _ in counters]
+            else:
+                counts = [
+                    (user_id,) + by_difficulty[scope]
+                    for user_id, _, _, by_difficulty in counters
+                    if scope in by_difficulty
+                ]
+            rankings.win_rates[scope] = [WinRateRanking.from_counts(tier, counts) for tier in WIN_RATE_TIERS]
+        return rankings
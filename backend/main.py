@@ -1,28 +1,42 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select
 from typing import List, Optional
 import uvicorn
+import asyncio
 import os
+import secrets
 from datetime import datetime
 
-from database import get_db, init_db
-from models import User, GameResult, PromoCode
+from database import SessionLocal, get_db, init_db, close_db, pool_metrics
+from response_cache import FastJSONResponse, dumps, json_response, make_etag
+from engine import verify_games
+from sessions import SessionTable
+from models import User, GameResult, PromoCode, UserStats
 from schemas import (
     GameResultCreate, 
     GameResultResponse,
+    GameResultBatchItemResponse,
     UserStatsResponse,
     PromoCodeCreate,
     PromoCodeResponse,
-    PromoCodeValidation
+    PromoCodeValidation,
+    LeaderboardPeriod,
+    LeaderboardRanking,
+    DifficultyLevel
+)
+from crud import (
+    create_game_result, create_game_results_batch, get_user_stats, validate_promo_code,
+    promo_code_status, promo_code_pool_stats, get_period_leaderboard, get_ranking
 )
-from crud import create_game_result, get_user_stats, create_promo_code, validate_promo_code
 
 app = FastAPI(
     title="Rose Tic Tac Toe API",
     description="Backend API for Telegram Tic Tac Toe mini-app",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # Configure CORS for development
@@ -32,13 +46,45 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Admin operations are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str]):
+    """Reject admin calls without the configured token"""
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token required"
+        )
+
+# Games hosted over /ws/game; kept in this process only
+game_sessions = SessionTable()
+
+# Largest accepted /game-results/batch request
+MAX_BATCH_ITEMS = 100
+
+def invalid_games(items):
+    """(index, reason) for every item whose move list does not replay to its status"""
+    replayed = [(index, item) for index, item in enumerate(items) if item.moves is not None]
+    reasons = verify_games(
+        (item.moves, item.difficulty.value, item.player_symbol.value, item.status.value)
+        for _, item in replayed
+    )
+    return [(index, reason) for (index, _), reason in zip(replayed, reasons) if reason is not None]
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
     await init_db()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled database connections"""
+    await close_db()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -55,52 +101,154 @@ async def record_game_result(
     """
     Record game result from frontend
     """
+    invalid = invalid_games([game_data])
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid game: {invalid[0][1]}"
+        )
+    
     try:
-        # Get or create user
+        # Stores the result, its promo code for wins and the user's counters in one transaction
         result = await create_game_result(db, game_data)
+        return GameResultResponse(**result)
         
-        # Generate promo code for wins
-        promo_code = None
-        if game_data.status == "win":
-            promo_obj = await create_promo_code(
-                db, 
-                user_id=result.user_id, 
-                game_result_id=result.id
-            )
-            promo_code = promo_obj.code
-            
-        return GameResultResponse(
-            id=result.id,
-            user_id=result.user_id,
-            status=result.status,
-            difficulty=result.difficulty,
-            promo_code=promo_code,
-            created_at=result.created_at
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to record game result: {str(e)}"
+        )
+
+@app.post("/game-results/batch", response_model=List[GameResultBatchItemResponse])
+async def record_game_results_batch(
+    items: List[GameResultCreate],
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Record several game results (e.g. queued while offline) in one transaction
+    """
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_ITEMS} results per batch"
+        )
+    
+    # Checked up front, so a bad item never reaches the transaction
+    invalid = invalid_games(items)
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid games: " + "; ".join(f"item {index}: {reason}" for index, reason in invalid)
         )
+    
+    try:
+        recorded = await create_game_results_batch(db, items)
+        return [GameResultBatchItemResponse(**entry) for entry in recorded]
         
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to record game result: {str(e)}"
+            detail=f"Failed to record game results: {str(e)}"
         )
 
+def session_game(session):
+    """GameResultCreate for a game finished over /ws/game"""
+    return GameResultCreate(
+        user_id=session.user_id,
+        username=session.username,
+        status=session.result,
+        difficulty=session.difficulty,
+        # One result per session, however often the recording is retried
+        idempotency_key=f"session:{session.session_id}",
+        moves=list(session.moves),
+        player_symbol=session.player_symbol
+    )
+
+async def record_session_game(game_data):
+    """Store a finished game in its own short transaction, not one held for the whole connection"""
+    async with SessionLocal() as db:
+        return await create_game_result(db, game_data)
+
+async def send_message(websocket, message):
+    await websocket.send_text(dumps(message).decode("utf-8"))
+
+@app.websocket("/ws/game")
+async def game_session(websocket: WebSocket):
+    """
+    Play games hosted by the server; messages are described in sessions.py
+    """
+    await websocket.accept()
+    session = None
+    try:
+        while True:
+            try:
+                session, reply = game_sessions.handle(session, await websocket.receive_json())
+            except ValueError as e:
+                await send_message(websocket, {"type": "error", "detail": str(e)})
+                continue
+            
+            # Started before the reply goes out, so a client that leaves now still gets its result recorded
+            recording = None
+            if session.result is not None:
+                recording = asyncio.ensure_future(record_session_game(session_game(session)))
+            
+            await send_message(websocket, reply)
+            
+            if recording is not None:
+                try:
+                    result = await recording
+                    await send_message(websocket, {
+                        "type": "result",
+                        "game_result": jsonable_encoder(GameResultResponse(**result))
+                    })
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    await send_message(websocket, {"type": "error", "detail": f"Failed to record game result: {str(e)}"})
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/user/{user_id}/stats", response_model=UserStatsResponse)
 async def get_user_statistics(
     user_id: int,
+    if_none_match: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Get user statistics
     """
     try:
-        stats = await get_user_stats(db, user_id)
-        return stats
+        body = dumps(jsonable_encoder(await get_user_stats(db, user_id)))
+        return json_response(body, make_etag(body), if_none_match)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to retrieve user stats: {str(e)}"
         )
 
+def promo_code_rejection(code_status):
+    """HTTP error for a promo code that cannot be redeemed, as in the JSON backends"""
+    if code_status is None:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invalid promo code"
+        )
+    if code_status == "not_owner":
+        return HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Promo code belongs to another user"
+        )
+    if code_status == "expired":
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Promo code expired"
+        )
+    # Also "valid": a concurrent request redeemed it first
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Promo code already used"
+    )
+
 @app.post("/promo-code/validate", response_model=PromoCodeResponse)
 async def validate_promo_code_endpoint(
     validation_data: PromoCodeValidation,
@@ -117,9 +265,8 @@ async def validate_promo_code_endpoint(
         )
         
         if not promo_code:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Invalid or expired promo code"
+            raise promo_code_rejection(
+                await promo_code_status(db, validation_data.code, validation_data.user_id)
             )
             
         return PromoCodeResponse(
@@ -140,37 +287,74 @@ async def validate_promo_code_endpoint(
 @app.get("/leaderboard")
 async def get_leaderboard(
     limit: int = 10,
+    period: LeaderboardPeriod = LeaderboardPeriod.ALL,
+    difficulty: Optional[DifficultyLevel] = None,
+    rank_by: LeaderboardRanking = LeaderboardRanking.WINS,
+    min_games: int = 10,
+    if_none_match: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get leaderboard of top players
+    Get leaderboard of top players: by wins (all time or for the current UTC
+    day, week or month) or by all-time win rate among players with at least
+    min_games games, optionally for one difficulty
     """
+    if rank_by == LeaderboardRanking.WIN_RATE and period != LeaderboardPeriod.ALL:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Win-rate rankings are only available for period=all"
+        )
+    
     try:
-        # Get users with their win counts
-        stmt = (
-            select(
-                User.id,
-                User.username,
-                func.count(GameResult.id).label('wins')
+        if period != LeaderboardPeriod.ALL:
+            rows = await get_period_leaderboard(
+                db, period.value, limit, difficulty.value if difficulty else None
             )
-            .join(GameResult, User.id == GameResult.user_id)
-            .where(GameResult.status == 'win')
-            .group_by(User.id, User.username)
-            .order_by(func.count(GameResult.id).desc())
-            .limit(limit)
-        )
+        elif rank_by == LeaderboardRanking.WIN_RATE or difficulty is not None:
+            rows = await get_ranking(
+                db, difficulty.value if difficulty else None, rank_by.value, min_games, limit
+            )
+        else:
+            # Counters are maintained on insert, so this reads the top of ix_user_stats_wins
+            stmt = (
+                select(
+                    User.id,
+                    User.username,
+                    UserStats.wins
+                )
+                .join(UserStats, User.id == UserStats.user_id)
+                .where(UserStats.wins > 0)
+                .order_by(UserStats.wins.desc())
+                .limit(limit)
+            )
+            
+            result = await db.execute(stmt)
+            rows = result.all()
         
-        result = await db.execute(stmt)
-        leaderboard = result.all()
+        if rank_by == LeaderboardRanking.WIN_RATE:
+            leaderboard = [
+                {
+                    "user_id": row.id,
+                    "username": row.username,
+                    "wins": row.wins,
+                    "games": row.games,
+                    "win_rate": round(row.win_rate * 100, 2)
+                }
+                for row in rows
+            ]
+        else:
+            leaderboard = [
+                {
+                    "user_id": row.id,
+                    "username": row.username,
+                    "wins": row.wins
+                }
+                for row in rows
+            ]
         
-        return [
-            {
-                "user_id": row.id,
-                "username": row.username,
-                "wins": row.wins
-            }
-            for row in leaderboard
-        ]
+        # Rows are read fresh every time; the ETag only spares the client the body
+        body = dumps(leaderboard)
+        return json_response(body, make_etag(body), if_none_match)
         
     except Exception as e:
         raise HTTPException(
@@ -178,6 +362,30 @@ async def get_leaderboard(
             detail=f"Failed to retrieve leaderboard: {str(e)}"
         )
 
+@app.get("/admin/db/metrics")
+async def db_metrics(x_admin_token: Optional[str] = Header(None)):
+    """
+    Connection pool occupancy and counters
+    """
+    require_admin(x_admin_token)
+    return pool_metrics()
+
+@app.get("/admin/sessions")
+async def game_session_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Active /ws/game sessions, evictions and message handling latency
+    """
+    require_admin(x_admin_token)
+    return game_sessions.stats()
+
+@app.get("/admin/promo-codes/pool")
+async def promo_code_pool(x_admin_token: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    """
+    Current promo code length and how many codes are left
+    """
+    require_admin(x_admin_token)
+    return await promo_code_pool_stats(db)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -0,0 +1,73 @@
+"""Initial schema: users, game_results, promo_codes
+
+Databases created by init_db() before it ran the migrations already have
+some or all of these tables; existing tables are left as they are, and the
+later revisions likewise skip what exists and rebuild their derived
+counters, so such databases need no ``alembic stamp``: ``alembic upgrade
+head`` (or starting main.py) brings them to the current schema.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("telegram_id", sa.Integer(), nullable=True),
+            sa.Column("username", sa.String(), nullable=True),
+            sa.Column("first_name", sa.String(), nullable=True),
+            sa.Column("last_name", sa.String(), nullable=True),
+            sa.Column("language_code", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_telegram_id", "users", ["telegram_id"], unique=True)
+
+    if "game_results" not in existing:
+        op.create_table(
+            "game_results",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("status", sa.Enum("WIN", "LOSS", "DRAW", name="gamestatus"), nullable=False),
+            sa.Column("difficulty", sa.Enum("RELAXED", "STRATEGIC", "MASTER", name="difficultylevel"), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_game_results_id", "game_results", ["id"])
+
+    if "promo_codes" not in existing:
+        op.create_table(
+            "promo_codes",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("code", sa.String(10), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("game_result_id", sa.Integer(), sa.ForeignKey("game_results.id"), nullable=True),
+            sa.Column("is_used", sa.Boolean(), nullable=True),
+            sa.Column("used_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_promo_codes_id", "promo_codes", ["id"])
+        op.create_index("ix_promo_codes_code", "promo_codes", ["code"], unique=True)
+
+
+def downgrade():
+    op.drop_table("promo_codes")
+    op.drop_table("game_results")
+    op.drop_table("users")
+    sa.Enum(name="difficultylevel").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="gamestatus").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,73 @@
+"""Composite indexes on game_results and the user_stats counter table
+
+The new table is backfilled from the existing game_results in the same
+migration; from then on crud.create_game_result keeps it up to date. Objects
+that an earlier init_db() created already are kept, and their counters
+rebuilt.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    indexes = {index["name"] for index in inspector.get_indexes("game_results")}
+    for name, columns in (
+        ("ix_game_results_user_status_difficulty", ["user_id", "status", "difficulty"]),
+        ("ix_game_results_user_difficulty", ["user_id", "difficulty"]),
+        ("ix_game_results_status_user", ["status", "user_id"]),
+    ):
+        if name not in indexes:
+            op.create_index(name, "game_results", columns)
+
+    if inspector.has_table("user_stats"):
+        # Created empty by init_db() over existing results; counted again below
+        op.execute("DELETE FROM user_stats")
+    else:
+        op.create_table(
+            "user_stats",
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("wins", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("losses", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("draws", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("relaxed_games", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("strategic_games", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("master_games", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_user_stats_wins", "user_stats", ["wins"])
+
+    # Enum columns store member names
+    op.execute(
+        """
+        INSERT INTO user_stats (user_id, wins, losses, draws, relaxed_games, strategic_games, master_games)
+        SELECT
+            user_id,
+            SUM(CASE WHEN status = 'WIN' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'LOSS' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'DRAW' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN difficulty = 'RELAXED' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN difficulty = 'STRATEGIC' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN difficulty = 'MASTER' THEN 1 ELSE 0 END)
+        FROM game_results
+        GROUP BY user_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_user_stats_wins", table_name="user_stats")
+    op.drop_table("user_stats")
+    op.drop_index("ix_game_results_status_user", table_name="game_results")
+    op.drop_index("ix_game_results_user_difficulty", table_name="game_results")
+    op.drop_index("ix_game_results_user_status_difficulty", table_name="game_results")
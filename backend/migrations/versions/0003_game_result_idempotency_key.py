@@ -0,0 +1,35 @@
+"""Client idempotency key on game_results
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Either may exist already when an earlier init_db() created the table
+    inspector = sa.inspect(op.get_bind())
+    if "idempotency_key" not in {column["name"] for column in inspector.get_columns("game_results")}:
+        with op.batch_alter_table("game_results") as batch_op:
+            batch_op.add_column(sa.Column("idempotency_key", sa.String(64), nullable=True))
+    if "ix_game_results_user_idempotency_key" not in {index["name"] for index in inspector.get_indexes("game_results")}:
+        op.create_index(
+            "ix_game_results_user_idempotency_key",
+            "game_results",
+            ["user_id", "idempotency_key"],
+            unique=True
+        )
+
+
+def downgrade():
+    op.drop_index("ix_game_results_user_idempotency_key", table_name="game_results")
+    with op.batch_alter_table("game_results") as batch_op:
+        batch_op.drop_column("idempotency_key")
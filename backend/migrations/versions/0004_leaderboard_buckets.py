@@ -0,0 +1,79 @@
+"""Per-period win counters for the day/week/month leaderboards
+
+Buckets of the periods in progress are backfilled from game_results; from
+then on crud.create_game_results_batch keeps them up to date. A table that an
+earlier init_db() created in the later per-difficulty layout is left to 0005,
+which rebuilds it.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+from leaderboard import PERIODS, period_key, period_start
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if inspector.has_table("leaderboard_buckets"):
+        if "difficulty" in {column["name"] for column in inspector.get_columns("leaderboard_buckets")}:
+            return
+        op.execute("DELETE FROM leaderboard_buckets")
+    else:
+        op.create_table(
+            "leaderboard_buckets",
+            sa.Column("period", sa.String(5), primary_key=True),
+            sa.Column("bucket", sa.String(10), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("wins", sa.Integer(), nullable=False, server_default="0"),
+        )
+        op.create_index(
+            "ix_leaderboard_buckets_period_bucket_wins",
+            "leaderboard_buckets",
+            ["period", "bucket", "wins"]
+        )
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    since = min(period_start(period, now) for period in PERIODS)
+    # Enum columns store member names
+    rows = op.get_bind().execute(
+        sa.text("SELECT user_id, created_at FROM game_results WHERE status = 'WIN' AND created_at >= :since"),
+        {"since": since}
+    )
+    counts = {}
+    for user_id, created_at in rows:
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        for period in PERIODS:
+            if created_at >= period_start(period, now):
+                key = (period, period_key(period, created_at), user_id)
+                counts[key] = counts.get(key, 0) + 1
+    if counts:
+        op.bulk_insert(
+            sa.table(
+                "leaderboard_buckets",
+                sa.column("period", sa.String), sa.column("bucket", sa.String),
+                sa.column("user_id", sa.Integer), sa.column("wins", sa.Integer),
+            ),
+            [
+                {"period": period, "bucket": bucket, "user_id": user_id, "wins": wins}
+                for (period, bucket, user_id), wins in counts.items()
+            ]
+        )
+
+
+def downgrade():
+    op.drop_index("ix_leaderboard_buckets_period_bucket_wins", table_name="leaderboard_buckets")
+    op.drop_table("leaderboard_buckets")
@@ -0,0 +1,131 @@
+"""Per-difficulty and win-rate rankings
+
+Adds ranking_stats (wins, games and win rate per user, overall and per
+difficulty) and a difficulty column on leaderboard_buckets. Both only hold
+derived counters, so they are rebuilt from game_results here, also when an
+earlier init_db() created them already; from then on
+crud.create_game_results_batch keeps them up to date.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+from leaderboard import PERIODS, period_key, period_start
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if inspector.has_table("ranking_stats"):
+        op.execute("DELETE FROM ranking_stats")
+    else:
+        op.create_table(
+            "ranking_stats",
+            sa.Column("difficulty", sa.String(9), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("wins", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("games", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("win_rate", sa.Float(), nullable=False, server_default="0"),
+        )
+        op.create_index("ix_ranking_stats_difficulty_wins", "ranking_stats", ["difficulty", "wins"])
+        op.create_index("ix_ranking_stats_difficulty_win_rate", "ranking_stats", ["difficulty", "win_rate", "games"])
+
+    # Enum columns store member names
+    for scope, difficulty in (("'all'", None), ("'relaxed'", "RELAXED"),
+                              ("'strategic'", "STRATEGIC"), ("'master'", "MASTER")):
+        where = f"WHERE difficulty = '{difficulty}'" if difficulty else ""
+        op.execute(
+            f"""
+            INSERT INTO ranking_stats (difficulty, user_id, wins, games, win_rate)
+            SELECT
+                {scope},
+                user_id,
+                SUM(CASE WHEN status = 'WIN' THEN 1 ELSE 0 END),
+                COUNT(*),
+                SUM(CASE WHEN status = 'WIN' THEN 1 ELSE 0 END) * 1.0 / COUNT(*)
+            FROM game_results
+            {where}
+            GROUP BY user_id
+            """
+        )
+
+    # Dropping the table drops whichever index it carries
+    op.drop_table("leaderboard_buckets")
+    op.create_table(
+        "leaderboard_buckets",
+        sa.Column("period", sa.String(5), primary_key=True),
+        sa.Column("bucket", sa.String(10), primary_key=True),
+        sa.Column("difficulty", sa.String(9), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("wins", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index(
+        "ix_leaderboard_buckets_period_bucket_difficulty_wins",
+        "leaderboard_buckets",
+        ["period", "bucket", "difficulty", "wins"]
+    )
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    since = min(period_start(period, now) for period in PERIODS)
+    rows = op.get_bind().execute(
+        sa.text(
+            "SELECT user_id, difficulty, created_at FROM game_results "
+            "WHERE status = 'WIN' AND created_at >= :since"
+        ),
+        {"since": since}
+    )
+    counts = {}
+    for user_id, difficulty, created_at in rows:
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        for period in PERIODS:
+            if created_at >= period_start(period, now):
+                for scope in ("all", difficulty.lower()):
+                    key = (period, period_key(period, created_at), scope, user_id)
+                    counts[key] = counts.get(key, 0) + 1
+    if counts:
+        op.bulk_insert(
+            sa.table(
+                "leaderboard_buckets",
+                sa.column("period", sa.String), sa.column("bucket", sa.String),
+                sa.column("difficulty", sa.String), sa.column("user_id", sa.Integer),
+                sa.column("wins", sa.Integer),
+            ),
+            [
+                {"period": period, "bucket": bucket, "difficulty": scope, "user_id": user_id, "wins": wins}
+                for (period, bucket, scope, user_id), wins in counts.items()
+            ]
+        )
+
+
+def downgrade():
+    op.drop_index("ix_leaderboard_buckets_period_bucket_difficulty_wins", table_name="leaderboard_buckets")
+    op.drop_table("leaderboard_buckets")
+    op.create_table(
+        "leaderboard_buckets",
+        sa.Column("period", sa.String(5), primary_key=True),
+        sa.Column("bucket", sa.String(10), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("wins", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index(
+        "ix_leaderboard_buckets_period_bucket_wins",
+        "leaderboard_buckets",
+        ["period", "bucket", "wins"]
+    )
+
+    op.drop_index("ix_ranking_stats_difficulty_win_rate", table_name="ranking_stats")
+    op.drop_index("ix_ranking_stats_difficulty_wins", table_name="ranking_stats")
+    op.drop_table("ranking_stats")
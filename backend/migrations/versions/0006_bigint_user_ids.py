@@ -0,0 +1,44 @@
+"""64-bit user ids
+
+users.id is the Telegram user id, which no longer fits in a 32-bit integer,
+so it and every column that references it become BIGINT. SQLite integers
+are 64-bit already, so only other databases are altered.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+# Columns holding a user id
+USER_ID_COLUMNS = (
+    ("users", "id"),
+    ("users", "telegram_id"),
+    ("game_results", "user_id"),
+    ("promo_codes", "user_id"),
+    ("user_stats", "user_id"),
+    ("leaderboard_buckets", "user_id"),
+    ("ranking_stats", "user_id"),
+)
+
+
+def _alter(type_, existing_type):
+    if op.get_bind().dialect.name == "sqlite":
+        return
+    for table, column in USER_ID_COLUMNS:
+        op.alter_column(table, column, type_=type_, existing_type=existing_type)
+
+
+def upgrade():
+    _alter(sa.BigInteger(), sa.Integer())
+
+
+def downgrade():
+    _alter(sa.Integer(), sa.BigInteger())
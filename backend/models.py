@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, ForeignKey, Enum, Boolean, Index, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.asyncio import AsyncAttrs
@@ -26,8 +26,9 @@ class DifficultyLevel(PyEnum):
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True, index=True)
-    telegram_id = Column(Integer, unique=True, index=True)
+    # Telegram user ids, which do not fit in 32 bits
+    id = Column(BigInteger, primary_key=True, index=True)
+    telegram_id = Column(BigInteger, unique=True, index=True)
     username = Column(String, nullable=True)
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
@@ -38,26 +39,38 @@ class User(Base):
     # Relationships
     game_results = relationship("GameResult", back_populates="user")
     promo_codes = relationship("PromoCode", back_populates="user")
+    stats = relationship("UserStats", back_populates="user", uselist=False)
 
 class GameResult(Base):
     __tablename__ = "game_results"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
     status = Column(Enum(GameStatus), nullable=False)
     difficulty = Column(Enum(DifficultyLevel), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Client-generated key that makes resubmissions idempotent
+    idempotency_key = Column(String(64), nullable=True)
     
     # Relationships
     user = relationship("User", back_populates="game_results")
     promo_codes = relationship("PromoCode", back_populates="game_result")
 
+    __table_args__ = (
+        # Covers per-user stats (filter on user, group by status/difficulty)
+        Index("ix_game_results_user_status_difficulty", "user_id", "status", "difficulty"),
+        Index("ix_game_results_user_difficulty", "user_id", "difficulty"),
+        # Covers counting wins per user
+        Index("ix_game_results_status_user", "status", "user_id"),
+        Index("ix_game_results_user_idempotency_key", "user_id", "idempotency_key", unique=True),
+    )
+
 class PromoCode(Base):
     __tablename__ = "promo_codes"
     
     id = Column(Integer, primary_key=True, index=True)
     code = Column(String(10), unique=True, nullable=False, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
     game_result_id = Column(Integer, ForeignKey("game_results.id"), nullable=True)
     is_used = Column(Boolean, default=False)
     used_at = Column(DateTime(timezone=True), nullable=True)
@@ -66,4 +79,69 @@ class PromoCode(Base):
     
     # Relationships
     user = relationship("User", back_populates="promo_codes")
-    game_result = relationship("GameResult", back_populates="promo_codes")
\ No newline at end of file
+    game_result = relationship("GameResult", back_populates="promo_codes")
+
+class UserStats(Base):
+    """Per-user counters, updated in the same transaction as each GameResult insert"""
+    __tablename__ = "user_stats"
+    
+    user_id = Column(BigInteger, ForeignKey("users.id"), primary_key=True)
+    wins = Column(Integer, nullable=False, default=0, server_default="0")
+    losses = Column(Integer, nullable=False, default=0, server_default="0")
+    draws = Column(Integer, nullable=False, default=0, server_default="0")
+    relaxed_games = Column(Integer, nullable=False, default=0, server_default="0")
+    strategic_games = Column(Integer, nullable=False, default=0, server_default="0")
+    master_games = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    # Relationships
+    user = relationship("User", back_populates="stats")
+
+    __table_args__ = (
+        # Leaderboard reads the top of this index
+        Index("ix_user_stats_wins", "wins"),
+    )
+
+class LeaderboardBucket(Base):
+    """Wins per user in one calendar period (see leaderboard.period_key), updated on insert"""
+    __tablename__ = "leaderboard_buckets"
+    
+    period = Column(String(5), primary_key=True)   # day, week or month
+    bucket = Column(String(10), primary_key=True)  # 2026-10-17, 2026-W42 or 2026-10
+    difficulty = Column(String(9), primary_key=True)  # all, relaxed, strategic or master
+    user_id = Column(BigInteger, ForeignKey("users.id"), primary_key=True)
+    wins = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # A period leaderboard reads the top of one bucket
+        Index("ix_leaderboard_buckets_period_bucket_difficulty_wins", "period", "bucket", "difficulty", "wins"),
+    )
+
+class RankingStats(Base):
+    """All-time wins, games and win rate per user, overall and per difficulty, updated on insert"""
+    __tablename__ = "ranking_stats"
+    
+    difficulty = Column(String(9), primary_key=True)  # all, relaxed, strategic or master
+    user_id = Column(BigInteger, ForeignKey("users.id"), primary_key=True)
+    wins = Column(Integer, nullable=False, default=0, server_default="0")
+    games = Column(Integer, nullable=False, default=0, server_default="0")
+    win_rate = Column(Float, nullable=False, default=0.0, server_default="0")
+
+    __table_args__ = (
+        # Rankings read the top of one difficulty
+        Index("ix_ranking_stats_difficulty_wins", "difficulty", "wins"),
+        Index("ix_ranking_stats_difficulty_win_rate", "difficulty", "win_rate", "games"),
+    )
+
+# Counter column for each game status and difficulty
+STATUS_COLUMNS = {
+    GameStatus.WIN: "wins",
+    GameStatus.LOSS: "losses",
+    GameStatus.DRAW: "draws",
+}
+
+DIFFICULTY_COLUMNS = {
+    DifficultyLevel.RELAXED: "relaxed_games",
+    DifficultyLevel.STRATEGIC: "strategic_games",
+    DifficultyLevel.MASTER: "master_games",
+}
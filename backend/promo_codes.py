@@ -0,0 +1,340 @@
+"""
+Promo code allocation and the table of issued codes.
+
+Codes are numeric strings of a fixed length (5 digits to start with, i.e.
+10000-99999). The allocator hands out each code at most once, in O(1), by
+running a Fisher-Yates shuffle lazily: the pool of free codes is a virtual
+array of which only the slots that have been swapped are stored, so memory
+grows with the number of codes issued rather than the size of the space.
+
+When the free part of the current length drops below ``low_water`` of its
+capacity, allocation moves on to one digit more. This keeps codes hard to
+guess: a random guess never has more than a ``1 - low_water`` chance of
+hitting an issued code.
+
+Issued codes live in ``PromoCodeStore`` until they are redeemed or expire;
+after that a sweeper moves them to an archive, so the table only holds codes
+that can still be used plus recent history.
+"""
+
+import heapq
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+
+PROMO_CODE_LENGTH = 5
+PROMO_CODE_MAX_LENGTH = 10
+
+# How long a new promo code stays valid (0 = never expires)
+PROMO_CODE_TTL_DAYS = float(os.getenv("PROMO_CODE_TTL_DAYS", 30))
+
+# Only issue promo codes for wins submitted with a move list that replays to a win
+PROMO_CODES_REQUIRE_MOVES = os.getenv("PROMO_CODES_REQUIRE_MOVES", "0").lower() in ("1", "true", "yes")
+
+# Sweeper: how often it runs, how many codes it archives per write, and how
+# long redeemed or expired codes stay in the table before they are archived
+PROMO_SWEEP_INTERVAL = float(os.getenv("PROMO_SWEEP_INTERVAL", 300))
+PROMO_SWEEP_BATCH = int(os.getenv("PROMO_SWEEP_BATCH", 500))
+PROMO_ARCHIVE_AFTER_HOURS = float(os.getenv("PROMO_ARCHIVE_AFTER_HOURS", 24))
+
+
+def promo_expires_at(created_at):
+    """Expiry timestamp (ISO string) for a code issued at ``created_at``, or None"""
+    if not PROMO_CODE_TTL_DAYS:
+        return None
+    return (created_at + timedelta(days=PROMO_CODE_TTL_DAYS)).isoformat()
+
+
+def _epoch(timestamp):
+    """Seconds since the epoch for a stored ISO timestamp (naive means UTC)"""
+    if not timestamp:
+        return 0.0
+    value = datetime.fromisoformat(timestamp)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class PromoCodeSpaceExhausted(Exception):
+    """Every code up to the maximum length has been issued"""
+
+
+class PromoCodeAllocator:
+    """Hands out unique random promo codes and tracks how many are left"""
+
+    def __init__(self, length=PROMO_CODE_LENGTH, max_length=PROMO_CODE_MAX_LENGTH, low_water=0.1):
+        self.max_length = max_length
+        self.low_water = low_water
+        self._random = secrets.SystemRandom()
+        self._open(length)
+
+    def _open(self, length):
+        """Start drawing from a fresh space of ``length``-digit codes"""
+        self.length = length
+        self._base = 10 ** (length - 1)
+        self._capacity = 9 * self._base
+        self._remaining = self._capacity
+        self._slots = {}   # position -> code offset, only for swapped slots
+        self._where = {}   # code offset -> position, for offsets not in their own slot
+
+    def _value_at(self, position):
+        return self._slots.get(position, position)
+
+    def _take(self, position):
+        """Remove the code at ``position`` from the free part of the pool"""
+        last = self._remaining - 1
+        value = self._value_at(position)
+        if position != last:
+            moved = self._value_at(last)
+            self._slots[position] = moved
+            self._where[moved] = position
+        self._slots.pop(last, None)
+        self._where.pop(value, None)
+        self._remaining = last
+        return value
+
+    def allocate(self):
+        """A code that has never been handed out or reserved"""
+        if self._remaining <= self._capacity * self.low_water and self.length < self.max_length:
+            self._open(self.length + 1)
+        if self._remaining == 0:
+            raise PromoCodeSpaceExhausted(f"All {self.length}-digit promo codes are taken")
+        return str(self._base + self._take(self._random.randrange(self._remaining)))
+
+    def reserve(self, code):
+        """Take a code issued elsewhere (earlier runs, other processes) out of the pool"""
+        if not code.isdigit() or len(code) < self.length:
+            return
+        if len(code) > self.length:
+            # Someone else already widened; follow them
+            self._open(len(code))
+        value = int(code) - self._base
+        position = self._where.get(value, value)
+        if position < self._remaining and self._value_at(position) == value:
+            self._take(position)
+
+    def export_state(self):
+        """
+        (settings, positions, values): the free-pool state as two parallel
+        integer sequences plus a small dict, see from_state()
+        """
+        settings = {
+            "length": self.length,
+            "max_length": self.max_length,
+            "low_water": self.low_water,
+            "remaining": self._remaining,
+        }
+        return settings, list(self._slots), list(self._slots.values())
+
+    @classmethod
+    def from_state(cls, settings, positions, values):
+        """Rebuild an allocator from export_state() output"""
+        allocator = cls(settings["length"], settings["max_length"], settings["low_water"])
+        allocator._remaining = settings["remaining"]
+        allocator._slots = dict(zip(positions, values))
+        # Only swapped slots are stored, and each holds a different offset
+        allocator._where = dict(zip(values, positions))
+        return allocator
+
+    def issued(self, code):
+        """
+        Whether a code has been handed out or reserved. Codes shorter than the
+        current length count as issued: their space was at least
+        ``1 - low_water`` full when allocation moved on.
+        """
+        if not code.isdigit() or len(code) > self.length:
+            return False
+        if len(code) < self.length:
+            return len(code) >= PROMO_CODE_LENGTH
+        value = int(code) - self._base
+        if value < 0:
+            return False
+        position = self._where.get(value, value)
+        return not (position < self._remaining and self._value_at(position) == value)
+
+    def stats(self):
+        """Current code length and how many codes of that length are left"""
+        return {
+            "length": self.length,
+            "capacity": self._capacity,
+            "issued": self._capacity - self._remaining,
+            "remaining": self._remaining,
+            # Codes left before allocation widens to the next length
+            "remaining_before_widening": max(0, self._remaining - int(self._capacity * self.low_water))
+            if self.length < self.max_length else self._remaining,
+        }
+
+
+# Positions in a PromoCodeStore entry
+_USER_ID, _GAME_RESULT_ID, _CREATED_AT, _EXPIRES_AT, _EXPIRES, _USED_AT = range(6)
+
+
+class PromoCodeStore:
+    """
+    Issued promo codes that have not been archived yet, keyed by code.
+
+    Entries are tuples (user_id, game_result_id, created_at, expires_at,
+    expiry epoch, used_at) rather than dicts; a code is unused while used_at
+    is None. Unused
+    codes with an expiry also sit in a heap ordered by expiry, and redeemed
+    codes in a queue ordered by redemption time, so finding what to archive
+    never scans the table.
+    """
+
+    def __init__(self):
+        self._codes = {}
+        self._expiring = []   # heap of (expires epoch, code); stale entries are skipped
+        self._redeemed = {}   # code -> used epoch, oldest redemption first
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __contains__(self, code):
+        return code in self._codes
+
+    def __iter__(self):
+        return iter(self._codes)
+
+    @classmethod
+    def from_dicts(cls, promos):
+        """Build the table from promo dicts in the snapshot layout"""
+        table = cls()
+        redeemed = []
+        for promo in promos:
+            entry = table._put(promo)
+            if entry[_USED_AT] is not None:
+                redeemed.append((_epoch(entry[_USED_AT]), promo["code"]))
+        # Snapshot order is issue order, the queue wants redemption order
+        redeemed.sort()
+        table._redeemed = {code: used for used, code in redeemed}
+        return table
+
+    def add(self, promo):
+        """Store a newly issued code (a promo dict in the snapshot layout)"""
+        entry = self._put(promo)
+        if entry[_USED_AT] is not None:
+            self._redeemed[promo["code"]] = _epoch(entry[_USED_AT])
+
+    def _put(self, promo):
+        used_at = None
+        if promo.get("is_used"):
+            used_at = promo.get("used_at") or ""
+        expires_at = promo.get("expires_at")
+        entry = (
+            promo["user_id"],
+            promo.get("game_result_id"),
+            promo.get("created_at"),
+            expires_at,
+            _epoch(expires_at) if expires_at else None,
+            used_at,
+        )
+        self._codes[promo["code"]] = entry
+        if used_at is None and expires_at:
+            heapq.heappush(self._expiring, (entry[_EXPIRES], promo["code"]))
+        return entry
+
+    def get(self, code):
+        """A code as a promo dict in the snapshot layout, or None"""
+        entry = self._codes.get(code)
+        if entry is None:
+            return None
+        return _as_dict(code, entry)
+
+    def owner(self, code):
+        """User the code was issued to, or None"""
+        entry = self._codes.get(code)
+        return entry[_USER_ID] if entry else None
+
+    def status(self, code, now):
+        """
+        "valid", "used" or "expired" at epoch time ``now``, or None for codes
+        that are not in the table
+        """
+        entry = self._codes.get(code)
+        if entry is None:
+            return None
+        if entry[_USED_AT] is not None:
+            return "used"
+        if entry[_EXPIRES] is not None and entry[_EXPIRES] <= now:
+            return "expired"
+        return "valid"
+
+    def check(self, code, user_id, now):
+        """
+        Whether ``user_id`` can redeem a code at epoch time ``now``: "valid",
+        "not_owner", "used", "expired", or None for codes not in the table
+        """
+        code_status = self.status(code, now)
+        if code_status is not None and self._codes[code][_USER_ID] != user_id:
+            return "not_owner"
+        return code_status
+
+    def redeem(self, code, used_at):
+        """Mark a code as used"""
+        entry = self._codes[code]
+        self._codes[code] = entry[:_USED_AT] + (used_at,)
+        self._redeemed[code] = _epoch(used_at)
+
+    def remove(self, code):
+        """Drop a code from the table (its heap entry goes stale)"""
+        self._codes.pop(code, None)
+        self._redeemed.pop(code, None)
+
+    def due_for_archive(self, now, grace_seconds, limit):
+        """
+        Up to ``limit`` (promo dict, reason) pairs for codes that were redeemed
+        or expired more than ``grace_seconds`` before ``now``. Expired codes are
+        taken off the expiry heap.
+        """
+        cutoff = now - grace_seconds
+        due = []
+        for code, used in self._redeemed.items():
+            if used > cutoff or len(due) >= limit:
+                break
+            due.append((_as_dict(code, self._codes[code]), "redeemed"))
+
+        expiring = self._expiring
+        while expiring and expiring[0][0] <= cutoff and len(due) < limit:
+            expires, code = heapq.heappop(expiring)
+            entry = self._codes.get(code)
+            if entry is None or entry[_USED_AT] is not None or entry[_EXPIRES] != expires:
+                continue  # redeemed or archived since it was pushed
+            due.append((_as_dict(code, entry), "expired"))
+        return due
+
+    def snapshot(self):
+        """Frozen copy for serialising in another thread, see to_json()"""
+        return PromoCodeSnapshot(dict(self._codes))
+
+    def stats(self):
+        """Sizes of the table and its queues"""
+        return {
+            "codes": len(self._codes),
+            "unused": len(self._codes) - len(self._redeemed),
+            "redeemed": len(self._redeemed),
+            "expiry_queue": len(self._expiring),
+        }
+
+
+class PromoCodeSnapshot:
+    """Copy of a PromoCodeStore's entries that can be turned into snapshot JSON"""
+
+    __slots__ = ("_codes",)
+
+    def __init__(self, codes):
+        self._codes = codes
+
+    def to_json(self):
+        return {code: _as_dict(code, entry) for code, entry in self._codes.items()}
+
+
+def _as_dict(code, entry):
+    return {
+        "code": code,
+        "user_id": entry[_USER_ID],
+        "game_result_id": entry[_GAME_RESULT_ID],
+        "is_used": entry[_USED_AT] is not None,
+        "created_at": entry[_CREATED_AT],
+        "expires_at": entry[_EXPIRES_AT],
+        "used_at": entry[_USED_AT] or None,
+    }
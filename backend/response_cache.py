@@ -0,0 +1,195 @@
+"""
+In-process cache for the read endpoints of the JSON file backends.
+
+Rendered responses (``/user/{id}/stats``, ``/leaderboard``) are kept in an
+LRU table with a TTL. The store reports every record it applies, whether
+written by this process or replayed from another one (see
+``DataStore.add_observer``), and the cache drops exactly the entries that
+record can change:
+
+- an entry depends on a set of users (the player of a stats response, every
+  player listed on a leaderboard); a new game or user record for one of them
+  drops it;
+- an entry may also watch game results of other players; leaderboards use
+  this to drop themselves only when the new result moves someone into the
+  listed rows (``DataStore.leaderboard_watch``).
+
+Entries hold the encoded JSON body, so a hit costs neither model
+construction nor serialisation, and carry a hash of it as ETag: clients that
+send If-None-Match get a bodiless 304 while the entry is unchanged. Bodies are
+encoded with orjson when it is installed and with the json module otherwise.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import status
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # optional, the json module produces the same output
+    orjson = None
+
+# Entries kept at most, and how long one may be served without a write dropping it
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+
+
+def dumps(value):
+    """Compact UTF-8 JSON bytes for a response value"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps()"""
+
+    def render(self, content):
+        return dumps(content)
+
+
+def make_etag(body):
+    """Strong ETag for an encoded response body"""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value covers ``etag``"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+def json_response(body, etag, if_none_match=None):
+    """Response for an encoded JSON body with its ETag, or 304 when the client already has it"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+class CachedResponse:
+    """One encoded response body and what invalidates it"""
+
+    __slots__ = ("body", "etag", "expires", "users", "watch")
+
+    def __init__(self, body, etag, expires, users, watch):
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+        self.users = users
+        self.watch = watch
+
+
+class ResponseCache:
+    """TTL + LRU table of rendered responses, invalidated by store records"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> CachedResponse, least recently used first
+        self._by_user = {}              # user_id -> keys of entries that depend on the user
+        self._watching = {}             # key -> watch predicate for other players' game results
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Live entry for ``key``, or None"""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires <= time.monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, value, users=(), watch=None):
+        """
+        Encode and store a response value that depends on ``users``;
+        ``watch(game_result)`` tells whether a game of another player changes it
+        """
+        if key in self._entries:
+            self._drop(key)
+        body = dumps(value)
+        entry = CachedResponse(body, make_etag(body), time.monotonic() + self.ttl, frozenset(users), watch)
+        if self.max_entries <= 0:
+            return entry
+        self._entries[key] = entry
+        for user_id in entry.users:
+            self._by_user.setdefault(user_id, set()).add(key)
+        if watch is not None:
+            self._watching[key] = watch
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+        self._watching.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
+
+    # Store observer
+
+    def applied(self, record):
+        """Drop the entries a record applied to the store can change"""
+        op = record["op"]
+        if op == "user":
+            self._invalidate_user(record["user"]["id"])
+        elif op == "game_result":
+            game_result = record["game_result"]
+            self._invalidate_user(game_result["user_id"])
+            changed = [key for key, watch in self._watching.items() if watch(game_result)]
+            for key in changed:
+                self._drop(key)
+            self.invalidations += len(changed)
+
+    def reset(self):
+        """The store state was replaced wholesale"""
+        self.invalidations += len(self._entries)
+        self.clear()
+
+    def _invalidate_user(self, user_id):
+        keys = self._by_user.get(user_id)
+        if keys:
+            self.invalidations += len(keys)
+            for key in list(keys):
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._watching.pop(key, None)
+        for user_id in entry.users:
+            keys = self._by_user[user_id]
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -13,6 +13,20 @@ class DifficultyLevel(str, Enum):
     STRATEGIC = "strategic"
     MASTER = "master"
 
+class PlayerSymbol(str, Enum):
+    DIAMOND = "diamond"
+    RING = "ring"
+
+class LeaderboardPeriod(str, Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+    ALL = "all"
+
+class LeaderboardRanking(str, Enum):
+    WINS = "wins"
+    WIN_RATE = "win_rate"
+
 # Request schemas
 class GameResultCreate(BaseModel):
     user_id: int = Field(..., description="Telegram user ID")
@@ -20,6 +34,14 @@ class GameResultCreate(BaseModel):
     status: GameStatus = Field(..., description="Game result status")
     difficulty: DifficultyLevel = Field(..., description="Game difficulty level")
     promo_code: Optional[str] = Field(None, description="Promo code for wins")
+    idempotency_key: Optional[str] = Field(None, max_length=64, description="Client-generated key; resubmitting it returns the original result")
+    moves: Optional[List[int]] = Field(None, max_length=9, description="Cells 0-8 in play order, diamond first; replayed before recording")
+    player_symbol: PlayerSymbol = Field(PlayerSymbol.DIAMOND, description="Symbol the player used")
+
+class PromoCodeCreate(BaseModel):
+    user_id: int = Field(..., description="Owner of the promo code")
+    game_result_id: Optional[int] = Field(None, description="Game that earned the code")
+    expires_at: Optional[datetime] = Field(None, description="When the code stops being valid")
 
 class PromoCodeValidation(BaseModel):
     code: str = Field(..., min_length=5, max_length=10, description="Promo code to validate")
@@ -37,6 +59,10 @@ class GameResultResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class GameResultBatchItemResponse(GameResultResponse):
+    idempotency_key: Optional[str] = None
+    duplicate: bool = False
+
 class UserStatsResponse(BaseModel):
     user_id: int
     username: Optional[str] = None
@@ -0,0 +1,254 @@
+"""
+Server-hosted game sessions.
+
+Over the ``/ws/game`` WebSocket the server owns the board: the client sends
+its moves, the server answers with the computer's move for the session's
+difficulty (``engine.choose_move``, the same choices as the client AI; master
+plays perfectly with ``engine.perfect_move`` unless
+``GAME_SESSION_PERFECT_MASTER`` is off) and, once the game is over, records
+the result with its full move list.
+
+Each game is one GameSession: a ``__slots__`` object holding the board code
+and the moves played so far. Sessions live in a SessionTable kept in
+least-recently-active order, so sessions idle for longer than
+``GAME_SESSION_IDLE_SECONDS`` are evicted from its front, lazily, whenever a
+session is opened or the table is inspected. A full table refuses new games
+instead of dropping an active one. A client that reconnects within the idle
+timeout resumes its game by session id.
+
+Messages are JSON objects:
+
+- ``{"type": "start", "user_id": ..., "username": ..., "difficulty": ...,
+  "player_symbol": ...}`` starts a game, ``{"type": "start", "user_id": ...,
+  "session_id": ...}`` resumes one;
+- ``{"type": "move", "cell": 0-8}`` plays a move.
+
+Each is answered with the session state (``GameSession.state``) or with
+``{"type": "error", "detail": ...}``.
+"""
+
+import os
+import random
+import secrets
+import time
+from collections import OrderedDict, deque
+
+import engine
+from columnar import DIFFICULTIES
+
+# Sessions kept at most, and seconds without a message before one is evicted
+GAME_SESSIONS_MAX = int(os.getenv("GAME_SESSIONS_MAX", 50000))
+GAME_SESSION_IDLE_SECONDS = float(os.getenv("GAME_SESSION_IDLE_SECONDS", 600))
+# Master plays minimax-optimal moves instead of the client's heuristic
+GAME_SESSION_PERFECT_MASTER = os.getenv("GAME_SESSION_PERFECT_MASTER", "1").lower() in ("1", "true", "yes")
+
+
+class SessionError(ValueError):
+    """A message that cannot be applied; reported to the client as an error message"""
+
+
+class GameSession:
+    """One game played against the server"""
+
+    __slots__ = (
+        "session_id", "user_id", "username", "difficulty", "player_symbol",
+        "code", "moves", "result", "last_active",
+    )
+
+    def __init__(self, session_id, user_id, username, difficulty, player_symbol, now):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.username = username
+        self.difficulty = difficulty
+        self.player_symbol = player_symbol
+        self.code = 0
+        self.moves = bytearray()
+        self.result = None
+        self.last_active = now
+
+    def computer_move(self, rng=random):
+        """Play the computer's move and return its cell"""
+        if self.difficulty == "master" and GAME_SESSION_PERFECT_MASTER:
+            cell = engine.perfect_move(self.code, rng)
+        else:
+            cell = engine.choose_move(self.code, self.difficulty, rng)
+        self._play(cell)
+        return cell
+
+    def move(self, cell, rng=random):
+        """Play the player's move and the computer's answer; returns the answer's cell or None"""
+        if self.result is not None:
+            raise SessionError("The game is over")
+        if type(cell) is not int or not 0 <= cell < 9:
+            raise SessionError(f"No such cell: {cell!r}")
+        if engine.to_move(self.code) != self.player_symbol:
+            raise SessionError("Not your turn")
+        try:
+            self._play(cell)
+        except ValueError:
+            raise SessionError(f"Cell {cell} is already taken")
+        if self.result is not None:
+            return None
+        return self.computer_move(rng)
+
+    def state(self, computer_move=None):
+        """State message sent to the client"""
+        return {
+            "type": "state",
+            "session_id": self.session_id,
+            "difficulty": self.difficulty,
+            "player_symbol": self.player_symbol,
+            "board": engine.decode(self.code),
+            "moves": list(self.moves),
+            "computer_move": computer_move,
+            "status": self.result or "playing",
+        }
+
+    def _play(self, cell):
+        self.code = engine.play(self.code, cell)
+        self.moves.append(cell)
+        self.result = engine.outcome(self.code, self.player_symbol)
+
+
+class SessionTable:
+    """Bounded table of game sessions with idle eviction"""
+
+    def __init__(self, max_sessions=GAME_SESSIONS_MAX, idle_seconds=GAME_SESSION_IDLE_SECONDS, window=1024):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()   # session_id -> GameSession, least recently active first
+        self.started = 0
+        self.finished = 0
+        self.evicted = 0
+        self.refused = 0
+        # Recent message handling times, in seconds
+        self._latencies = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def handle(self, session, message, rng=random):
+        """
+        Apply one client message to the connection's current session (None
+        before the first start). Returns the session now bound to the
+        connection and the reply; raises SessionError for bad messages.
+        Finished games leave the table.
+        """
+        started = time.perf_counter()
+        if not isinstance(message, dict):
+            raise SessionError("Messages must be JSON objects")
+        kind = message.get("type")
+        if kind == "start":
+            if message.get("session_id") is not None:
+                session = self.resume(message.get("session_id"), message.get("user_id"))
+                reply = session.state()
+            else:
+                session, computer_move = self.open(
+                    message.get("user_id"),
+                    message.get("username"),
+                    message.get("difficulty", "relaxed"),
+                    message.get("player_symbol", "diamond"),
+                    rng
+                )
+                reply = session.state(computer_move)
+        elif kind == "move":
+            if session is None:
+                raise SessionError("No game started")
+            if session.result is None:
+                self._check_live(session)
+            self.touch(session)
+            reply = session.state(session.move(message.get("cell"), rng))
+            if session.result is not None:
+                self.close(session)
+        else:
+            raise SessionError(f"Unknown message type: {kind!r}")
+        self._latencies.append(time.perf_counter() - started)
+        return session, reply
+
+    def open(self, user_id, username, difficulty, player_symbol, rng=random):
+        """
+        Start a game; the computer opens when the player has ring. Returns
+        the session and the computer's opening cell or None.
+        """
+        if type(user_id) is not int:
+            raise SessionError("user_id must be an integer")
+        if username is not None and not isinstance(username, str):
+            raise SessionError("username must be a string")
+        if difficulty not in DIFFICULTIES:
+            raise SessionError(f"Unknown difficulty: {difficulty!r}")
+        if player_symbol not in engine.SYMBOLS:
+            raise SessionError(f"Unknown player_symbol: {player_symbol!r}")
+
+        now = time.monotonic()
+        self.evict_idle(now)
+        if len(self._sessions) >= self.max_sessions:
+            self.refused += 1
+            raise SessionError("Too many active games, try again later")
+
+        session = GameSession(secrets.token_urlsafe(12), user_id, username, difficulty, player_symbol, now)
+        computer_move = session.computer_move(rng) if player_symbol == "ring" else None
+        self._sessions[session.session_id] = session
+        self.started += 1
+        return session, computer_move
+
+    def resume(self, session_id, user_id):
+        """Live session of ``user_id`` with ``session_id``"""
+        session = self._sessions.get(session_id) if isinstance(session_id, str) else None
+        if session is None or session.user_id != user_id:
+            raise SessionError("Unknown or expired session")
+        self._check_live(session)
+        self.touch(session)
+        return session
+
+    def touch(self, session):
+        session.last_active = time.monotonic()
+        if session.session_id in self._sessions:
+            self._sessions.move_to_end(session.session_id)
+
+    def close(self, session):
+        if self._sessions.pop(session.session_id, None) is not None and session.result is not None:
+            self.finished += 1
+
+    def evict_idle(self, now=None):
+        """Drop sessions idle for longer than the timeout; returns how many"""
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if not self._idle(session, now):
+                break
+            del self._sessions[session.session_id]
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def stats(self):
+        self.evict_idle()
+        latencies = sorted(self._latencies)
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_seconds": self.idle_seconds,
+            "started": self.started,
+            "finished": self.finished,
+            "evicted": self.evicted,
+            "refused": self.refused,
+            "message_ms_p50": _percentile_ms(latencies, 0.5),
+            "message_ms_p99": _percentile_ms(latencies, 0.99),
+            "message_ms_max": _percentile_ms(latencies, 1.0),
+            "perfect_master": GAME_SESSION_PERFECT_MASTER,
+            "transpositions": engine.transpositions.stats(),
+        }
+
+    def _check_live(self, session):
+        if session.session_id not in self._sessions or self._idle(session, time.monotonic()):
+            raise SessionError("Unknown or expired session")
+
+    def _idle(self, session, now):
+        return now - session.last_active > self.idle_seconds
+
+
+def _percentile_ms(values, q):
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
@@ -1,17 +1,26 @@
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Header, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
-import json
+import asyncio
 import os
 import secrets
+import time
 from enum import Enum
 
+from storage import DataStore, StoreWriter, PromoCodeSweeper, HistoryRoller
+from promo_codes import promo_expires_at, PROMO_CODES_REQUIRE_MOVES
+from engine import verify_games
+from leaderboard import period_key
+from response_cache import FastJSONResponse, ResponseCache, dumps, json_response
+from sessions import SessionTable
+
 app = FastAPI(
     title="Rose Tic Tac Toe API",
     description="Simple backend API for Telegram Tic Tac Toe mini-app",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # Configure CORS for development
@@ -21,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # Data models
@@ -34,12 +44,31 @@ class DifficultyLevel(str, Enum):
     STRATEGIC = "strategic"
     MASTER = "master"
 
+class PlayerSymbol(str, Enum):
+    DIAMOND = "diamond"
+    RING = "ring"
+
+class LeaderboardPeriod(str, Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+    ALL = "all"
+
+class LeaderboardRanking(str, Enum):
+    WINS = "wins"
+    WIN_RATE = "win_rate"
+
 class GameResultCreate(BaseModel):
     user_id: int
     username: Optional[str] = None
     status: GameStatus
     difficulty: DifficultyLevel
     promo_code: Optional[str] = None
+    # Client-generated key; resubmitting the same key returns the original result
+    idempotency_key: Optional[str] = Field(None, max_length=64)
+    # Optional full game: cells 0-8 in play order, diamond first; replayed before recording
+    moves: Optional[List[int]] = None
+    player_symbol: PlayerSymbol = PlayerSymbol.DIAMOND
 
 class GameResultResponse(BaseModel):
     id: int
@@ -49,6 +78,10 @@ class GameResultResponse(BaseModel):
     promo_code: Optional[str] = None
     created_at: str
 
+class GameResultBatchItemResponse(GameResultResponse):
+    idempotency_key: Optional[str] = None
+    duplicate: bool = False
+
 class UserStatsResponse(BaseModel):
     user_id: int
     username: Optional[str] = None
@@ -69,28 +102,47 @@ class PromoCodeResponse(BaseModel):
     used_at: Optional[str] = None
     created_at: str
 
+# Admin operations are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str]):
+    """Reject admin calls without the configured token"""
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token required"
+        )
+
 # File storage
 DATA_FILE = "game_data.json"
 
-def load_data():
-    """Load data from JSON file"""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {
-        "users": {},
-        "game_results": [],
-        "promo_codes": {}
-    }
+store = DataStore(DATA_FILE)
+writer = StoreWriter(store)
+sweeper = PromoCodeSweeper(store, writer)
+roller = HistoryRoller(store, writer)
+# Rendered /user/{id}/stats and /leaderboard responses, dropped by the writes that change them
+response_cache = ResponseCache()
+store.add_observer(response_cache)
+# Games hosted over /ws/game; kept in this process only
+game_sessions = SessionTable()
+
+# Largest accepted /game-results/batch request
+MAX_BATCH_ITEMS = 100
 
-def save_data(data):
-    """Save data to JSON file"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+@app.on_event("startup")
+async def startup_event():
+    """Load stored data into memory once on startup"""
+    await store.load_async()
+    writer.start()
+    sweeper.start()
+    roller.start()
 
-def generate_promo_code():
-    """Generate unique 5-digit promo code"""
-    return str(secrets.randbelow(90000) + 10000)
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued writes before exiting"""
+    await roller.stop()
+    await sweeper.stop()
+    await writer.stop()
 
 @app.get("/")
 async def root():
@@ -100,57 +152,96 @@ async def root():
         "timestamp": datetime.utcnow().isoformat()
     }
 
+def record_game(data, game_data):
+    """
+    Record one game inside a writer operation. Returns the stored game result
+    and whether it was already recorded under the same idempotency key.
+    """
+    if game_data.idempotency_key is not None:
+        existing = store.find_by_idempotency_key(game_data.user_id, game_data.idempotency_key)
+        if existing is not None:
+            return existing, True
+    
+    # Create or update user
+    user_id_str = str(game_data.user_id)
+    if user_id_str not in data["users"]:
+        store.add_user({
+            "id": game_data.user_id,
+            "username": game_data.username,
+            "created_at": datetime.utcnow().isoformat()
+        })
+    
+    # Create game result
+    result_id = store.next_game_result_id()
+    game_result = {
+        "id": result_id,
+        "user_id": game_data.user_id,
+        "status": game_data.status.value,
+        "difficulty": game_data.difficulty.value,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    if game_data.idempotency_key is not None:
+        game_result["idempotency_key"] = game_data.idempotency_key
+    
+    # Generate promo code for wins
+    promo_code = None
+    if game_data.status == GameStatus.WIN and (game_data.moves is not None or not PROMO_CODES_REQUIRE_MOVES):
+        promo_code = store.allocate_promo_code()
+        game_result["promo_code"] = promo_code
+    
+    store.add_game_result(game_result)
+    
+    if promo_code:
+        issued_at = datetime.utcnow()
+        store.add_promo_code({
+            "code": promo_code,
+            "user_id": game_data.user_id,
+            "game_result_id": result_id,
+            "is_used": False,
+            "created_at": issued_at.isoformat(),
+            "expires_at": promo_expires_at(issued_at),
+            "used_at": None
+        })
+    
+    return game_result, False
+
+def invalid_games(items):
+    """(index, reason) for every item whose move list does not replay to its status"""
+    replayed = [(index, item) for index, item in enumerate(items) if item.moves is not None]
+    reasons = verify_games(
+        (item.moves, item.difficulty.value, item.player_symbol.value, item.status.value)
+        for _, item in replayed
+    )
+    return [(index, reason) for (index, _), reason in zip(replayed, reasons) if reason is not None]
+
+def game_result_response(game_result, **extra):
+    """GameResultResponse fields of a stored game result as a plain dict"""
+    return {
+        "id": game_result["id"],
+        "user_id": game_result["user_id"],
+        "status": game_result["status"],
+        "difficulty": game_result["difficulty"],
+        "promo_code": game_result.get("promo_code"),
+        "created_at": game_result["created_at"],
+        **extra
+    }
+
 @app.post("/game-result", response_model=GameResultResponse)
 async def record_game_result(game_data: GameResultCreate):
     """Record game result from frontend"""
+    invalid = invalid_games([game_data])
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid game: {invalid[0][1]}"
+        )
+    
     try:
-        data = load_data()
+        # All writes go through the single writer task
+        game_result, _ = await writer.submit(lambda data: record_game(data, game_data))
         
-        # Create or update user
-        user_id_str = str(game_data.user_id)
-        if user_id_str not in data["users"]:
-            data["users"][user_id_str] = {
-                "id": game_data.user_id,
-                "username": game_data.username,
-                "created_at": datetime.utcnow().isoformat()
-            }
-        
-        # Create game result
-        result_id = len(data["game_results"]) + 1
-        game_result = {
-            "id": result_id,
-            "user_id": game_data.user_id,
-            "status": game_data.status,
-            "difficulty": game_data.difficulty,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        
-        data["game_results"].append(game_result)
-        
-        # Generate promo code for wins
-        promo_code = None
-        if game_data.status == GameStatus.WIN:
-            promo_code = generate_promo_code()
-            data["promo_codes"][promo_code] = {
-                "code": promo_code,
-                "user_id": game_data.user_id,
-                "game_result_id": result_id,
-                "is_used": False,
-                "created_at": datetime.utcnow().isoformat(),
-                "used_at": None
-            }
-            game_result["promo_code"] = promo_code
-        
-        save_data(data)
-        
-        return GameResultResponse(
-            id=result_id,
-            user_id=game_data.user_id,
-            status=game_data.status,
-            difficulty=game_data.difficulty,
-            promo_code=promo_code,
-            created_at=game_result["created_at"]
-        )
+        # Built and encoded directly, without a response model round trip
+        return FastJSONResponse(game_result_response(game_result))
         
     except Exception as e:
         raise HTTPException(
@@ -158,57 +249,143 @@ async def record_game_result(game_data: GameResultCreate):
             detail=f"Failed to record game result: {str(e)}"
         )
 
-@app.get("/user/{user_id}/stats", response_model=UserStatsResponse)
-async def get_user_statistics(user_id: int):
-    """Get user statistics"""
+@app.post("/game-results/batch", response_model=List[GameResultBatchItemResponse])
+async def record_game_results_batch(items: List[GameResultCreate]):
+    """Record several game results (e.g. queued while offline) in one commit"""
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_ITEMS} results per batch"
+        )
+    
+    # Checked up front, so a bad item never leaves the rest half-recorded
+    invalid = invalid_games(items)
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid games: " + "; ".join(f"item {index}: {reason}" for index, reason in invalid)
+        )
+    
     try:
-        data = load_data()
-        user_id_str = str(user_id)
+        # One writer operation, so the whole batch lands in a single append
+        recorded = await writer.submit(lambda data: [record_game(data, item) for item in items])
         
-        # Check if user exists
-        if user_id_str not in data["users"]:
-            return UserStatsResponse(
-                user_id=user_id,
-                username=None,
-                total_games=0,
-                wins=0,
-                losses=0,
-                draws=0,
-                win_rate=0.0,
-                favorite_difficulty=None
+        return FastJSONResponse([
+            game_result_response(
+                game_result,
+                idempotency_key=game_result.get("idempotency_key"),
+                duplicate=duplicate
             )
+            for game_result, duplicate in recorded
+        ])
         
-        user = data["users"][user_id_str]
-        user_games = [g for g in data["game_results"] if g["user_id"] == user_id]
-        
-        # Calculate statistics
-        total_games = len(user_games)
-        wins = len([g for g in user_games if g["status"] == "win"])
-        losses = len([g for g in user_games if g["status"] == "loss"])
-        draws = len([g for g in user_games if g["status"] == "draw"])
-        
-        win_rate = round(wins / total_games * 100, 2) if total_games > 0 else 0.0
-        
-        # Find favorite difficulty
-        difficulty_count = {}
-        for game in user_games:
-            diff = game["difficulty"]
-            difficulty_count[diff] = difficulty_count.get(diff, 0) + 1
-        
-        favorite_difficulty = None
-        if difficulty_count:
-            favorite_difficulty = max(difficulty_count, key=difficulty_count.get)
-        
-        return UserStatsResponse(
-            user_id=user_id,
-            username=user.get("username"),
-            total_games=total_games,
-            wins=wins,
-            losses=losses,
-            draws=draws,
-            win_rate=win_rate,
-            favorite_difficulty=favorite_difficulty
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to record game results: {str(e)}"
         )
+
+def session_game(session):
+    """GameResultCreate for a game finished over /ws/game"""
+    return GameResultCreate(
+        user_id=session.user_id,
+        username=session.username,
+        status=session.result,
+        difficulty=session.difficulty,
+        # One result per session, however often the recording is retried
+        idempotency_key=f"session:{session.session_id}",
+        moves=list(session.moves),
+        player_symbol=session.player_symbol
+    )
+
+async def send_message(websocket, message):
+    await websocket.send_text(dumps(message).decode("utf-8"))
+
+@app.websocket("/ws/game")
+async def game_session(websocket: WebSocket):
+    """Play games hosted by the server; messages are described in sessions.py"""
+    await websocket.accept()
+    session = None
+    try:
+        while True:
+            try:
+                session, reply = game_sessions.handle(session, await websocket.receive_json())
+            except ValueError as e:
+                await send_message(websocket, {"type": "error", "detail": str(e)})
+                continue
+            
+            # Started before the reply goes out, so a client that leaves now still gets its result recorded
+            recording = None
+            if session.result is not None:
+                game_data = session_game(session)
+                recording = asyncio.ensure_future(writer.submit(lambda data: record_game(data, game_data)))
+            
+            await send_message(websocket, reply)
+            
+            if recording is not None:
+                try:
+                    game_result, _ = await recording
+                    await send_message(websocket, {"type": "result", "game_result": game_result_response(game_result)})
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    await send_message(websocket, {"type": "error", "detail": f"Failed to record game result: {str(e)}"})
+    except WebSocketDisconnect:
+        pass
+
+def user_statistics(user_id):
+    """UserStatsResponse fields from the in-memory counters, as a plain dict"""
+    data = store.data
+    user_id_str = str(user_id)
+    
+    # Check if user exists
+    if user_id_str not in data["users"]:
+        return {
+            "user_id": user_id,
+            "username": None,
+            "total_games": 0,
+            "wins": 0,
+            "losses": 0,
+            "draws": 0,
+            "win_rate": 0.0,
+            "favorite_difficulty": None
+        }
+    
+    user = data["users"][user_id_str]
+    counters = store.user_index.get(user_id)
+    
+    # Calculate statistics
+    wins = counters["win"] if counters else 0
+    losses = counters["loss"] if counters else 0
+    draws = counters["draw"] if counters else 0
+    total_games = wins + losses + draws
+    
+    win_rate = round(wins / total_games * 100, 2) if total_games > 0 else 0.0
+    
+    # Find favorite difficulty
+    favorite_difficulty = store.user_index.favorite_difficulty(user_id)
+    
+    return {
+        "user_id": user_id,
+        "username": user.get("username"),
+        "total_games": total_games,
+        "wins": wins,
+        "losses": losses,
+        "draws": draws,
+        "win_rate": win_rate,
+        "favorite_difficulty": favorite_difficulty
+    }
+
+@app.get("/user/{user_id}/stats", response_model=UserStatsResponse)
+async def get_user_statistics(user_id: int, if_none_match: Optional[str] = Header(None)):
+    """Get user statistics"""
+    try:
+        await store.refresh()
+        cache_key = ("stats", user_id)
+        cached = response_cache.get(cache_key)
+        if cached is None:
+            cached = response_cache.put(cache_key, user_statistics(user_id), users=(user_id,))
+        return json_response(cached.body, cached.etag, if_none_match)
         
     except Exception as e:
         raise HTTPException(
@@ -216,32 +393,55 @@ async def get_user_statistics(user_id: int):
             detail=f"Failed to retrieve user stats: {str(e)}"
         )
 
+def promo_code_rejection(code, code_status):
+    """HTTP error for a promo code that cannot be redeemed"""
+    if code_status is None:
+        if store.promo_code_issued(code):
+            # Redeemed or expired long ago and already archived
+            return HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Promo code is no longer valid"
+            )
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invalid promo code"
+        )
+    if code_status == "not_owner":
+        return HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Promo code belongs to another user"
+        )
+    if code_status == "expired":
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Promo code expired"
+        )
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Promo code already used"
+    )
+
 @app.post("/promo-code/validate", response_model=PromoCodeResponse)
 async def validate_promo_code(validation_data: PromoCodeValidation):
     """Validate a promo code"""
     try:
-        data = load_data()
-        
-        # Check if promo code exists and is valid
-        if validation_data.code not in data["promo_codes"]:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Invalid promo code"
-            )
+        code = validation_data.code
+        user_id = validation_data.user_id
         
-        promo = data["promo_codes"][validation_data.code]
+        # A code never becomes redeemable again, so rejections need no writer round trip
+        await store.refresh()
+        code_status = store.promo_codes.check(code, user_id, time.time())
+        if code_status != "valid":
+            raise promo_code_rejection(code, code_status)
         
-        # Check if already used
-        if promo["is_used"]:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Promo code already used"
-            )
+        def redeem(data):
+            # Check and mark used in one step; a concurrent request may have won
+            code_status = store.redeem_promo_code(code, user_id, datetime.utcnow().isoformat(), time.time())
+            if code_status != "valid":
+                raise promo_code_rejection(code, code_status)
+            return store.promo_codes.get(code)
         
-        # Mark as used
-        promo["is_used"] = True
-        promo["used_at"] = datetime.utcnow().isoformat()
-        save_data(data)
+        promo = await writer.submit(redeem)
         
         return PromoCodeResponse(
             code=promo["code"],
@@ -259,36 +459,50 @@ async def validate_promo_code(validation_data: PromoCodeValidation):
         )
 
 @app.get("/leaderboard")
-async def get_leaderboard(limit: int = 10):
-    """Get leaderboard of top players"""
+async def get_leaderboard(
+    limit: int = 10,
+    period: LeaderboardPeriod = LeaderboardPeriod.ALL,
+    difficulty: Optional[DifficultyLevel] = None,
+    rank_by: LeaderboardRanking = LeaderboardRanking.WINS,
+    min_games: int = 10,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get leaderboard of top players: by wins (all time or for the current UTC
+    day, week or month) or by all-time win rate among players with at least
+    min_games games, optionally for one difficulty
+    """
+    if rank_by == LeaderboardRanking.WIN_RATE and period != LeaderboardPeriod.ALL:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Win-rate rankings are only available for period=all"
+        )
+    
     try:
-        data = load_data()
-        
-        # Count wins per user
-        user_wins = {}
-        user_names = {}
-        
-        for game in data["game_results"]:
-            if game["status"] == "win":
-                user_id = game["user_id"]
-                user_wins[user_id] = user_wins.get(user_id, 0) + 1
-                # Get username
-                user_id_str = str(user_id)
-                if user_id_str in data["users"]:
-                    user_names[user_id] = data["users"][user_id_str].get("username")
+        data = await store.refresh()
         
-        # Sort by wins and take top users
-        sorted_users = sorted(user_wins.items(), key=lambda x: x[1], reverse=True)[:limit]
-        
-        leaderboard = []
-        for user_id, wins in sorted_users:
-            leaderboard.append({
-                "user_id": user_id,
-                "username": user_names.get(user_id, f"User_{user_id}"),
-                "wins": wins
-            })
+        now = datetime.utcnow()
+        query = (limit, period.value, difficulty.value if difficulty else None, rank_by.value, min_games)
+        # The current period is part of the key, so boards roll over with it
+        cache_key = ("leaderboard", period_key(period.value, now) if period != LeaderboardPeriod.ALL else None) + query
+        cached = response_cache.get(cache_key)
+        if cached is None:
+            leaderboard = []
+            rows = store.leaderboard_top(*query, now=now)
+            for row in rows:
+                user = data["users"].get(str(row["user_id"]))
+                leaderboard.append({
+                    "user_id": row["user_id"],
+                    "username": user.get("username") if user else f"User_{row['user_id']}",
+                    **{key: value for key, value in row.items() if key != "user_id"}
+                })
+            cached = response_cache.put(
+                cache_key, leaderboard,
+                users=[row["user_id"] for row in rows],
+                watch=store.leaderboard_watch(rows, *query, now=now)
+            )
         
-        return leaderboard
+        return json_response(cached.body, cached.etag, if_none_match)
         
     except Exception as e:
         raise HTTPException(
@@ -296,6 +510,84 @@ async def get_leaderboard(limit: int = 10):
             detail=f"Failed to retrieve leaderboard: {str(e)}"
         )
 
+@app.post("/admin/leaderboard/rebuild")
+async def rebuild_leaderboard(x_admin_token: Optional[str] = Header(None)):
+    """Recompute the leaderboard from the full game history"""
+    require_admin(x_admin_token)
+    try:
+        await store.refresh()
+        players = store.rebuild_leaderboard()
+        return {"players": players}
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to rebuild leaderboard: {str(e)}"
+        )
+
+@app.get("/admin/storage/metrics")
+async def storage_metrics(x_admin_token: Optional[str] = Header(None)):
+    """Group-commit batch sizes and commit latencies"""
+    require_admin(x_admin_token)
+    return writer.metrics.snapshot()
+
+@app.get("/admin/cache")
+async def response_cache_stats(x_admin_token: Optional[str] = Header(None)):
+    """Response cache size, hit rate and invalidations"""
+    require_admin(x_admin_token)
+    return response_cache.stats()
+
+@app.get("/admin/sessions")
+async def game_session_stats(x_admin_token: Optional[str] = Header(None)):
+    """Active /ws/game sessions, evictions and message handling latency"""
+    require_admin(x_admin_token)
+    return game_sessions.stats()
+
+@app.get("/admin/promo-codes/pool")
+async def promo_code_pool(x_admin_token: Optional[str] = Header(None)):
+    """Current promo code length and how many codes are left"""
+    require_admin(x_admin_token)
+    await store.refresh()
+    return store.state.promo_allocator.stats()
+
+@app.get("/admin/promo-codes/store")
+async def promo_code_store(x_admin_token: Optional[str] = Header(None)):
+    """Promo codes still held in memory and what the sweeper archived"""
+    require_admin(x_admin_token)
+    await store.refresh()
+    return sweeper.stats()
+
+@app.post("/admin/promo-codes/sweep")
+async def sweep_promo_codes(x_admin_token: Optional[str] = Header(None)):
+    """Archive redeemed and expired promo codes now instead of waiting for the sweeper"""
+    require_admin(x_admin_token)
+    try:
+        return {"archived": await sweeper.sweep()}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to sweep promo codes: {str(e)}"
+        )
+
+@app.get("/admin/history")
+async def history_stats(x_admin_token: Optional[str] = Header(None)):
+    """Hot and archived game results, per-month counters and all-time totals"""
+    require_admin(x_admin_token)
+    await store.refresh()
+    return roller.stats()
+
+@app.post("/admin/history/roll")
+async def roll_history(x_admin_token: Optional[str] = Header(None)):
+    """Archive game results older than the hot window now instead of waiting for the roller"""
+    require_admin(x_admin_token)
+    try:
+        return {"archived": await roller.roll()}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to archive game history: {str(e)}"
+        )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,468 @@
+"""
+Binary snapshot format for the JSON file backends.
+
+A binary snapshot holds the same data as game_data.json plus the indexes
+derived from it, laid out so that loading is mostly memory copies:
+
+- a fixed header (magic, version, section table of name/offset/length);
+- game results as raw little-endian column sections (see columnar.py), so
+  the in-memory columns are filled straight from the mapped file;
+- per-user counters, leaderboard order (overall and per difficulty) and
+  promo code allocator state as fixed-width integer sections, so nothing has
+  to be replayed from the game history on start;
+- users, hot promo codes, the sparse per-row game result fields and the
+  counters of archived history (see history.py) as small JSON sections.
+
+The file is read through ``mmap``. Start-up cost depends on the number of
+users and unarchived promo codes, not on the length of the game history.
+``SnapshotReader`` gives read-only memoryviews over the mapped columns, so
+tools can scan a snapshot without loading it.
+
+The derived sections are computed from the archived history counters plus
+the game result columns when the snapshot is written (in the storage I/O
+thread), never from live state.
+
+Usage:
+    python snapshot.py convert game_data.json game_data.snap
+    python snapshot.py export game_data.snap game_data.json
+    python snapshot.py info game_data.snap
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import compress
+
+from columnar import DIFFICULTIES, GameResultColumns, iso_from_epoch_us
+from history import HistoryArchive, difficulty_leaderboards
+from leaderboard import WinLeaderboard
+from promo_codes import PromoCodeAllocator, PromoCodeStore
+
+MAGIC = b"RTTSNAP\0"
+VERSION = 2
+
+_HEADER = struct.Struct("<8sII")      # magic, version, number of sections
+_SECTION = struct.Struct("<16sQQ")    # name, offset, length
+_ALIGN = 8
+
+# Integer sections and their array type codes
+_TYPECODES = {
+    "gr.id": "q",
+    "gr.user": "q",
+    "gr.time": "q",
+    "gr.kind": "B",
+    "gr.promo": "q",
+    "user.ids": "q",
+    "user.stats": "q",
+    "user.dwins": "q",
+    "board": "q",
+    "board.diff": "q",
+    "alloc.pos": "q",
+    "alloc.val": "q",
+}
+
+# Fields per user in the user.stats section: win, loss, draw, games per
+# difficulty, difficulty order; rows follow the sorted user.ids section
+_USER_FIELDS = 3 + len(DIFFICULTIES) + 1
+# The user.dwins section holds wins per difficulty, in the same row order;
+# board.diff holds (difficulty index, user_id, wins) per player on each
+# per-difficulty board, in WinLeaderboard.export() order
+
+
+def _little_endian(values):
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _encode_order(difficulties):
+    """Difficulty indexes in first-played order, packed two bits each"""
+    order = 0
+    for position, difficulty in enumerate(difficulties):
+        order |= (DIFFICULTIES.index(difficulty) + 1) << (2 * position)
+    return order
+
+
+def _decode_order(order):
+    indexes = []
+    while order:
+        indexes.append((order & 3) - 1)
+        order >>= 2
+    return indexes
+
+
+def _derived_sections(columns, user_ids, kinds, promo_codes, extra, promos, history, allocator_state):
+    """
+    Per-user counters, leaderboard order and allocator state for the archived
+    history (HistoryArchive.to_json() output) followed by the columns
+    """
+    stats = {}
+    for user_id, win, loss, draw, difficulties, difficulty_wins in history.get("users", ()):
+        stats[user_id] = [
+            win, loss, draw,
+            {DIFFICULTIES.index(name): count for name, count in difficulties.items()},
+            {DIFFICULTIES.index(name): count for name, count in difficulty_wins.items()},
+        ]
+    # Counter keeps first-seen order, which is also the order in which each
+    # user first played each difficulty
+    for (user_id, kind), count in Counter(zip(user_ids, kinds)).items():
+        entry = stats.get(user_id)
+        if entry is None:
+            entry = stats[user_id] = [0, 0, 0, {}, {}]
+        status, difficulty = divmod(kind, len(DIFFICULTIES))
+        entry[status] += count
+        difficulties = entry[3]
+        difficulties[difficulty] = difficulties.get(difficulty, 0) + count
+        if status == 0:
+            entry[4][difficulty] = entry[4].get(difficulty, 0) + count
+
+    user_ids_sorted = array("q", sorted(stats))
+    user_stats = array("q")
+    user_difficulty_wins = array("q")
+    for user_id in user_ids_sorted:
+        win, loss, draw, difficulties, difficulty_wins = stats[user_id]
+        user_stats.extend((win, loss, draw))
+        user_stats.extend(difficulties.get(index, 0) for index in range(len(DIFFICULTIES)))
+        user_stats.append(_encode_order(DIFFICULTIES[index] for index in difficulties))
+        user_difficulty_wins.extend(difficulty_wins.get(index, 0) for index in range(len(DIFFICULTIES)))
+
+    leaderboard = WinLeaderboard.restore(history.get("leaderboard", ()))
+    for user_id in columns.winners():
+        leaderboard.record_win(user_id)
+    board = array("q")
+    for user_id, wins in leaderboard.export():
+        board.extend((user_id, wins))
+    difficulty_boards = array("q")
+    for difficulty, difficulty_board in difficulty_leaderboards(history).items():
+        for user_id in columns.winners(difficulty):
+            difficulty_board.record_win(user_id)
+        index = DIFFICULTIES.index(difficulty)
+        for user_id, wins in difficulty_board.export():
+            difficulty_boards.extend((index, user_id, wins))
+
+    if allocator_state is None:
+        # Snapshots converted from older JSON files: every issued code is
+        # still on its game result or in the promo code table
+        allocator = PromoCodeAllocator()
+        for code in compress(promo_codes, promo_codes):
+            allocator.reserve(str(code))
+        for fields in extra.values():
+            if isinstance(fields.get("promo_code"), str):
+                allocator.reserve(fields["promo_code"])
+        for promo in promos:
+            allocator.reserve(promo["code"])
+        allocator_state = promo_allocator_state(allocator)
+    settings, positions, values = (
+        allocator_state["settings"], allocator_state["positions"], allocator_state["values"]
+    )
+
+    return {
+        "user.ids": user_ids_sorted,
+        "user.stats": user_stats,
+        "user.dwins": user_difficulty_wins,
+        "board": board,
+        "board.diff": difficulty_boards,
+        "alloc": settings,
+        "alloc.pos": array("q", positions),
+        "alloc.val": array("q", values),
+    }
+
+
+def promo_allocator_state(allocator):
+    """Allocator state as stored in snapshots, see PromoCodeAllocator.export_state()"""
+    settings, positions, values = allocator.export_state()
+    return {"settings": settings, "positions": positions, "values": values}
+
+
+def write_snapshot(f, snapshot):
+    """
+    Write a snapshot dict (users, game_results as GameResultSnapshot,
+    promo_codes as PromoCodeSnapshot, and optionally history,
+    promo_allocator and log_generation as plain structures) to a binary file
+    object
+    """
+    ids, user_ids, created, kinds, promo_codes, extra = snapshot["game_results"].columns()
+    promos = list(snapshot["promo_codes"].to_json().values())
+    history = snapshot.get("history") or {}
+
+    sections = {
+        "meta": {
+            "game_results": len(ids),
+            "users": len(snapshot["users"]),
+            "promo_codes": len(promos),
+            "log_generation": snapshot.get("log_generation", 0),
+        },
+        "users": snapshot["users"],
+        "gr.id": ids,
+        "gr.user": user_ids,
+        "gr.time": created,
+        "gr.kind": kinds,
+        "gr.promo": promo_codes,
+        "gr.extra": {str(row): fields for row, fields in extra.items()},
+        "promos": promos,
+        "history": history,
+    }
+    columns = GameResultColumns.from_columns(ids, user_ids, created, kinds, promo_codes, extra)
+    sections.update(_derived_sections(
+        columns, user_ids, kinds, promo_codes, extra, promos, history, snapshot.get("promo_allocator")
+    ))
+
+    payloads = []
+    for name, value in sections.items():
+        if isinstance(value, array):
+            payloads.append((name, _little_endian(value).tobytes()))
+        else:
+            payloads.append((name, json.dumps(value, ensure_ascii=False).encode("utf-8")))
+
+    offset = _HEADER.size + _SECTION.size * len(payloads)
+    table = []
+    for name, payload in payloads:
+        offset += -offset % _ALIGN
+        table.append(_SECTION.pack(name.encode("ascii"), offset, len(payload)))
+        offset += len(payload)
+
+    f.write(_HEADER.pack(MAGIC, VERSION, len(payloads)))
+    f.write(b"".join(table))
+    position = _HEADER.size + _SECTION.size * len(payloads)
+    for name, payload in payloads:
+        padding = -position % _ALIGN
+        f.write(b"\0" * padding)
+        f.write(payload)
+        position += padding + len(payload)
+
+
+class SnapshotReader:
+    """Read-only view of a binary snapshot through mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._views = []
+        try:
+            magic, version, count = _HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a binary snapshot")
+            if version != VERSION:
+                raise ValueError(f"Unsupported snapshot version {version}")
+            self.sections = {}
+            for index in range(count):
+                name, offset, length = _SECTION.unpack_from(self._map, _HEADER.size + _SECTION.size * index)
+                self.sections[name.rstrip(b"\0").decode("ascii")] = (offset, length)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        self._map.close()
+
+    def raw(self, name):
+        """Zero-copy memoryview of a section's bytes"""
+        offset, length = self.sections[name]
+        view = self._view[offset:offset + length]
+        self._views.append(view)
+        return view
+
+    def column(self, name):
+        """Zero-copy memoryview of an integer section (little-endian hosts)"""
+        view = self.raw(name).cast(_TYPECODES[name])
+        self._views.append(view)
+        return view
+
+    def array(self, name):
+        """Copy of an integer section as an array"""
+        values = array(_TYPECODES[name])
+        values.frombytes(self.raw(name))
+        if sys.byteorder == "big" and values.itemsize > 1:
+            values.byteswap()
+        return values
+
+    def json(self, name):
+        return json.loads(bytes(self.raw(name)))
+
+
+class UserCounters:
+    """
+    Per-user counters from a snapshot, looked up by binary search over the
+    sorted user id section instead of being unpacked up front
+    """
+
+    def __init__(self, user_ids, stats, difficulty_wins):
+        self._user_ids = user_ids
+        self._stats = stats
+        self._difficulty_wins = difficulty_wins
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def get(self, user_id):
+        """
+        (win, loss, draw, {difficulty: games} in first-played order,
+        {difficulty: wins}), or None
+        """
+        index = bisect_left(self._user_ids, user_id)
+        if index == len(self._user_ids) or self._user_ids[index] != user_id:
+            return None
+        start = index * _USER_FIELDS
+        win, loss, draw = self._stats[start:start + 3]
+        counts = self._stats[start + 3:start + 3 + len(DIFFICULTIES)]
+        order = self._stats[start + 3 + len(DIFFICULTIES)]
+        wins = self._difficulty_wins[index * len(DIFFICULTIES):(index + 1) * len(DIFFICULTIES)]
+        return (
+            win, loss, draw,
+            {DIFFICULTIES[index]: counts[index] for index in _decode_order(order)},
+            {DIFFICULTIES[index]: wins[index] for index in range(len(DIFFICULTIES)) if wins[index]},
+        )
+
+
+class SnapshotContents:
+    """Everything read_snapshot() restores"""
+
+    def __init__(self, users, game_results, promo_codes, user_counters, leaderboard,
+                 difficulty_leaderboards, promo_allocator, idempotency_keys, history, log_generation):
+        self.users = users
+        self.game_results = game_results
+        self.promo_codes = promo_codes
+        self.user_counters = user_counters
+        self.leaderboard = leaderboard
+        self.difficulty_leaderboards = difficulty_leaderboards
+        self.promo_allocator = promo_allocator
+        self.idempotency_keys = idempotency_keys
+        self.history = history
+        self.log_generation = log_generation
+
+
+def read_snapshot(path):
+    """Load a binary snapshot into in-memory structures"""
+    with SnapshotReader(path) as reader:
+        user_ids = reader.array("gr.user")
+        extra = {int(row): fields for row, fields in reader.json("gr.extra").items()}
+        game_results = GameResultColumns.from_columns(
+            reader.array("gr.id"), user_ids, reader.array("gr.time"), reader.array("gr.kind"),
+            reader.array("gr.promo"), extra
+        )
+
+        user_counters = UserCounters(reader.array("user.ids"), reader.array("user.stats"), reader.array("user.dwins"))
+
+        board = reader.array("board")
+        leaderboard = WinLeaderboard.restore(zip(board[0::2], board[1::2]))
+
+        promo_allocator = PromoCodeAllocator.from_state(
+            reader.json("alloc"), reader.array("alloc.pos"), reader.array("alloc.val")
+        )
+
+        ids = game_results._ids
+        idempotency_keys = {
+            (user_ids[row], fields["idempotency_key"]): ids[row]
+            for row, fields in extra.items()
+            if fields.get("idempotency_key") is not None
+        }
+
+        history = HistoryArchive.from_json(reader.json("history"))
+
+        entries = reader.array("board.diff")
+        pairs = {difficulty: [] for difficulty in DIFFICULTIES}
+        for index, user_id, wins in zip(entries[0::3], entries[1::3], entries[2::3]):
+            pairs[DIFFICULTIES[index]].append((user_id, wins))
+        difficulty_boards = {difficulty: WinLeaderboard.restore(pairs[difficulty]) for difficulty in DIFFICULTIES}
+
+        return SnapshotContents(
+            users=reader.json("users"),
+            game_results=game_results,
+            promo_codes=PromoCodeStore.from_dicts(reader.json("promos")),
+            user_counters=user_counters,
+            leaderboard=leaderboard,
+            difficulty_leaderboards=difficulty_boards,
+            promo_allocator=promo_allocator,
+            idempotency_keys=idempotency_keys,
+            history=history,
+            log_generation=reader.json("meta")["log_generation"],
+        )
+
+
+def _write_file(path, snapshot):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        write_snapshot(f, snapshot)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def convert(json_path, snapshot_path):
+    """Write a binary snapshot with the contents of a JSON snapshot"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    game_results = GameResultColumns.from_dicts(data.get("game_results", []))
+    _write_file(snapshot_path, {
+        "users": data.get("users", {}),
+        "game_results": game_results.snapshot(),
+        "promo_codes": PromoCodeStore.from_dicts(data.get("promo_codes", {}).values()).snapshot(),
+        "history": data.get("history"),
+        "promo_allocator": data.get("promo_allocator"),
+        "log_generation": data.get("log_generation", 0),
+    })
+    return len(game_results)
+
+
+def export(snapshot_path, json_path):
+    """Write a JSON snapshot with the contents of a binary snapshot"""
+    contents = read_snapshot(snapshot_path)
+    data = {
+        "users": contents.users,
+        "game_results": contents.game_results.to_json(),
+        "promo_codes": contents.promo_codes.snapshot().to_json(),
+        "history": contents.history.to_json(),
+        "promo_allocator": promo_allocator_state(contents.promo_allocator),
+        "log_generation": contents.log_generation,
+    }
+    tmp_file = json_path + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, json_path)
+    return len(data["game_results"])
+
+
+def info(snapshot_path):
+    """Section sizes and a few aggregates, computed without loading the snapshot"""
+    with SnapshotReader(snapshot_path) as reader:
+        print(f"{snapshot_path}: version {VERSION}")
+        for name, (offset, length) in reader.sections.items():
+            print(f"  {name:<12} {length:>12} bytes at {offset}")
+        print(f"  meta: {reader.json('meta')}")
+        kinds = reader.raw("gr.kind")
+        print(f"  wins: {sum(kinds.tobytes().count(index) for index in range(len(DIFFICULTIES)))}")
+        created = reader.column("gr.time")
+        if len(created):
+            print(f"  first game: {iso_from_epoch_us(created[0])}, last game: {iso_from_epoch_us(created[-1])}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("convert", "export", "info"):
+        print(__doc__)
+        sys.exit(1)
+    if sys.argv[1] == "convert":
+        print(f"Converted {convert(sys.argv[2], sys.argv[3])} game results")
+    elif sys.argv[1] == "export":
+        print(f"Exported {export(sys.argv[2], sys.argv[3])} game results")
+    else:
+        info(sys.argv[2])
@@ -0,0 +1,1244 @@
+"""
+Append-only storage engine for the JSON file backends.
+
+The snapshot file (game_data.json) keeps its original layout. Every mutation
+is appended as one JSON line to a write-ahead log next to it, and the log is
+periodically folded back into the snapshot, so a write costs one small append
+no matter how long the history is.
+
+State is loaded once and kept resident. Reads only touch the disk again when
+the snapshot or log changed underneath us, which happens when another process
+(e.g. a stray copy started by launcher.py) writes to the same files:
+
+- writers hold an exclusive lock on ``<name>.lock`` while they catch up with
+  the log, apply their changes and append them, so ids are always assigned
+  against the latest state and appends never interleave;
+- readers poll the snapshot and log with ``os.stat`` and, if either changed,
+  take a shared lock and replay only the new tail of the log, or reload
+  everything when the snapshot was rewritten by a compaction.
+
+Inside a process, the async endpoints never write directly: they hand their
+read-modify-write step to ``StoreWriter``, a single asyncio task that drains
+whatever is queued, runs it in order under one lock and commits the whole
+batch with one fsynced append. Snapshots are only ever replaced atomically
+(write to a temp file, fsync, ``os.replace``), so neither file can be torn.
+
+Every log starts with a header line carrying its generation, and a snapshot
+records the generation of the log that goes on top of it. A compaction
+writes the snapshot for the next generation before it starts the new log, so
+after a crash in between, the old log no longer matches the snapshot and is
+skipped instead of being applied a second time.
+
+Disk I/O and JSON (de)serialisation run on a small bounded thread pool; the
+event loop only applies already-parsed records and swaps in fully built
+state, so a large load or compaction never stalls other requests. Worker
+threads never touch the live state: records are immutable once stored (a
+redeemed promo code is replaced, not edited) and compaction serialises a
+shallow copy taken on the loop.
+
+Game results are held column-wise in ``GameResultColumns`` and promo codes
+in a ``PromoCodeStore`` rather than as dicts in the data; both are turned
+back into the usual JSON layout when a snapshot is written.
+``PromoCodeSweeper`` periodically moves redeemed and expired codes out of the
+promo code table into ``<name>.promo_archive.jsonl``: the archive lines are
+appended and fsynced by the same write that logs their removal. The
+allocator state is part of the snapshot, so archived codes are never issued
+again.
+
+``HistoryRoller`` does the same for game results older than the hot window:
+they go to monthly files under ``<name>.history/`` and only their counters
+stay in memory (see history.py). Per-user stats and the leaderboard already
+include them, so dropping the rows changes no read.
+
+Observers registered with ``DataStore.add_observer`` (the response cache in
+response_cache.py) are told about every record applied to the state, from
+this process or replayed from the log, and about wholesale reloads.
+
+With ``STORAGE_SNAPSHOT_FORMAT=binary`` compactions write ``<name>.snap``
+(see snapshot.py) instead of the JSON file. It also carries the indexes, so
+loading it does not replay the game history.
+"""
+
+import abc
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from columnar import DIFFICULTIES, GameResultColumns, epoch_us, iso_from_epoch_us
+from history import (
+    HistoryArchive, history_dir_for, hot_window_start, partition_of, write_partitions,
+    HISTORY_HOT_MONTHS, HISTORY_ROLL_INTERVAL, HISTORY_ROLL_BATCH
+)
+from leaderboard import PERIODS, PeriodLeaderboards, Rankings, WinLeaderboard, period_key, period_start
+from promo_codes import (
+    PromoCodeAllocator, PromoCodeStore,
+    PROMO_SWEEP_INTERVAL, PROMO_SWEEP_BATCH, PROMO_ARCHIVE_AFTER_HOURS
+)
+from snapshot import promo_allocator_state, read_snapshot, write_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only, locking is a no-op
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Fold the log into the snapshot after this many appended records
+COMPACT_EVERY = int(os.getenv("STORAGE_COMPACT_EVERY", 1000))
+
+# Group commit: how long the writer waits for more operations after the first
+# one (0 disables waiting) and how many operations go into one flush at most
+GROUP_COMMIT_MS = float(os.getenv("STORAGE_GROUP_COMMIT_MS", 0))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("STORAGE_GROUP_COMMIT_MAX_BATCH", 256))
+
+# Threads for blocking file I/O and JSON work
+IO_THREADS = int(os.getenv("STORAGE_IO_THREADS", 2))
+
+# Format written on compaction: "json" (game_data.json) or "binary"
+# (game_data.snap, see snapshot.py)
+SNAPSHOT_FORMAT = os.getenv("STORAGE_SNAPSHOT_FORMAT", "json")
+
+
+def empty_data():
+    """Initial data structure for a fresh store"""
+    return {
+        "users": {},
+        "game_results": [],
+        "promo_codes": {}
+    }
+
+
+def log_path_for(data_file):
+    """Write-ahead log path that belongs to a snapshot file"""
+    return os.path.splitext(data_file)[0] + ".wal"
+
+
+def binary_snapshot_path_for(data_file):
+    """Binary snapshot path that belongs to a JSON snapshot file"""
+    return os.path.splitext(data_file)[0] + ".snap"
+
+
+def promo_archive_path_for(data_file):
+    """Archive of swept promo codes that belongs to a snapshot file"""
+    return os.path.splitext(data_file)[0] + ".promo_archive.jsonl"
+
+
+def _file_signature(path):
+    """Identity of a file on disk: (inode, mtime, size), or None if missing"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class UserIndex:
+    """Per-user running counters, maintained on insert"""
+
+    def __init__(self):
+        self._users = {}
+        # Counters restored from a binary snapshot, unpacked on first use
+        self._restored = None
+
+    @classmethod
+    def from_counters(cls, counters):
+        """
+        Index on top of snapshot counters: ``counters.get(user_id)`` returns
+        (win, loss, draw, {difficulty: games}, {difficulty: wins}) or None
+        """
+        index = cls()
+        index._restored = counters
+        return index
+
+    def _entry(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is None and self._restored is not None:
+            counters = self._restored.get(user_id)
+            if counters is not None:
+                win, loss, draw, difficulties, difficulty_wins = counters
+                entry = self._users[user_id] = {
+                    "win": win,
+                    "loss": loss,
+                    "draw": draw,
+                    "difficulties": difficulties,
+                    "difficulty_wins": difficulty_wins
+                }
+        return entry
+
+    def add(self, game_result):
+        """Account for one new game result; returns the user's updated counters"""
+        entry = self._entry(game_result["user_id"])
+        if entry is None:
+            entry = self._users[game_result["user_id"]] = {
+                "win": 0,
+                "loss": 0,
+                "draw": 0,
+                "difficulties": {},
+                "difficulty_wins": {}
+            }
+        entry[game_result["status"]] += 1
+        difficulties = entry["difficulties"]
+        difficulty = game_result["difficulty"]
+        difficulties[difficulty] = difficulties.get(difficulty, 0) + 1
+        if game_result["status"] == "win":
+            difficulty_wins = entry["difficulty_wins"]
+            difficulty_wins[difficulty] = difficulty_wins.get(difficulty, 0) + 1
+        return entry
+
+    def get(self, user_id):
+        """Counters for a user, or None if they have not played yet"""
+        return self._entry(user_id)
+
+    def favorite_difficulty(self, user_id):
+        """Most played difficulty of a user; ties go to the easier difficulty"""
+        entry = self._entry(user_id)
+        if not entry or not entry["difficulties"]:
+            return None
+        difficulties = entry["difficulties"]
+        # max() keeps the first of equal counts, and DIFFICULTIES runs from easiest
+        return max(DIFFICULTIES, key=lambda difficulty: difficulties.get(difficulty, 0))
+
+
+class StoreState:
+    """In-memory data plus the secondary indexes derived from it"""
+
+    def __init__(self, data=None):
+        self.data = data if data is not None else empty_data()
+        # Promo codes, archived history and allocator live outside the data dict
+        self.promo_codes = PromoCodeStore.from_dicts(self.data.pop("promo_codes", {}).values())
+        self.history = HistoryArchive.from_json(self.data.pop("history", None))
+        # Generation of the log that is replayed over this snapshot
+        self.log_generation = self.data.pop("log_generation", 0)
+        allocator_state = self.data.pop("promo_allocator", None)
+        # Counters and leaderboard start from the archived games
+        self.user_index = UserIndex.from_counters(self.history)
+        self.leaderboard = WinLeaderboard.restore(self.history.leaderboard.export())
+        self.period_leaderboards = PeriodLeaderboards()
+        # Built in one go once the counters are complete, then kept up to date
+        self.rankings = None
+        # (user_id, client idempotency key) -> game result id
+        self.idempotency_keys = {}
+        game_results = self.data["game_results"]
+        for game_result in game_results:
+            self._index(game_result)
+        # Game results are held column-wise; the dicts are only used for indexing
+        self.data["game_results"] = GameResultColumns.from_dicts(game_results)
+        self.rankings = self.rebuild_rankings(self.rebuild_difficulty_leaderboards())
+        if allocator_state is not None:
+            self.promo_allocator = PromoCodeAllocator.from_state(
+                allocator_state["settings"], allocator_state["positions"], allocator_state["values"]
+            )
+        else:
+            # Snapshots from before the allocator was stored
+            self.promo_allocator = PromoCodeAllocator()
+            for game_result in game_results:
+                if game_result.get("promo_code"):
+                    self.promo_allocator.reserve(game_result["promo_code"])
+            for code in self.promo_codes:
+                self.promo_allocator.reserve(code)
+
+    @classmethod
+    def from_snapshot(cls, contents):
+        """State restored from a binary snapshot, indexes included"""
+        state = cls.__new__(cls)
+        state.data = {"users": contents.users, "game_results": contents.game_results}
+        state.promo_codes = contents.promo_codes
+        state.user_index = UserIndex.from_counters(contents.user_counters)
+        state.leaderboard = contents.leaderboard
+        state.idempotency_keys = contents.idempotency_keys
+        state.promo_allocator = contents.promo_allocator
+        state.history = contents.history
+        state.log_generation = contents.log_generation
+        state.period_leaderboards = state.rebuild_period_leaderboards(datetime.utcnow())
+        state.rankings = state.rebuild_rankings(contents.difficulty_leaderboards)
+        return state
+
+    def rebuild_period_leaderboards(self, now):
+        """Day/week/month leaderboards from the wins in memory since the earliest period start"""
+        since = min(period_start(period, now) for period in PERIODS)
+        wins = self.data["game_results"].wins_since(epoch_us(since.isoformat()))
+        return PeriodLeaderboards.from_wins(
+            (user_id, datetime.fromisoformat(iso_from_epoch_us(created)), difficulty)
+            for user_id, created, difficulty in wins
+        )
+
+    def rebuild_difficulty_leaderboards(self):
+        """Per-difficulty win boards: the archived ones plus the wins in memory, replayed in order"""
+        game_results = self.data["game_results"]
+        boards = {}
+        for difficulty, archived in self.history.difficulty_leaderboards.items():
+            board = boards[difficulty] = WinLeaderboard.restore(archived.export())
+            for user_id in game_results.winners(difficulty):
+                board.record_win(user_id)
+        return boards
+
+    def rebuild_rankings(self, wins):
+        """Win-rate rankings from every player's counters, around the per-difficulty win boards"""
+        def counters():
+            for key in self.data["users"]:
+                entry = self.user_index.get(int(key))
+                if entry is None:
+                    continue
+                difficulty_wins = entry["difficulty_wins"]
+                yield (
+                    int(key),
+                    entry["win"],
+                    entry["win"] + entry["loss"] + entry["draw"],
+                    {
+                        difficulty: (difficulty_wins.get(difficulty, 0), games)
+                        for difficulty, games in entry["difficulties"].items()
+                    }
+                )
+
+        return Rankings.from_counters(DIFFICULTIES, counters(), wins)
+
+    def next_game_result_id(self):
+        """Id for the next game result"""
+        game_results = self.data["game_results"]
+        if len(game_results):
+            return game_results._ids[-1] + 1
+        return self.history.last_id + 1
+
+    def apply(self, record):
+        """Apply one log record"""
+        op = record["op"]
+        data = self.data
+        if op == "user":
+            user = record["user"]
+            data["users"][str(user["id"])] = user
+        elif op == "game_result":
+            game_result = record["game_result"]
+            self._index(game_result)
+            data["game_results"].append(game_result)
+        elif op == "promo_code":
+            promo = record["promo"]
+            self.promo_codes.add(promo)
+            self.promo_allocator.reserve(promo["code"])
+        elif op == "promo_used":
+            self.promo_codes.redeem(record["code"], record["used_at"])
+        elif op == "promo_archived":
+            for promo in record["promos"]:
+                self.promo_codes.remove(promo["code"])
+        elif op == "history_archived":
+            self._archive_game_results(record["game_results"])
+        else:
+            raise ValueError(f"Unknown log record: {op}")
+
+    def _index(self, game_result):
+        """Keep the secondary structures in step with a new game result"""
+        user_id = game_result["user_id"]
+        difficulty = game_result["difficulty"]
+        won = game_result["status"] == "win"
+        entry = self.user_index.add(game_result)
+        if won:
+            self.leaderboard.record_win(user_id)
+            moment = _naive_utc(game_result["created_at"])
+            if moment is not None:
+                self.period_leaderboards.record_win(user_id, moment, difficulty)
+        if self.rankings is not None:
+            self.rankings.record(
+                user_id, difficulty, won,
+                (entry["win"], entry["win"] + entry["loss"] + entry["draw"]),
+                (entry["difficulty_wins"].get(difficulty, 0), entry["difficulties"][difficulty])
+            )
+        key = game_result.get("idempotency_key")
+        if key is not None:
+            self.idempotency_keys[(game_result["user_id"], key)] = game_result["id"]
+
+    def _archive_game_results(self, archived):
+        """Fold the oldest game results into the history counters and drop their rows"""
+        game_results = self.data["game_results"]
+        if archived and (not len(game_results) or game_results._ids[0] != archived[0]["id"]):
+            raise ValueError("Archived game results are not the oldest ones in memory")
+        for game_result in archived:
+            self.history.add(game_result)
+            key = game_result.get("idempotency_key")
+            if key is not None:
+                self.idempotency_keys.pop((game_result["user_id"], key), None)
+        # Counters and leaderboard already include these games
+        game_results.drop_prefix(len(archived))
+
+    def snapshot_copy(self):
+        """Copy that stays consistent while a worker thread serialises it"""
+        return {
+            "users": dict(self.data["users"]),
+            "game_results": self.data["game_results"].snapshot(),
+            "promo_codes": self.promo_codes.snapshot(),
+            "history": self.history.to_json(),
+            "promo_allocator": promo_allocator_state(self.promo_allocator),
+            "log_generation": self.log_generation,
+        }
+
+
+def _naive_utc(timestamp):
+    """Naive UTC datetime for a stored ISO timestamp, or None if it does not parse"""
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+class _Loaded:
+    """Result of reading the snapshot and log from disk"""
+
+    def __init__(self, state, log_records, log_offset, snapshot_sig, log_sig):
+        self.state = state
+        self.log_records = log_records
+        self.log_offset = log_offset
+        self.snapshot_sig = snapshot_sig
+        self.log_sig = log_sig
+
+
+class DataStore:
+    """Snapshot + write-ahead log store for users, game results and promo codes"""
+
+    def __init__(self, data_file, compact_every=COMPACT_EVERY, io_threads=IO_THREADS,
+                 snapshot_format=SNAPSHOT_FORMAT):
+        if snapshot_format not in ("json", "binary"):
+            raise ValueError(f"Unknown snapshot format: {snapshot_format}")
+        self.data_file = data_file
+        self.snapshot_format = snapshot_format
+        # The file compactions write and reloads watch
+        self.snapshot_file = data_file if snapshot_format == "json" else binary_snapshot_path_for(data_file)
+        self.log_file = log_path_for(data_file)
+        self.archive_file = promo_archive_path_for(data_file)
+        self.history_dir = history_dir_for(data_file)
+        self.lock_file = os.path.splitext(data_file)[0] + ".lock"
+        self.compact_every = compact_every
+        self.state = StoreState()
+        self.loaded = False
+        self._pending = []
+        self._log_records = 0
+        self._log_offset = 0
+        self._snapshot_sig = None
+        self._log_sig = None
+        self._executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="storage-io")
+        self._io_lock = None
+        self._observers = []
+
+    @property
+    def data(self):
+        return self.state.data
+
+    @property
+    def user_index(self):
+        return self.state.user_index
+
+    @property
+    def leaderboard(self):
+        return self.state.leaderboard
+
+    @property
+    def promo_codes(self):
+        return self.state.promo_codes
+
+    @property
+    def history(self):
+        return self.state.history
+
+    # Public API
+
+    def add_observer(self, observer):
+        """
+        Call ``observer.applied(record)`` for every record applied to the
+        state and ``observer.reset()`` whenever the state is replaced
+        """
+        self._observers.append(observer)
+
+    def load(self):
+        """Load the snapshot and replay the log (blocking; for scripts and tools)"""
+        lock = self._acquire(shared=True)
+        try:
+            self._install(self._read_full())
+        finally:
+            self._release(lock)
+        return self.data
+
+    async def load_async(self):
+        """Load the snapshot and replay the log without blocking the event loop"""
+        async with self._serialised():
+            lock = await self._io(self._acquire, True)
+            try:
+                self._install(await self._io(self._read_full))
+            finally:
+                self._release(lock)
+        return self.data
+
+    async def refresh(self):
+        """Pick up changes made by other processes since the last read"""
+        if self.loaded and not self._changed_on_disk():
+            return self.data
+        async with self._serialised():
+            # Our own writer may have caught up while we waited
+            if not self.loaded or self._changed_on_disk():
+                lock = await self._io(self._acquire, True)
+                try:
+                    self._apply_changes(await self._io(self._read_changes))
+                finally:
+                    self._release(lock)
+        return self.data
+
+    async def apply_batch(self, operations):
+        """
+        Run several read-modify-write callables under one lock and commit
+        everything they recorded with a single append. Each callable gets the
+        current data; returns a (result, exception) pair per callable.
+        """
+        async with self._serialised():
+            lock = await self._io(self._acquire, False)
+            try:
+                self._apply_changes(await self._io(self._read_changes))
+                outcomes, discarded = self._run_operations(operations)
+                try:
+                    # Memory holds discarded changes, so it must not become a snapshot
+                    await self._write_pending(allow_compact=not discarded)
+                except BaseException:
+                    self._install(await self._io(self._read_full))
+                    raise
+                if discarded:
+                    # Memory still holds the discarded changes; resync with disk
+                    self._install(await self._io(self._read_full))
+            finally:
+                self._release(lock)
+        return outcomes
+
+    async def compact(self):
+        """Fold the log into a fresh snapshot and start an empty log"""
+        async with self._serialised():
+            lock = await self._io(self._acquire, False)
+            try:
+                self._apply_changes(await self._io(self._read_changes))
+                await self._write_pending(force_compact=True)
+            finally:
+                self._release(lock)
+
+    def allocate_promo_code(self):
+        """A promo code that has never been issued"""
+        return self.state.promo_allocator.allocate()
+
+    def promo_code_issued(self, code):
+        """Whether a code was ever issued, including codes already archived"""
+        return self.state.promo_allocator.issued(code)
+
+    def next_game_result_id(self):
+        """Id for the next game result, counting archived ones"""
+        return self.state.next_game_result_id()
+
+    def find_by_idempotency_key(self, user_id, key):
+        """Game result previously recorded with a client idempotency key"""
+        game_result_id = self.state.idempotency_keys.get((user_id, key))
+        if game_result_id is None:
+            return None
+        game_results = self.data["game_results"]
+        row = game_results.row_of(game_result_id)
+        return game_results[row] if row is not None else None
+
+    def leaderboard_top(self, limit, period="all", difficulty=None, rank_by="wins", min_games=0, now=None):
+        """
+        Up to ``limit`` ranked players as dicts with user_id and wins, for all
+        time or the current UTC "day", ISO "week" or "month", optionally for
+        one difficulty. ``rank_by="win_rate"`` (all time only) ranks players
+        with at least ``min_games`` games and adds games and win_rate.
+        """
+        state = self.state
+        now = now or datetime.utcnow()
+        if rank_by == "win_rate":
+            if period != "all":
+                raise ValueError("Win-rate rankings are only kept for all time")
+            return [
+                {"user_id": user_id, "wins": wins, "games": games, "win_rate": round(wins / games * 100, 2)}
+                for user_id, wins, games in state.rankings.top_win_rate(limit, min_games, difficulty)
+            ]
+        if period != "all":
+            pairs = state.period_leaderboards.top(period, limit, now, difficulty)
+        elif difficulty is not None:
+            pairs = state.rankings.top_wins(difficulty, limit)
+        else:
+            pairs = self.leaderboard.top(limit)
+        return [{"user_id": user_id, "wins": wins} for user_id, wins in pairs]
+
+    def leaderboard_watch(self, rows, limit, period="all", difficulty=None, rank_by="wins", min_games=0, now=None):
+        """
+        Predicate telling whether a game result of a player not in ``rows``
+        (a leaderboard_top() result for the same arguments) changes it once
+        applied: only when that player now ranks above the last row
+        """
+        full = len(rows) >= limit
+        last = rows[-1] if rows else None
+        bucket = period_key(period, now or datetime.utcnow()) if period != "all" else None
+
+        def changed(game_result):
+            if difficulty is not None and game_result["difficulty"] != difficulty:
+                return False
+            user_id = game_result["user_id"]
+            if rank_by == "win_rate":
+                entry = self.user_index.get(user_id)
+                if difficulty is None:
+                    wins, games = entry["win"], entry["win"] + entry["loss"] + entry["draw"]
+                else:
+                    wins, games = entry["difficulty_wins"].get(difficulty, 0), entry["difficulties"][difficulty]
+                if games < max(min_games, 1):
+                    return False
+                if not full:
+                    return True
+                if last is None:
+                    return False
+                # Same order as WinRateRanking
+                return (-wins / games, -games, user_id) < (-last["wins"] / last["games"], -last["games"], last["user_id"])
+
+            if game_result["status"] != "win":
+                return False
+            if bucket is not None:
+                moment = _naive_utc(game_result["created_at"])
+                if moment is None or period_key(period, moment) != bucket:
+                    return False
+            if not full:
+                return True
+            if last is None:
+                return False
+            # Players who only tie the last row rank below it
+            if bucket is not None:
+                wins = self.state.period_leaderboards.board(period, moment, difficulty).wins(user_id)
+            elif difficulty is not None:
+                wins = self.state.rankings.wins[difficulty].wins(user_id)
+            else:
+                wins = self.leaderboard.wins(user_id)
+            return wins > last["wins"]
+
+        return changed
+
+    def rebuild_leaderboard(self):
+        """Recompute the leaderboards from the archived counters and the games in memory"""
+        leaderboard = WinLeaderboard.restore(self.history.leaderboard.export())
+        for user_id in self.data["game_results"].winners():
+            leaderboard.record_win(user_id)
+        self.state.leaderboard = leaderboard
+        self.state.period_leaderboards = self.state.rebuild_period_leaderboards(datetime.utcnow())
+        self.state.rankings = self.state.rebuild_rankings(self.state.rebuild_difficulty_leaderboards())
+        # Ties may come out in a different order
+        for observer in self._observers:
+            observer.reset()
+        return len(leaderboard)
+
+    def history_totals(self):
+        """Games by status and difficulty over the whole history"""
+        totals = self.history.totals()
+        game_results = self.data["game_results"]
+        totals["games"] += len(game_results)
+        for (status, difficulty), count in game_results.kind_counts().items():
+            totals[status] += count
+            totals[difficulty] += count
+        return totals
+
+    # Mutations, called from operations passed to apply_batch
+
+    def add_user(self, user):
+        """Register a new user"""
+        self._record({"op": "user", "user": user})
+
+    def add_game_result(self, game_result):
+        """Append a game result"""
+        self._record({"op": "game_result", "game_result": game_result})
+
+    def add_promo_code(self, promo):
+        """Store a newly issued promo code"""
+        self._record({"op": "promo_code", "promo": promo})
+
+    def mark_promo_used(self, code, used_at):
+        """Flag a promo code as redeemed"""
+        self._record({"op": "promo_used", "code": code, "used_at": used_at})
+
+    def redeem_promo_code(self, code, user_id, used_at, now):
+        """
+        Compare-and-set redemption: marks the code used only if ``user_id``
+        may redeem it right now. Returns the check result, "valid" on success.
+        """
+        code_status = self.state.promo_codes.check(code, user_id, now)
+        if code_status == "valid":
+            self.mark_promo_used(code, used_at)
+        return code_status
+
+    def archive_promo_codes(self, promos, archived_at):
+        """Move promo codes (dicts with an ``archive_reason``) to the archive file"""
+        self._record({"op": "promo_archived", "archived_at": archived_at, "promos": promos})
+
+    def archive_game_results(self, count, archived_at):
+        """Move the ``count`` oldest game results to the monthly history files"""
+        game_results = self.data["game_results"]
+        self._record({
+            "op": "history_archived",
+            "archived_at": archived_at,
+            "game_results": game_results[:count]
+        })
+
+    def _record(self, record):
+        self.state.apply(record)
+        self._pending.append(record)
+        for observer in self._observers:
+            observer.applied(record)
+
+    # Event-loop side: only memory, never blocks
+
+    def _serialised(self):
+        # One state transition at a time within the process
+        if self._io_lock is None:
+            self._io_lock = asyncio.Lock()
+        return self._io_lock
+
+    async def _io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _changed_on_disk(self):
+        return (_file_signature(self.snapshot_file) != self._snapshot_sig
+                or _file_signature(self.log_file) != self._log_sig)
+
+    def _install(self, loaded):
+        self.state = loaded.state
+        self._pending = []
+        self._log_records = loaded.log_records
+        self._log_offset = loaded.log_offset
+        self._snapshot_sig = loaded.snapshot_sig
+        self._log_sig = loaded.log_sig
+        self.loaded = True
+        for observer in self._observers:
+            observer.reset()
+
+    def _apply_changes(self, changes):
+        if changes is None:
+            return
+        if isinstance(changes, _Loaded):
+            self._install(changes)
+            return
+        records, log_offset, log_sig = changes
+        for record in records:
+            self.state.apply(record)
+            for observer in self._observers:
+                observer.applied(record)
+        self._log_records += len(records)
+        self._log_offset = log_offset
+        self._log_sig = log_sig
+
+    def _run_operations(self, operations):
+        outcomes = []
+        discarded = False
+        for operation in operations:
+            mark = len(self._pending)
+            try:
+                outcomes.append((operation(self.data), None))
+            except Exception as e:
+                if len(self._pending) > mark:
+                    # Keep the failed operation's records out of the log
+                    del self._pending[mark:]
+                    discarded = True
+                outcomes.append((None, e))
+        return outcomes, discarded
+
+    async def _write_pending(self, force_compact=False, allow_compact=True):
+        """Append pending records and compact when due, all in a worker thread"""
+        if not self._pending and not force_compact:
+            return
+        payload = b"".join(
+            json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+            for record in self._pending
+        )
+        archive = b"".join(
+            json.dumps(dict(promo, archived_at=record["archived_at"]), ensure_ascii=False).encode("utf-8") + b"\n"
+            for record in self._pending if record["op"] == "promo_archived"
+            for promo in record["promos"]
+        )
+        history = {}
+        for record in self._pending:
+            if record["op"] == "history_archived":
+                for game_result in record["game_results"]:
+                    line = json.dumps(game_result, ensure_ascii=False).encode("utf-8") + b"\n"
+                    history.setdefault(partition_of(game_result["created_at"]), []).append(line)
+        history = {partition: b"".join(lines) for partition, lines in history.items()}
+        records = len(self._pending)
+        generation = self.state.log_generation
+        snapshot = None
+        if force_compact or (allow_compact and self._log_records + records >= self.compact_every):
+            snapshot = self.state.snapshot_copy()
+            # The snapshot holds everything up to this log, so the next log goes over it
+            snapshot["log_generation"] = generation + 1
+
+        self._log_offset, self._log_sig, snapshot_sig = await self._io(
+            self._write, payload, generation, snapshot, archive, history
+        )
+        self._pending = []
+        if snapshot is None:
+            self._log_records += records
+        else:
+            self._log_records = 0
+            self._snapshot_sig = snapshot_sig
+            self.state.log_generation += 1
+
+    # Worker-thread side: blocking I/O, never touches live state
+
+    def _read_full(self):
+        """Read the snapshot and replay the whole log into a fresh state"""
+        snapshot_sig = _file_signature(self.snapshot_file)
+        if self.snapshot_format == "binary" and snapshot_sig is not None:
+            state = StoreState.from_snapshot(read_snapshot(self.snapshot_file))
+        else:
+            # JSON snapshot, also the starting point before the first binary one
+            data = empty_data()
+            if os.path.exists(self.data_file):
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    data.update(json.load(f))
+            state = StoreState(data)
+        records, log_offset, log_sig = self._read_log(0, state.log_generation)
+        for record in records:
+            state.apply(record)
+        return _Loaded(state, len(records), log_offset, snapshot_sig, log_sig)
+
+    def _read_changes(self):
+        """What changed on disk since our last read: None, a tail of records, or a full reload"""
+        if not self.loaded:
+            return self._read_full()
+
+        snapshot_sig = _file_signature(self.snapshot_file)
+        log_sig = _file_signature(self.log_file)
+        if snapshot_sig != self._snapshot_sig:
+            # Another process compacted: the log was folded into a new snapshot
+            return self._read_full()
+        if log_sig == self._log_sig:
+            return None
+        if self._log_sig is None:
+            # Another process started the log
+            return self._read_log(0, self.state.log_generation)
+        if log_sig is None or log_sig[0] != self._log_sig[0] or log_sig[2] < self._log_offset:
+            # Log replaced or cut short behind our back
+            return self._read_full()
+        return self._read_log(self._log_offset, self.state.log_generation)
+
+    def _read_log(self, offset, generation):
+        """
+        Parse every complete record in the log from ``offset`` on. A log of
+        an older generation than ``generation`` (the snapshot's) was already
+        folded into the snapshot: nothing is replayed, and offset 0 makes the
+        next writer start the log over.
+        """
+        log_sig = _file_signature(self.log_file)
+        if log_sig is None:
+            return [], 0, None
+
+        with open(self.log_file, 'rb') as f:
+            f.seek(offset)
+            raw = f.read()
+
+        # Only consume whole lines; a torn tail from a crash is truncated by
+        # the next writer before it appends
+        end = raw.rfind(b"\n") + 1
+        records = [json.loads(line) for line in raw[:end].splitlines() if line.strip()]
+        if offset == 0:
+            # Logs written before the header existed count as generation 0
+            log_generation = records[0]["generation"] if records and records[0]["op"] == "log" else 0
+            if log_generation < generation:
+                return [], 0, log_sig
+            if log_generation > generation:
+                raise ValueError(
+                    f"{self.log_file} is generation {log_generation}, newer than its snapshot ({generation})"
+                )
+            if records and records[0]["op"] == "log":
+                records = records[1:]
+        return records, offset + end, log_sig
+
+    def _write(self, payload, generation, snapshot, archive=b"", history=None):
+        self._ensure_dir()
+        if history:
+            # Like the promo archive: written before the log records the move
+            write_partitions(self.history_dir, history)
+        if archive:
+            # Archive first: a crash before the log append leaves the codes in
+            # both places, and the next sweep archives them again
+            with open(self.archive_file, 'ab') as f:
+                f.write(archive)
+                f.flush()
+                os.fsync(f.fileno())
+
+        with open(self.log_file, 'ab') as f:
+            # Drop a torn tail left by a crashed writer, or a log of an older
+            # generation, before appending
+            if f.tell() > self._log_offset:
+                f.truncate(self._log_offset)
+            if payload and not self._log_offset:
+                payload = _log_header(generation) + payload
+            if payload:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            log_offset = f.tell()
+
+        snapshot_sig = None
+        if snapshot is not None:
+            tmp_file = self.snapshot_file + ".tmp"
+            if self.snapshot_format == "binary":
+                with open(tmp_file, 'wb') as f:
+                    write_snapshot(f, snapshot)
+                    f.flush()
+                    os.fsync(f.fileno())
+            else:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, indent=2, ensure_ascii=False, default=_snapshot_default)
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+            self._fsync_dir()
+            snapshot_sig = _file_signature(self.snapshot_file)
+
+            # The snapshot now contains everything the log had; a crash before
+            # this point leaves a log of the previous generation, which loads skip
+            header = _log_header(generation + 1)
+            with open(self.log_file, 'wb') as f:
+                f.write(header)
+                f.flush()
+                os.fsync(f.fileno())
+            log_offset = len(header)
+
+        return log_offset, _file_signature(self.log_file), snapshot_sig
+
+    # Locking
+
+    def _acquire(self, shared):
+        """Take the advisory lock shared by every process using the same data file"""
+        if fcntl is None:
+            return None
+        self._ensure_dir()
+        f = open(self.lock_file, 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        return f
+
+    def _release(self, lock):
+        if lock is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            lock.close()
+
+    def _fsync_dir(self):
+        """Make a rename durable by syncing the containing directory"""
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.data_file)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _ensure_dir(self):
+        directory = os.path.dirname(self.data_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+
+def _log_header(generation):
+    return json.dumps({"op": "log", "generation": generation}).encode("utf-8") + b"\n"
+
+
+def _snapshot_default(value):
+    # Tables that keep a compact in-memory form (PromoCodeSnapshot, GameResultSnapshot)
+    return value.to_json()
+
+
+class WriterMetrics:
+    """Batch size and commit latency of a StoreWriter"""
+
+    def __init__(self, window=1024):
+        self.batches = 0
+        self.operations = 0
+        self.failed_commits = 0
+        self.max_batch_size = 0
+        # Recent (batch size, commit seconds, oldest wait seconds) samples
+        self._samples = deque(maxlen=window)
+
+    def observe(self, batch_size, commit_seconds, wait_seconds):
+        self.batches += 1
+        self.operations += batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        self._samples.append((batch_size, commit_seconds, wait_seconds))
+
+    def snapshot(self):
+        """Counters plus percentiles over the recent samples"""
+        sizes = sorted(sample[0] for sample in self._samples)
+        commits = sorted(sample[1] for sample in self._samples)
+        waits = sorted(sample[2] for sample in self._samples)
+        return {
+            "batches": self.batches,
+            "operations": self.operations,
+            "failed_commits": self.failed_commits,
+            "avg_batch_size": round(self.operations / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "batch_size_p50": _percentile(sizes, 0.5),
+            "batch_size_p99": _percentile(sizes, 0.99),
+            "commit_ms_p50": _percentile_ms(commits, 0.5),
+            "commit_ms_p99": _percentile_ms(commits, 0.99),
+            "commit_ms_max": _percentile_ms(commits, 1.0),
+            "durable_ms_p50": _percentile_ms(waits, 0.5),
+            "durable_ms_p99": _percentile_ms(waits, 0.99),
+        }
+
+
+def _percentile(values, q):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _percentile_ms(values, q):
+    return round(_percentile(values, q) * 1000, 3)
+
+
+class StoreWriter:
+    """
+    Single asyncio task through which all mutations of a store are committed.
+
+    With a group-commit window, the writer waits up to ``window_ms`` after the
+    first queued operation (or until ``max_batch`` operations are waiting) and
+    persists all of them with one flush; each caller resumes as soon as its
+    batch is durable. A window of 0 commits whatever is queued right away.
+    """
+
+    def __init__(self, store, window_ms=GROUP_COMMIT_MS, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.store = store
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.metrics = WriterMetrics()
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        """Start the writer task on the running event loop"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commit everything already queued and stop the writer task"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, operation):
+        """
+        Queue a read-modify-write callable and wait until its changes are
+        durable; returns its result or re-raises its exception
+        """
+        if self._task is None:
+            raise RuntimeError("Store writer is not running")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((operation, future, loop.time()))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = await self._collect()
+            if None in batch:
+                batch = [item for item in batch if item is not None]
+                stopping = True
+            if batch:
+                await self._commit(batch)
+
+    async def _collect(self):
+        """Wait for the first operation, then gather more for the group-commit window"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _commit(self, batch):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            outcomes = await self.store.apply_batch([operation for operation, _, _ in batch])
+        except Exception as e:
+            self.metrics.failed_commits += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        finished = loop.time()
+        self.metrics.observe(len(batch), finished - started, finished - batch[0][2])
+
+        for (_, future, _), (result, error) in zip(batch, outcomes):
+            if future.done():
+                continue  # caller went away
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class _PeriodicTask(abc.ABC):
+    """Background task that calls ``run()`` every ``interval`` seconds"""
+
+    description = "Periodic task"
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        """Start running on the event loop"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Stop running; a batch that is being written still completes"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @abc.abstractmethod
+    async def run(self):
+        """One round of work"""
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Try again next round; nothing was moved if the write failed
+                logger.exception("%s failed", self.description)
+
+
+class PromoCodeSweeper(_PeriodicTask):
+    """
+    Background task that moves redeemed and expired promo codes from the
+    store to its archive file, ``batch_size`` codes per write, once they are
+    older than the grace period.
+    """
+
+    description = "Promo code sweep"
+
+    def __init__(self, store, writer, interval=PROMO_SWEEP_INTERVAL, batch_size=PROMO_SWEEP_BATCH,
+                 archive_after_hours=PROMO_ARCHIVE_AFTER_HOURS):
+        super().__init__(interval)
+        self.store = store
+        self.writer = writer
+        self.batch_size = batch_size
+        self.grace = archive_after_hours * 3600
+        self.archived = 0
+        self.last_sweep = None
+
+    async def run(self):
+        return await self.sweep()
+
+    async def sweep(self):
+        """Archive everything that is due now; returns the number of codes archived"""
+        total = 0
+        while True:
+            archived = await self.writer.submit(self._sweep_batch)
+            total += archived
+            if archived < self.batch_size:
+                break
+            # Let queued requests in between batches
+            await asyncio.sleep(0)
+        self.archived += total
+        self.last_sweep = datetime.utcnow().isoformat()
+        return total
+
+    def stats(self):
+        return {
+            "archived": self.archived,
+            "last_sweep": self.last_sweep,
+            **self.store.promo_codes.stats(),
+        }
+
+    def _sweep_batch(self, data):
+        due = self.store.promo_codes.due_for_archive(time.time(), self.grace, self.batch_size)
+        if due:
+            self.store.archive_promo_codes(
+                [dict(promo, archive_reason=reason) for promo, reason in due],
+                datetime.utcnow().isoformat()
+            )
+        return len(due)
+
+
+class HistoryRoller(_PeriodicTask):
+    """
+    Background task that moves game results older than the hot window
+    (``hot_months`` calendar months) to the monthly history files,
+    ``batch_size`` results per write.
+    """
+
+    description = "History roll"
+
+    def __init__(self, store, writer, interval=HISTORY_ROLL_INTERVAL, batch_size=HISTORY_ROLL_BATCH,
+                 hot_months=HISTORY_HOT_MONTHS):
+        super().__init__(interval if hot_months > 0 else 0)
+        self.store = store
+        self.writer = writer
+        self.batch_size = batch_size
+        self.hot_months = hot_months
+        self.archived = 0
+        self.last_roll = None
+
+    async def run(self):
+        return await self.roll()
+
+    async def roll(self):
+        """Archive every game result that left the hot window; returns how many"""
+        if self.hot_months <= 0:
+            return 0
+        total = 0
+        while True:
+            archived = await self.writer.submit(self._roll_batch)
+            total += archived
+            if archived < self.batch_size:
+                break
+            await asyncio.sleep(0)
+        self.archived += total
+        self.last_roll = datetime.utcnow().isoformat()
+        return total
+
+    def stats(self):
+        history = self.store.history
+        return {
+            "hot_months": self.hot_months,
+            "hot_game_results": len(self.store.data["game_results"]),
+            "archived_game_results": history.rows,
+            "archived_this_run": self.archived,
+            "last_roll": self.last_roll,
+            "partitions": history.partitions,
+            "totals": self.store.history_totals(),
+        }
+
+    def _roll_batch(self, data):
+        now = datetime.utcnow()
+        # The current week's leaderboard is rebuilt from memory on load
+        cutoff = epoch_us(min(hot_window_start(now, self.hot_months), period_start("week", now)).isoformat())
+        # Rows are in insertion order, so the cold ones are a prefix
+        count = data["game_results"].rows_before(cutoff, self.batch_size)
+        if count:
+            self.store.archive_game_results(count, now.isoformat())
+        return count
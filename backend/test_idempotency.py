@@ -0,0 +1,68 @@
+"""
+Idempotent game result submission over HTTP: a resubmitted idempotency key
+returns the stored result instead of recording the game again, on both
+backends, keys longer than the 64 characters the SQL column holds are
+rejected by both, and a concurrent duplicate on the SQL backend is not a 500.
+
+Run with ``python -m pytest test_idempotency.py``.
+"""
+
+import itertools
+
+import crud
+import database
+
+_users = itertools.count(100)
+
+
+def _game(user_id, key):
+    return {"user_id": user_id, "status": "win", "difficulty": "relaxed", "idempotency_key": key}
+
+
+def _batch(client, *games):
+    response = client.post("/game-results/batch", json=list(games))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_resubmitted_key_returns_the_stored_result(client):
+    user_id = next(_users)
+    first, repeat = _batch(client, _game(user_id, "k1"), _game(user_id, "k1"))
+    assert not first["duplicate"] and repeat["duplicate"]
+    assert repeat["id"] == first["id"]
+    assert repeat["promo_code"] == first["promo_code"] is not None
+
+    # Resubmitted later, e.g. after a lost response
+    (again,) = _batch(client, _game(user_id, "k1"))
+    assert again["duplicate"] and again["id"] == first["id"]
+    assert client.get(f"/user/{user_id}/stats").json()["wins"] == 1
+
+    # Keys are per user
+    (other,) = _batch(client, _game(next(_users), "k1"))
+    assert not other["duplicate"] and other["id"] != first["id"]
+
+
+def test_concurrent_duplicate_key_returns_the_other_result(sql_client, monkeypatch):
+    user_id = next(_users)
+    ensure_users = crud._ensure_users
+    stored = []
+
+    async def racing_ensure_users(db, items):
+        # Another request stores the same key between the lookup and the insert
+        if not stored:
+            stored.append(None)
+            async with database.SessionLocal() as other:
+                stored[0] = (await crud.create_game_results_batch(other, items))[0]
+        await ensure_users(db, items)
+
+    monkeypatch.setattr(crud, "_ensure_users", racing_ensure_users)
+    (result,) = _batch(sql_client, _game(user_id, "race"))
+    assert result["duplicate"]
+    assert result["id"] == stored[0]["id"]
+    assert result["promo_code"] == stored[0]["promo_code"]
+    assert sql_client.get(f"/user/{user_id}/stats").json()["wins"] == 1
+
+
+def test_overlong_key_is_rejected(client):
+    response = client.post("/game-result", json=_game(next(_users), "k" * 65))
+    assert response.status_code == 422
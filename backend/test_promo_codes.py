@@ -0,0 +1,39 @@
+"""
+Promo code redemption over HTTP, against the SQL backend (main.py) and the
+JSON file backend (simple_backend.py); both must answer the same way.
+
+Run with ``python -m pytest test_promo_codes.py``.
+"""
+
+OWNER = 7000000123
+OTHER = 2
+
+
+def _promo_code(client):
+    response = client.post("/game-result", json={"user_id": OWNER, "status": "win", "difficulty": "master"})
+    assert response.status_code == 200
+    return response.json()["promo_code"]
+
+
+def _redeem(client, code, user_id):
+    response = client.post("/promo-code/validate", json={"code": code, "user_id": user_id})
+    return response.status_code, response.json()
+
+
+def test_owner_redeems_once(client):
+    code = _promo_code(client)
+    status_code, body = _redeem(client, code, OWNER)
+    assert status_code == 200
+    assert body["code"] == code and body["is_valid"]
+    assert _redeem(client, code, OWNER) == (400, {"detail": "Promo code already used"})
+
+
+def test_code_of_another_user(client):
+    code = _promo_code(client)
+    assert _redeem(client, code, OTHER) == (403, {"detail": "Promo code belongs to another user"})
+    # Still redeemable by its owner
+    assert _redeem(client, code, OWNER)[0] == 200
+
+
+def test_unknown_code(client):
+    assert _redeem(client, "ZZZZZ", OWNER) == (404, {"detail": "Invalid promo code"})
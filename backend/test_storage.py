@@ -0,0 +1,120 @@
+"""
+Crash recovery of the JSON file store (storage.py): log replay over the
+snapshot, torn log tails and a crash in the middle of a compaction, plus the
+favorite difficulty kept by its user index.
+
+Run with ``python -m pytest test_storage.py``.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+from storage import DataStore
+
+
+class Crash(Exception):
+    """Stands in for the process dying at a given point"""
+
+
+def _game(store, user_id, status="win", difficulty="master"):
+    def operation(data):
+        if str(user_id) not in data["users"]:
+            store.add_user({"id": user_id, "username": f"u{user_id}", "created_at": "2026-10-01T00:00:00"})
+        game_result = {
+            "id": store.next_game_result_id(),
+            "user_id": user_id,
+            "status": status,
+            "difficulty": difficulty,
+            "created_at": "2026-10-01T00:00:00",
+        }
+        store.add_game_result(game_result)
+        return game_result
+    return operation
+
+
+def _submit(store, *operations):
+    outcomes = asyncio.run(store.apply_batch(list(operations)))
+    for _, error in outcomes:
+        if error is not None:
+            raise error
+    return [result for result, _ in outcomes]
+
+
+def _reloaded(store):
+    fresh = DataStore(store.data_file, compact_every=store.compact_every, snapshot_format=store.snapshot_format)
+    fresh.load()
+    return fresh
+
+
+def _ids(store):
+    return list(store.data["game_results"]._ids)
+
+
+@pytest.fixture(params=["json", "binary"])
+def store(request, tmp_path):
+    store = DataStore(str(tmp_path / "game_data.json"), compact_every=1000, snapshot_format=request.param)
+    store.load()
+    yield store
+    store._executor.shutdown()
+
+
+def test_log_is_replayed_over_the_snapshot(store):
+    _submit(store, _game(store, 1), _game(store, 2, "loss"))
+    asyncio.run(store.compact())
+    _submit(store, _game(store, 1))
+
+    fresh = _reloaded(store)
+    assert _ids(fresh) == [1, 2, 3]
+    assert fresh.user_index.get(1)["win"] == 2
+    assert fresh.leaderboard.top(10) == [(1, 2)]
+
+
+def test_torn_log_tail_is_ignored_and_dropped(store):
+    _submit(store, _game(store, 1))
+    with open(store.log_file, "ab") as f:
+        f.write(b'{"op": "game_result", "game_res')
+
+    fresh = _reloaded(store)
+    assert _ids(fresh) == [1]
+    _submit(fresh, _game(fresh, 1))
+    assert _ids(_reloaded(fresh)) == [1, 2]
+
+
+def test_crash_between_snapshot_replace_and_log_reset(store, monkeypatch):
+    _submit(store, _game(store, 1), _game(store, 2))
+    store.archive_game_results(1, "2026-10-02T00:00:00")
+    asyncio.run(store._write_pending())
+
+    # Dies right after the new snapshot is renamed into place, before the log is reset
+    def crash():
+        raise Crash()
+    monkeypatch.setattr(store, "_fsync_dir", crash)
+    with pytest.raises(Crash):
+        asyncio.run(store.compact())
+    assert os.path.getsize(store.log_file) > 0
+
+    fresh = _reloaded(store)
+    assert _ids(fresh) == [2]
+    assert fresh.history.rows == 1
+    assert fresh.user_index.get(1)["win"] == 1
+    assert fresh.user_index.get(2)["win"] == 1
+
+    # Writes after the crash start the log over instead of appending to the stale one
+    _submit(fresh, _game(fresh, 1))
+    again = _reloaded(fresh)
+    assert _ids(again) == [2, 3]
+    assert again.user_index.get(1)["win"] == 2
+    assert again.leaderboard.top(10) == [(1, 2), (2, 1)]
+
+
+
+def test_favorite_difficulty_ties_go_to_the_easier_difficulty(store):
+    # Master is played first, but relaxed has as many games
+    _submit(store, _game(store, 1, difficulty="master"), _game(store, 1, difficulty="relaxed"))
+    assert store.user_index.favorite_difficulty(1) == "relaxed"
+    _submit(store, _game(store, 1, difficulty="master"))
+    assert store.user_index.favorite_difficulty(1) == "master"
+    _submit(store, _game(store, 1, difficulty="strategic"), _game(store, 1, difficulty="strategic"))
+    assert _reloaded(store).user_index.favorite_difficulty(1) == "strategic"
@@ -0,0 +1,97 @@
+"""
+Concurrent searches on the larger boards (variants.py).
+
+Run with ``python -m pytest test_variants.py`` or ``python test_variants.py``.
+"""
+
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import variants
+
+THREADS = 8
+
+
+def setup_module():
+    # Switch threads far more often than the default 5 ms, so that searches
+    # interleave mid-search
+    global _switch_interval
+    _switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+
+def teardown_module():
+    sys.setswitchinterval(_switch_interval)
+
+
+def _positions(name, count, seed=0):
+    """(variant, diamonds, rings) after a few random moves, game still on"""
+    variant = variants.VARIANTS[name]
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        diamonds = rings = 0
+        for ply in range(rng.randrange(2, 7)):
+            empty = [cell for cell in range(variant.cells) if not (diamonds | rings) >> cell & 1]
+            if ply % 2:
+                rings |= 1 << rng.choice(empty)
+            else:
+                diamonds |= 1 << rng.choice(empty)
+        if variant.winner(diamonds, rings) is None:
+            positions.append((name, diamonds, rings))
+    return positions
+
+
+def _search(position, seed):
+    name, diamonds, rings = position
+    search = variants.search_for(name)
+    search.clear()
+    return search.best_move(diamonds, rings, 3, None, random.Random(seed))
+
+
+def test_search_for_is_per_thread():
+    own = variants.search_for("4x4")
+    assert variants.search_for("4x4") is own
+    with ThreadPoolExecutor(1) as executor:
+        other = executor.submit(variants.search_for, "4x4").result()
+    assert other is not own
+    assert other.variant is own.variant
+
+
+def test_concurrent_searches_match_sequential():
+    positions = _positions("4x4", 24) + _positions("5x5", 24)
+    expected = [_search(position, seed) for seed, position in enumerate(positions)]
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(_search, positions, range(len(positions))))
+    assert results == expected
+
+
+def test_concurrent_timed_searches_keep_their_deadline():
+    positions = _positions("5x5", THREADS * 2, seed=1)
+    # Short and long budgets side by side, so a borrowed deadline shows
+    budgets = [0.02 if index % 2 else 0.5 for index in range(len(positions))]
+
+    def timed(position, seconds):
+        name, diamonds, rings = position
+        started = time.perf_counter()
+        cell, _, depth = variants.search_for(name).best_move(diamonds, rings, None, seconds)
+        return cell, depth, time.perf_counter() - started
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(timed, positions, budgets))
+    for (_, diamonds, rings), seconds, (cell, depth, elapsed) in zip(positions, budgets, results):
+        assert not (diamonds | rings) >> cell & 1
+        assert depth >= 1
+        # The deadline is checked every 256 nodes of the search
+        assert elapsed < seconds + 0.2
+
+
+if __name__ == "__main__":
+    setup_module()
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
+    teardown_module()
@@ -0,0 +1,368 @@
+"""
+Search engine for larger boards: N×N with K in a row.
+
+engine.py solves the 3×3 game completely at import; from 4×4 up the game tree
+is far too big for that. A Variant describes a board (size and win length)
+and a Search looks for moves on it with:
+
+- bitboards: each side's marks are one int with bit ``row * size + col``.
+  Every run of K cells in a row, column or diagonal is a line mask, and one
+  pass over the line masks finds the cells that win at once for either side
+  and scores the position;
+- negamax with alpha-beta pruning. An immediate win is taken at once, a
+  single opposing threat forces the block, and other moves are tried
+  transposition-table move first, then by how many lines run through the
+  cell (centre first);
+- iterative deepening: depth 1, 2, ... until the depth limit, a decided
+  result or the time budget runs out, keeping the best move of the last
+  finished depth;
+- a transposition table keyed by Zobrist hashes (a random 64-bit key per
+  side and cell, XORed in as moves are made): a bounded LRU, kept across
+  the moves and games of one Search.
+
+Positions are scored for the side to move: 10 ** (marks - 1) for every line
+only it occupies, minus the same for the opponent's lines. A win scores
+WIN_SCORE plus the number of empty cells left, so quicker wins rank higher
+and a score does not depend on the path to its position.
+
+DIFFICULTY_LIMITS maps every DifficultyLevel to a depth limit and a time
+budget per move. A search runs on the calling thread for up to its budget,
+so async callers should hand it to an executor. A Search keeps its deadline,
+counters and table on itself and must not be shared between threads;
+``search_for`` gives every thread its own. Running this module prints how
+deep each variant gets within those limits.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Search limits per difficulty: (depth limit in plies or None, seconds per move or None)
+DIFFICULTY_LIMITS = {
+    "relaxed": (1, None),
+    "strategic": (3, None),
+    "master": (None, float(os.getenv("SEARCH_MASTER_SECONDS", 0.2))),
+}
+
+# Default budget of each Search's transposition table (one per variant and thread)
+SEARCH_TT_BYTES = int(os.getenv("SEARCH_TT_BYTES", 8 << 20))
+
+# Estimated bytes per transposition table entry (dict slot, 64-bit key, tuple)
+TT_ENTRY_BYTES = 200
+
+WIN_SCORE = 1_000_000
+
+# Transposition table bounds
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class Variant:
+    """Board geometry and the masks and keys derived from it"""
+
+    def __init__(self, size, win_length, seed=0):
+        if not 3 <= win_length <= size:
+            raise ValueError(f"Win length must be between 3 and {size}, not {win_length}")
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.full_mask = (1 << self.cells) - 1
+        self.lines = tuple(self._lines())
+        # Cells through which most lines run first
+        line_counts = [sum(1 for line in self.lines if line >> cell & 1) for cell in range(self.cells)]
+        self.move_order = tuple(sorted(range(self.cells), key=lambda cell: (-line_counts[cell], cell)))
+        self.line_counts = tuple(line_counts)
+        # Line scores by number of marks
+        self.weights = (0,) + tuple(10 ** (marks - 1) for marks in range(1, win_length + 1))
+        rng = random.Random(seed)
+        self.zobrist = tuple(tuple(rng.getrandbits(64) for _ in range(self.cells)) for _ in range(2))
+
+    def __repr__(self):
+        return f"Variant({self.size}, {self.win_length})"
+
+    def _lines(self):
+        size, length = self.size, self.win_length
+        for row in range(size):
+            for col in range(size):
+                for row_step, col_step in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    last_row = row + row_step * (length - 1)
+                    last_col = col + col_step * (length - 1)
+                    if 0 <= last_row < size and 0 <= last_col < size:
+                        yield sum(
+                            1 << (row + row_step * i) * size + col + col_step * i
+                            for i in range(length)
+                        )
+
+    def winner(self, diamonds, rings):
+        """Winner of a position: "diamond", "ring", "draw", or None while the game is on"""
+        for line in self.lines:
+            if diamonds & line == line:
+                return "diamond"
+            if rings & line == line:
+                return "ring"
+        return "draw" if diamonds | rings == self.full_mask else None
+
+    def zobrist_hash(self, diamonds, rings):
+        key = 0
+        for cell in range(self.cells):
+            if diamonds >> cell & 1:
+                key ^= self.zobrist[0][cell]
+            elif rings >> cell & 1:
+                key ^= self.zobrist[1][cell]
+        return key
+
+
+# Boards offered besides the 3×3 game of engine.py
+VARIANTS = {
+    "3x3": Variant(3, 3),
+    "4x4": Variant(4, 4),
+    "5x5": Variant(5, 4),
+}
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _popcount(mask):
+    return bin(mask).count("1")
+
+
+class Search:
+    """Alpha-beta searcher for one variant, with its own transposition table; not thread-safe"""
+
+    def __init__(self, variant, max_bytes=SEARCH_TT_BYTES):
+        self.variant = variant
+        self.max_bytes = max_bytes
+        self.max_entries = max(1, max_bytes // TT_ENTRY_BYTES)
+        self._table = OrderedDict()   # Zobrist hash -> (depth, score, bound, best cell)
+        self._deadline = None
+        self.searches = 0
+        self.nodes = 0
+        self.probes = 0
+        self.hits = 0
+        self.evictions = 0
+        self.timeouts = 0
+        self.last_depth = 0
+
+    def choose_move(self, diamonds, rings, difficulty, rng=random):
+        """Move for the side to move, searched within the limits of ``difficulty``"""
+        max_depth, seconds = DIFFICULTY_LIMITS[difficulty]
+        return self.best_move(diamonds, rings, max_depth, seconds, rng)[0]
+
+    def best_move(self, diamonds, rings, max_depth=None, seconds=None, rng=random):
+        """
+        (cell, score for the side to move, depth searched) for a position
+        given as bitboards. Searches one ply deeper at a time until
+        ``max_depth`` (default: the end of the game), a decided result or
+        ``seconds`` run out; depth 1 always finishes. Equally ranked cells
+        are tried in random order, so equal moves vary between games.
+        """
+        variant = self.variant
+        if diamonds & rings or (diamonds | rings) & ~variant.full_mask:
+            raise ValueError("Overlapping or out-of-range bitboards")
+        if variant.winner(diamonds, rings) is not None:
+            raise ValueError("The game is over")
+        side = 0 if _popcount(diamonds) == _popcount(rings) else 1
+        own, other = (diamonds, rings) if side == 0 else (rings, diamonds)
+        empty = variant.full_mask & ~(diamonds | rings)
+        remaining = _popcount(empty)
+        max_depth = remaining if max_depth is None else min(max_depth, remaining)
+
+        self.searches += 1
+        key = variant.zobrist_hash(diamonds, rings)
+        counts = variant.line_counts
+        moves = sorted(
+            (cell for cell in range(variant.cells) if empty >> cell & 1),
+            key=lambda cell: (-counts[cell], rng.random())
+        )
+        best = (moves[0], 0, 0)
+        started = time.perf_counter()
+        for depth in range(1, max_depth + 1):
+            self._deadline = started + seconds if seconds is not None and depth > 1 else None
+            try:
+                score, cell = self._root(own, other, key, side, moves, depth)
+            except _Timeout:
+                self.timeouts += 1
+                break
+            best = (cell, score, depth)
+            # The best move is searched first at the next depth
+            moves.remove(cell)
+            moves.insert(0, cell)
+            if abs(score) >= WIN_SCORE:
+                break
+        self.last_depth = best[2]
+        return best
+
+    def clear(self):
+        self._table.clear()
+
+    def stats(self):
+        return {
+            "variant": f"{self.variant.size}x{self.variant.size}/{self.variant.win_length}",
+            "entries": len(self._table),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "searches": self.searches,
+            "nodes": self.nodes,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.probes, 4) if self.probes else 0.0,
+            "evictions": self.evictions,
+            "timeouts": self.timeouts,
+            "last_depth": self.last_depth,
+        }
+
+    def _scan(self, own, other):
+        """
+        One pass over the lines: (score for ``own``, cells where ``own`` wins
+        at once, cells where ``other`` does, whether any line is still open)
+        """
+        weights = self.variant.weights
+        score = own_wins = other_wins = 0
+        live = False
+        for line in self.variant.lines:
+            mine = own & line
+            theirs = other & line
+            if theirs:
+                if not mine:
+                    live = True
+                    rest = line ^ theirs
+                    if not rest & (rest - 1):
+                        other_wins |= rest
+                    score -= weights[_popcount(theirs)]
+            elif mine:
+                live = True
+                rest = line ^ mine
+                if not rest & (rest - 1):
+                    own_wins |= rest
+                score += weights[_popcount(mine)]
+            else:
+                live = True
+        return score, own_wins, other_wins, live
+
+    def _root(self, own, other, key, side, moves, depth):
+        empty = self.variant.full_mask & ~(own | other)
+        _, own_wins, other_wins, _ = self._scan(own, other)
+        if own_wins:
+            cell = next(cell for cell in moves if own_wins >> cell & 1)
+            return WIN_SCORE + _popcount(empty) - 1, cell
+        if other_wins:
+            moves = [cell for cell in moves if other_wins >> cell & 1][:1]
+        zobrist = self.variant.zobrist[side]
+        alpha, beta = -2 * WIN_SCORE, 2 * WIN_SCORE
+        best_cell = moves[0]
+        for cell in moves:
+            bit = 1 << cell
+            value = -self._negamax(other, own | bit, key ^ zobrist[cell], 1 - side, depth - 1, -beta, -alpha)
+            if value > alpha:
+                alpha, best_cell = value, cell
+        return alpha, best_cell
+
+    def _negamax(self, own, other, key, side, depth, alpha, beta):
+        self.nodes += 1
+        if self._deadline is not None and not self.nodes & 255 and time.perf_counter() > self._deadline:
+            raise _Timeout()
+        variant = self.variant
+        empty = variant.full_mask & ~(own | other)
+        if not empty:
+            return 0
+        score, own_wins, other_wins, live = self._scan(own, other)
+        remaining = _popcount(empty)
+        if own_wins:
+            return WIN_SCORE + remaining - 1
+        if not live:
+            return 0
+        if other_wins & (other_wins - 1) and remaining > 1:
+            # Two threats: one of them is played next move
+            return -(WIN_SCORE + remaining - 2)
+        if depth <= 0:
+            return score
+
+        self.probes += 1
+        table = self._table
+        entry = table.get(key)
+        table_move = None
+        if entry is not None:
+            self.hits += 1
+            table.move_to_end(key)
+            entry_depth, entry_score, bound, table_move = entry
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return entry_score
+                if bound == LOWER:
+                    alpha = max(alpha, entry_score)
+                else:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+
+        if other_wins:
+            moves = (other_wins.bit_length() - 1,)
+        else:
+            moves = [cell for cell in variant.move_order if empty >> cell & 1]
+            if table_move is not None and empty >> table_move & 1:
+                moves.remove(table_move)
+                moves.insert(0, table_move)
+
+        zobrist = variant.zobrist[side]
+        original_alpha = alpha
+        best_score, best_cell = -2 * WIN_SCORE, moves[0]
+        for cell in moves:
+            value = -self._negamax(other, own | 1 << cell, key ^ zobrist[cell], 1 - side, depth - 1, -beta, -alpha)
+            if value > best_score:
+                best_score, best_cell = value, cell
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        table[key] = (depth, best_score, bound, best_cell)
+        if len(table) > self.max_entries:
+            table.popitem(last=False)
+            self.evictions += 1
+        return best_score
+
+
+# One Search per variant and thread, created on first use
+_local = threading.local()
+
+
+def search_for(variant):
+    """The calling thread's Search of a VARIANTS key"""
+    searches = getattr(_local, "searches", None)
+    if searches is None:
+        searches = _local.searches = {}
+    search = searches.get(variant)
+    if search is None:
+        search = searches[variant] = Search(VARIANTS[variant])
+    return search
+
+
+def choose_move(variant, diamonds, rings, difficulty, rng=random):
+    """Move for the ``difficulty`` AI in a position of a VARIANTS key, given as bitboards"""
+    return search_for(variant).choose_move(diamonds, rings, difficulty, rng)
+
+
+def benchmark(seed=0):
+    """Per variant and difficulty: seconds for the opening move and the depth reached"""
+    results = {}
+    for name, variant in VARIANTS.items():
+        for difficulty in DIFFICULTY_LIMITS:
+            search = Search(variant)
+            started = time.perf_counter()
+            search.choose_move(0, 0, difficulty, random.Random(seed))
+            elapsed = time.perf_counter() - started
+            results[name, difficulty] = (elapsed, search.last_depth, search.nodes)
+    return results
+
+
+if __name__ == "__main__":
+    for (name, difficulty), (elapsed, depth, nodes) in benchmark().items():
+        print(f"{name} {difficulty}: depth {depth}, {nodes} nodes in {elapsed * 1000:.1f} ms")